@@ -1,3 +1,4 @@
+import os
 import logging
 import configparser
 
@@ -8,9 +9,40 @@ def read_config(args):
     config = configparser.ConfigParser()
     config.read(args.config)
 
+    # Relative paths in the config file are relative to the directory
+    # containing the config file
+    config_dir = os.path.dirname(os.path.abspath(args.config))
+    def _path(section, option, fallback=''):
+        value = config.get(section, option, fallback=fallback)
+        if not value:
+            return None
+        return os.path.join(config_dir, value)
+
     past_days = config.getint('General', 'days_to_schedule_in_the_past')
     future_days = config.getint('General', 'days_to_schedule_in_the_future')
 
+    # How far back-to-back events with the same status may be
+    # coalesced into a single event: "none", "day" (within a single day
+    # in the door's timezone), or a number of hours
+    text = config.get('General', 'coalesce_span', fallback='day').strip().lower()
+    if text == 'none':
+        coalesce_span = None
+    elif text == 'day':
+        coalesce_span = 'day'
+    else:
+        try:
+            coalesce_span = int(float(text) * 3600)
+        except ValueError:
+            logging.error(f"Invalid coalesce_span in config file: {text}")
+            logging.error("Cannot continue")
+            exit(1)
+
+    rebuild_mode = config.get('Google', 'rebuild_mode', fallback='none').strip().lower()
+    if rebuild_mode not in ('none', 'clear', 'swap'):
+        logging.error(f"Invalid rebuild_mode in config file: {rebuild_mode}")
+        logging.error("Cannot continue")
+        exit(1)
+
     today = date.today()
     first_date = today - timedelta(days=past_days)
     last_date = today + timedelta(days=future_days)
@@ -20,19 +52,37 @@ def read_config(args):
         'first date' : first_date,
         'last date' : last_date,
         'send emails': config.getboolean('General', 'send_emails'),
+        'state dir': _path('General', 'state_dir'),
+        'coalesce span': coalesce_span,
 
         # Google
         'color unlocked': config.getint('Google', 'color_unlocked'),
         'color locked': config.getint('Google', 'color_locked'),
         'color access_controlled': config.getint('Google', 'color_access_controlled'),
         'color card_and_code': config.getint('Google', 'color_card_and_code'),
+        'google download max shards': config.getint('Google', 'download_max_shards', fallback=8),
+        'google download events per shard': config.getint('Google', 'download_events_per_shard', fallback=5000),
+        'google batch size': config.getint('Google', 'batch_size', fallback=50),
+        'rebuild mode': None if rebuild_mode == 'none' else rebuild_mode,
+        'rebuild diff ratio': config.getfloat('Google', 'rebuild_diff_ratio', fallback=0.9),
+        'api budget': config.getint('Google', 'api_budget', fallback=0),
+        'apply time limit': config.getfloat('Google', 'apply_time_limit_seconds', fallback=0),
 
         # Email
         'sender': config.get('Email', 'sender'),
         'recipient' : config.get('Email', 'recipient'),
         'subject': config.get('Email', 'subject'),
         'body': config.get('Email', 'body'),
-        'logo path': config.get('Email', 'logo_path'),
+        'logo path': _path('Email', 'logo_path'),
+        'template path': _path('Email', 'template_path',
+                               fallback='email-template.html'),
+        'smtp server': config.get('Email', 'smtp_server', fallback='smtp.gmail.com'),
+        'smtp port': config.getint('Email', 'smtp_port', fallback=587),
+        'smtp starttls': config.getboolean('Email', 'smtp_starttls', fallback=True),
+        'smtp auth': config.getboolean('Email', 'smtp_auth', fallback=True),
+        'smtp username': config.get('Email', 'smtp_username', fallback='') or \
+            config.get('Email', 'sender'),
+        'digest interval minutes': config.getint('Email', 'digest_interval_minutes', fallback=0),
     }
 
     return config_values
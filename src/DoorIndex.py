@@ -0,0 +1,106 @@
+import logging
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import Snapshot
+import TimeZones
+
+# A per-door sorted interval index of the merged Verkada timelines
+# (i.e., the output of Verkada.merge_data()), for answering "what state
+# is door X in at time T / over this range" without going to the
+# Google Calendar.
+#
+# The index is backed by the merged schedule snapshot that the sync
+# writes to the state directory (see Snapshot.py): each door's events
+# are sorted and do not overlap, and are stored in columnar arrays
+# (start epochs, end epochs, and statuses) that are used directly from
+# the mmap.  A point query is a single bisect, and a range query is a
+# bisect plus the overlapping intervals, i.e., O(log n) per door.  Site
+# queries run the door query on each door at the site.
+#
+# See doorStatus.py for a CLI and HTTP front end.
+
+# Accept either UTC epoch seconds or a timezone-aware datetime
+def _epoch(when):
+    if isinstance(when, datetime):
+        return int(when.timestamp())
+    return int(when)
+
+class DoorIndex:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # The [first, last) window that was synchronized (the union of
+        # the doors' local date ranges); outside of it, the state of the
+        # doors is unknown
+        self.first_epoch = snapshot.first_epoch
+        self.last_epoch = snapshot.last_epoch
+        self.doors = snapshot.door_ids
+
+        self.sites = {}
+        for name, i in sorted(self.doors.items()):
+            site = snapshot.sites[i]
+            if site is not None:
+                self.sites.setdefault(site, []).append(name)
+
+    def close(self):
+        self.snapshot.close()
+
+    def _interval(self, name, i, j):
+        snapshot = self.snapshot
+        tz = TimeZones.lookup(snapshot.time_zones[i])
+        return {
+            'door': name,
+            'door_status': snapshot.status_names[snapshot.statuses[j]],
+            'start': datetime.fromtimestamp(snapshot.starts[j], tz),
+            'end': datetime.fromtimestamp(snapshot.ends[j], tz),
+        }
+
+    # The range of door "name"'s intervals in the snapshot arrays
+    def _door(self, name):
+        if name not in self.doors:
+            raise KeyError(f"Unknown door: {name}")
+        i = self.doors[name]
+        offsets = self.snapshot.door_offsets
+        return i, offsets[i], offsets[i + 1]
+
+    def _site(self, site):
+        if site not in self.sites:
+            raise KeyError(f"Unknown site: {site}")
+        return self.sites[site]
+
+    # The interval that door "name" is in at time "when", or None if
+    # the door has no scheduled status at that time
+    def status_at(self, name, when):
+        i, lo, hi = self._door(name)
+        when = _epoch(when)
+
+        # The last interval starting at or before "when"
+        j = bisect_right(self.snapshot.starts, when, lo, hi) - 1
+        if j < lo or when >= self.snapshot.ends[j]:
+            return None
+        return self._interval(name, i, j)
+
+    # All the intervals of door "name" that overlap [start, end)
+    def statuses_between(self, name, start, end):
+        i, lo, hi = self._door(name)
+        start = _epoch(start)
+        end = _epoch(end)
+
+        # Intervals do not overlap, so their ends are sorted too
+        first = bisect_right(self.snapshot.ends, start, lo, hi)
+        last = bisect_left(self.snapshot.starts, end, lo, hi)
+        return [self._interval(name, i, j) for j in range(first, last)]
+
+    def site_status_at(self, site, when):
+        return {name: self.status_at(name, when)
+                for name in self._site(site)}
+
+    def site_statuses_between(self, site, start, end):
+        return {name: self.statuses_between(name, start, end)
+                for name in self._site(site)}
+
+def load(config):
+    filename = Snapshot.filename(config)
+    logging.info(f"Loading door index from {filename}")
+    return DoorIndex(Snapshot.load(filename))
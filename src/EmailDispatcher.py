@@ -1,96 +1,297 @@
 import os
+import json
+import time
+import queue
+import html
 import logging
 import smtplib
-import datetime
-import ConfigCreator
+import threading
 
-# TODO Do we really need multiprocessing?
-from multiprocessing import Process
+from string import Template
+from collections import defaultdict
+from datetime import datetime, timezone
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 
-# TODO Get this from config.ini
-subject = "Notice of Schedule Change"
-# TODO Get this from config.ini
-text = "The door schedule has been changed"
-# TODO Get this from config.ini
-sender = "yinzstudio@gmail.com"
-recipients = ConfigCreator.read_config()['mailinglist'].split(" ")
-imagepath = ConfigCreator.read_config()['emailimagepath']
-
-# TODO Get this from args
-password = os.environ.get("GMAIL")
-
-def send_email(subject, body, sender, recipients, password):
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = ', '.join(recipients)
+import Log
+
+# Email notifications of the changes made to the Google Calendar.
+#
+# The changes from main.compare() are summarized per door into a
+# single digest email per run (or, if configured, per time window
+# across multiple runs).  The HTML template and logo are read from
+# disk only once, and emails are sent from a background thread over a
+# single persistent SMTP connection so that sending never blocks the
+# synchronization.
+
+# Stored in the state directory when digests span multiple runs
+_spool_filename = 'email-digest-spool.json'
+
+_time_format = "%a %m/%d/%Y %H:%M %Z"
+
+_queue = None
+_worker = None
+_template = None
+_logo = None
+
+#-----------------------------------------------------------------
+
+class _Sender:
+    def __init__(self, config, password):
+        self.config = config
+        self.password = password
+        self.smtp = None
+        self.sent = 0
+
+    def _connect(self):
+        config = self.config
+        logging.info(f"Connecting to SMTP server {config['smtp server']}:{config['smtp port']}")
+        smtp = smtplib.SMTP(config['smtp server'], config['smtp port'])
+        smtp.ehlo()
+        if config['smtp starttls']:
+            smtp.starttls()
+            smtp.ehlo()
+        if config['smtp auth']:
+            smtp.login(config['smtp username'], self.password)
+        self.smtp = smtp
+
+    def send(self, msg, recipients):
+        # Reuse the connection; if the server dropped it (e.g., due to
+        # an idle timeout), reconnect once and try again.
+        for attempt in range(2):
+            if self.smtp is None:
+                self._connect()
+            try:
+                self.smtp.sendmail(self.config['sender'], recipients, msg.as_string())
+                self.sent += 1
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self.smtp = None
+
+def _run_worker(config, password, work_queue):
+    sender = _Sender(config, password)
+    while True:
+        item = work_queue.get()
+        if item is None:
+            work_queue.task_done()
+            break
+
+        msg, recipients, on_sent = item
+        try:
+            sender.send(msg, recipients)
+            logging.info(f"Sent email: {msg['Subject']}")
+            if on_sent:
+                on_sent()
+        except (smtplib.SMTPException, OSError) as e:
+            logging.error(f"Failed to send email: {e}")
+        work_queue.task_done()
+
+    sender.close()
+    logging.info(f"Email dispatcher sent {sender.sent} emails")
+
+# Read the template and logo (once), and start the background sender.
+# If emails cannot be sent with this config (e.g., the template is
+# missing, or there is no SMTP password), log why and don't send any:
+# the synchronization itself should still run.
+def start(args, config):
+    global _queue
+    global _worker
+    global _template
+    global _logo
+
+    if not config['send emails']:
+        return
+
+    if not config['smtp server']:
+        logging.error("send_emails is True, but smtp_server is not set; not sending emails")
+        return
+    if config['smtp auth'] and not args.smtp_password:
+        logging.error("send_emails is True, but there is no SMTP password (set SMTP_PASSWORD, or smtp_auth = False for a server that does not require logging in); not sending emails")
+        return
 
-    text = body
-    html = ""
     try:
-        # TODO Do not use hard-coded names
-        with open("email.html") as email:
-            html = email.read()
-    except FileNotFoundError:
-        # TODO Better error message, and abort!
-        logging.log("html email not included")
-    part1 = MIMEText(text, 'plain')
-    part2 = MIMEText(html, 'html')
-    msg.attach(part1)
-    msg.attach(part2)
-
-    with open(imagepath, 'rb') as image_file:
-        image_data = image_file.read()
-        # TODO Get logo from config file
-        image = MIMEImage(image_data, name=os.path.basename("mercylogo.png"))
+        with open(config['template path']) as fp:
+            _template = Template(fp.read())
+    except OSError as e:
+        logging.error(f"Cannot read email template; not sending emails: {e}")
+        return
+    if config['logo path']:
+        try:
+            with open(config['logo path'], 'rb') as fp:
+                _logo = fp.read()
+        except OSError as e:
+            logging.warning(f"Cannot read email logo; sending emails without it: {e}")
+
+    _queue = queue.Queue()
+    _worker = threading.Thread(target=_run_worker,
+                               args=(config, args.smtp_password, _queue),
+                               name='EmailDispatcher',
+                               daemon=True)
+    _worker.start()
+
+# Wait for all queued emails to be sent, and close the SMTP connection
+def close():
+    global _queue
+    global _worker
+
+    if _worker is None:
+        return
+
+    _queue.put(None)
+    _worker.join()
+    _queue = None
+    _worker = None
+
+#-----------------------------------------------------------------
+
+def _format_time(epoch, dt):
+    if dt is None:
+        dt = datetime.fromtimestamp(epoch, timezone.utc)
+    return dt.strftime(_time_format)
+
+# Summarize the results of main.compare() as a list of change records
+def _changes_from_diff(to_delete, to_add):
+    changes = []
+    for event in to_delete:
+        changes.append({
+            'door': event.get('summary', ''),
+            'change': 'removed',
+            'door_status': event.get('description', ''),
+            'start_epoch': event['start_epoch'],
+            'end_epoch': event['end_epoch'],
+            'start': _format_time(event['start_epoch'], event.get('start')),
+            'end': _format_time(event['end_epoch'], event.get('end')),
+        })
+    for event in to_add:
+        changes.append({
+            'door': event['name'],
+            'change': 'added',
+            'door_status': event['door_status'],
+            'start_epoch': event['start_epoch'],
+            'end_epoch': event['end_epoch'],
+            'start': _format_time(event['start_epoch'], event.get('start_time')),
+            'end': _format_time(event['end_epoch'], event.get('end_time')),
+        })
+    return changes
+
+def _group_by_door(changes):
+    doors = defaultdict(list)
+    for change in changes:
+        doors[change['door']].append(change)
+    for door_changes in doors.values():
+        door_changes.sort(key=lambda x: (x['start_epoch'], x['change']))
+    return dict(sorted(doors.items()))
+
+def _render_text(config, doors):
+    lines = [config['body'], '']
+    for door, door_changes in doors.items():
+        lines.append(f"{door}:")
+        for change in door_changes:
+            lines.append(f"  {change['change']}: {change['door_status']} "
+                         f"from {change['start']} to {change['end']}")
+        lines.append('')
+    return '\n'.join(lines)
+
+def _render_html(doors):
+    parts = []
+    for door, door_changes in doors.items():
+        parts.append(f"<p><b>{html.escape(door)}</b></p><ul>")
+        for change in door_changes:
+            parts.append(f"<li>{html.escape(change['change'])}: "
+                         f"{html.escape(change['door_status'])} from "
+                         f"{html.escape(change['start'])} to "
+                         f"{html.escape(change['end'])}</li>")
+        parts.append("</ul>")
+    return _template.safe_substitute(changes='\n'.join(parts))
+
+def _build_message(config, changes):
+    doors = _group_by_door(changes)
+    recipients = config['recipient'].split()
+
+    msg = MIMEMultipart('related')
+    msg['Subject'] = f"{config['subject']} ({len(changes)} changes, {len(doors)} doors)"
+    msg['From'] = config['sender']
+    msg['To'] = ', '.join(recipients)
+
+    alternative = MIMEMultipart('alternative')
+    alternative.attach(MIMEText(_render_text(config, doors), 'plain'))
+    alternative.attach(MIMEText(_render_html(doors), 'html'))
+    msg.attach(alternative)
+
+    if _logo is not None:
+        image = MIMEImage(_logo, name=os.path.basename(config['logo path']))
         image.add_header('Content-ID', '<image1>')
         msg.attach(image)
 
-    with smtplib.SMTP('smtp.gmail.com', 587) as smtp_server:
-       smtp_server.ehlo()
-       smtp_server.starttls()
-       smtp_server.login(sender, password)
-       smtp_server.sendmail(sender, recipients, msg.as_string())
-       smtp_server.close()
-    # TODO Use logging
-    print("Message sent!")
-
-def emailfromdoorchange(doorname, originalschedule,newschedule):
-    Doorname = doorname
-    ogdoorstatus = originalschedule['door_status']
-    newdoorstatus = newschedule['door_status']
-    starttime = newschedule['start_time'].strftime("%m/%d/%Y, %H:%M:%S")
-    endtime = newschedule['end_time'].strftime("%m/%d/%Y, %H:%M:%S")
-
-    msgbody = f"The {Doorname} door has changed from being {ogdoorstatus} to {newdoorstatus} between the times of {starttime} and {endtime}. Changes are reflected in the calendar at https://calendar.google.com/calendar/u/0/r"
-    send_email(subject, msgbody, sender, recipients, password)
-
-def emailmultipledoorchange():
-    msgbody = "Multiple door schedules in your building have changed. The calendar is available at https://calendar.google.com/calendar/u/0/r."
-    send_email(subject,msgbody,sender,recipients,password)
-
-originalevent = {
-    'door_status': 'unlocked',
-    'start_time': datetime.datetime(2025, 3, 20, 17, 30),
-    'end_time': datetime.datetime(2025, 3, 20, 19, 0)
-}
-newevent = {
-    'door_status': 'access_controlled',
-    'start_time': datetime.datetime(2025, 3, 21, 16, 30),
-    'end_time': datetime.datetime(2025, 3, 21, 17, 30)
-}
-
-# TODO What is this?
-#emailfromdoorchange("Atrium",originalevent,newevent)
-
-# TODO Why is there a main?
-if __name__ == '__main__':
-    # TODO Why is there a single thread and then we just join?
-    # Just call the function directly.
-    p = Process(target=emailfromdoorchange, args=("Atrium",originalevent,newevent))
-    p.start()
-    p.join()
+    return msg, recipients
+
+#-----------------------------------------------------------------
+
+def _read_spool(filename):
+    if not os.path.exists(filename):
+        return {'first_change': None, 'changes': []}
+    with open(filename) as fp:
+        return json.load(fp)
+
+def _write_spool(filename, spool):
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as fp:
+        json.dump(spool, fp)
+    os.replace(tmp, filename)
+
+# Queue a digest of the changes from main.compare() to be sent in the
+# background.  If a digest interval is configured, changes are instead
+# collected in the state directory until the interval has passed since
+# the first unsent change.
+def notify(config, to_delete, to_add):
+    if _worker is None:
+        return
+
+    changes = _changes_from_diff(to_delete, to_add)
+    interval = config['digest interval minutes']
+    on_sent = None
+
+    if interval > 0 and config['state dir'] is None:
+        logging.warning("digest_interval_minutes is set, but state_dir is not; sending a digest for this run")
+        interval = 0
+
+    if interval > 0:
+        os.makedirs(config['state dir'], exist_ok=True)
+        filename = os.path.join(config['state dir'], _spool_filename)
+        spool = _read_spool(filename)
+        if changes and spool['first_change'] is None:
+            spool['first_change'] = time.time()
+        spool['changes'].extend(changes)
+        changes = spool['changes']
+
+        due = spool['first_change'] is not None and \
+            time.time() - spool['first_change'] >= interval * 60
+        if not due:
+            _write_spool(filename, spool)
+            Log.summary("Email digest", spooled=len(changes))
+            return
+
+        # Keep the spool until the digest has actually been sent, so
+        # that the changes are not lost if sending fails
+        _write_spool(filename, spool)
+        on_sent = lambda: _write_spool(filename, {'first_change': None, 'changes': []})
+
+    if not changes:
+        return
+
+    msg, recipients = _build_message(config, changes)
+    _queue.put((msg, recipients, on_sent))
+    Log.summary("Email digest", queued_changes=len(changes),
+                recipients=len(recipients))
@@ -1,79 +1,279 @@
 import os
+import json
 import logging
 
-from pprint import pformat
+from time import perf_counter, sleep
 from collections import defaultdict
 from datetime import datetime, timezone, timedelta, time
+from concurrent.futures import ThreadPoolExecutor
 
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+import Log
+import Metrics
+
+# Maximum number of attempts for a single Google API request that is
+# rate limited or hits a server error
+_max_attempts = 5
+
+# Stored in the state directory: the density of events seen by the
+# previous download, used to choose the download shards
+_state_basename = 'google-download-state.json'
+
+def _retryable(error):
+    status = error.resp.status
+    if status == 429 or status >= 500:
+        return True
+    # Google also reports some rate limiting as HTTP 403
+    content = error.content or b''
+    return status == 403 and (b'rateLimitExceeded' in content or
+                              b'userRateLimitExceeded' in content)
+
+# Execute a Google API request, recording metrics (including the
+# number of bytes received) and retrying with exponential backoff when
+# rate limited or on server errors.
+def _execute(request, endpoint):
+    received = []
+    postproc = request.postproc
+    def _measure(resp, content):
+        received.append(len(content or b''))
+        return postproc(resp, content)
+    request.postproc = _measure
+
+    delay = 1
+    for attempt in range(1, _max_attempts + 1):
+        start = perf_counter()
+        try:
+            result = request.execute()
+        except HttpError as e:
+            Metrics.api_call('google', endpoint, e.resp.status,
+                             perf_counter() - start,
+                             len(e.content or b''))
+            if not _retryable(e) or attempt == _max_attempts:
+                raise
+
+            logging.warning(f"Google API returned HTTP {e.resp.status} for {endpoint}; retrying in {delay} seconds")
+            Metrics.retry('google', endpoint)
+            sleep(delay)
+            delay *= 2
+            continue
+
+        Metrics.api_call('google', endpoint, 200,
+                         perf_counter() - start,
+                         received[-1] if received else 0)
+        return result
+
+# Build a Google Calendar API client.  Clients are not thread safe, so
+# each thread that makes API calls needs its own.
+def _build_service(args):
+    # If an alternate Google API base URL was specified (e.g., a local
+    # stand-in server for testing), don't bother with real credentials.
+    if args.google_base_url:
+        base_url = args.google_base_url.rstrip('/')
+        return build("calendar", "v3", credentials=AnonymousCredentials(),
+                     cache_discovery=False,
+                     client_options={"api_endpoint": f"{base_url}/calendar/v3/"})
 
-def login(args):
-    logging.info("Logging in to Google")
     SCOPES = ["https://www.googleapis.com/auth/calendar"]
     creds = service_account.Credentials.from_service_account_file(args.google_creds, scopes=SCOPES)
     return build("calendar", "v3", credentials=creds,
                  cache_discovery=False)
 
-def download(service, args, config):
-    first_date = datetime.combine(config['first date'],
-                                  time(0, 0, 0),
-                                  tzinfo=timezone.utc).isoformat()
-    last_date = datetime.combine(config['last date'],
-                                 time(23, 59, 59),
-                                 tzinfo=timezone.utc).isoformat()
-    logging.info(f"Downloading Google Calendar events between {first_date} and {last_date}...")
+def login(args):
+    if args.google_base_url:
+        logging.info(f"Using Google Calendar API at {args.google_base_url}")
+    else:
+        logging.info("Logging in to Google")
+    return _build_service(args)
 
-    output = defaultdict(list)
+#-----------------------------------------------------------------
+
+def _state_filename(config):
+    return os.path.join(config['state dir'], _state_basename)
+
+# The number of events per day (by UTC start date) seen in the
+# previous download, or None if unknown
+def _read_density(config):
+    if config['state dir'] is None:
+        return None
+    filename = _state_filename(config)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename) as fp:
+            return json.load(fp)['events_per_day']
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Ignoring unreadable Google download state {filename}: {e}")
+        return None
+
+def _write_density(config, output):
+    if config['state dir'] is None:
+        return
+    density = defaultdict(int)
+    for events in output.values():
+        for event in events:
+            density[event['start'].date().isoformat()] += 1
+
+    os.makedirs(config['state dir'], exist_ok=True)
+    filename = _state_filename(config)
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as fp:
+        json.dump({'events_per_day': density}, fp)
+    os.replace(tmp, filename)
+
+# Split the download window into time shards.  The number of shards
+# (and where the shard boundaries fall) is chosen so that each shard is
+# expected to hold about the same number of events -- based on the
+# events per day seen in the previous run -- and no more than
+# 'google download events per shard' events.  Shard boundaries are at
+# midnight UTC.
+def _plan_shards(config, first, last):
+    days = [config['first date'] + timedelta(days=i)
+            for i in range((config['last date'] - config['first date']).days + 1)]
+    max_shards = min(config['google download max shards'], len(days))
+
+    density = _read_density(config)
+    if density is None:
+        # No history: assume that events are spread evenly
+        counts = [1] * len(days)
+        num_shards = max_shards
+    else:
+        known = [density[d.isoformat()] for d in days if d.isoformat() in density]
+        # Days that were not in the previous window (e.g., the newest
+        # day at the end of the window) are assumed to be average
+        average = sum(known) / len(known) if known else 0
+        counts = [density.get(d.isoformat(), average) for d in days]
+        expected = sum(counts)
+        num_shards = -(-int(expected) // config['google download events per shard'])
+        num_shards = max(1, min(num_shards, max_shards))
+        if expected == 0:
+            counts = [1] * len(days)
+
+    # Cut the window where the running total of events passes each
+    # multiple of (total / num_shards).  There are num_shards - 1 cuts:
+    # if the last days have no events, the running total reaches
+    # "total" before the end of the window, and must not cut again.
+    total = sum(counts)
+    boundaries = [first]
+    cumulative = 0
+    for i, count in enumerate(counts[:-1]):
+        cumulative += count
+        if len(boundaries) < num_shards and \
+           cumulative >= len(boundaries) * total / num_shards:
+            boundaries.append(datetime.combine(days[i + 1], time(0, 0, 0),
+                                               tzinfo=timezone.utc))
+    boundaries.append(last)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# Page through all the events in one time shard.  Google returns events
+# that overlap the [time_min, time_max) range, so an event that spans a
+# shard boundary is returned by both shards.
+def _download_shard(service, calendar_id, time_min, time_max,
+                    fields="nextPageToken,items(summary,id,description,start,end,colorId)"):
+    events = []
     page_token = None
     while True:
-        events_result = (
+        events_result = _execute(
             service.events()
-            .list(calendarId=args.google_calendar_id,
-                  timeMin=first_date,
-                  timeMax=last_date,
+            .list(calendarId=calendar_id,
+                  timeMin=time_min.isoformat(),
+                  timeMax=time_max.isoformat(),
                   # Expand recurring events into separate instances rather
                   # than grouping them
                   singleEvents=True,
                   orderBy="startTime",
                   pageToken=page_token,
                   maxResults=2500,
-                  fields="items(summary,id,description,start,end,colorId)"
-                  )
-            .execute()
+                  fields=fields
+                  ),
+            "events.list"
         )
 
-        new_events = events_result.get('items', [])
-        if not new_events:
+        events.extend(events_result.get('items', []))
+
+        # Continues to process events if there are more to process
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
             break
 
+    return events
+
+# Download the events on the calendar, gathered by door name.
+#
+# The Verkada events are kept by *local* date, so for a door far from
+# UTC, the window extends up to a day beyond the same dates in UTC
+# (e.g., 05:00 on the first day in Sydney is the previous day in UTC).
+# Download a day more on each side; main.compare() then only considers
+# the events that start within each door's local window.
+def download(service, args, config):
+    first = datetime.combine(config['first date'] - timedelta(days=1),
+                             time(0, 0, 0),
+                             tzinfo=timezone.utc)
+    last = datetime.combine(config['last date'] + timedelta(days=2),
+                            time(0, 0, 0),
+                            tzinfo=timezone.utc)
+    shards = _plan_shards(config, first, last)
+    logging.info(f"Downloading Google Calendar events between {first.isoformat()} and {last.isoformat()} in {len(shards)} shards...")
+
+    # Each shard is a chain of dependent page requests; download the
+    # shards concurrently, each with its own API client.  The first
+    # shard uses the client that we were given.
+    def _worker(i, time_min, time_max):
+        shard_service = service if i == 0 else _build_service(args)
+        return _download_shard(shard_service, args.google_calendar_id,
+                               time_min, time_max)
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(_worker, i, time_min, time_max)
+                   for i, (time_min, time_max) in enumerate(shards)]
+        results = [future.result() for future in futures]
+
+    # Each shard is sorted by start time, and every event that a shard
+    # returns for the first time starts inside that shard.  So once the
+    # duplicates are dropped, concatenating the shards in order keeps
+    # every door's events sorted.
+    output = defaultdict(list)
+    seen = set()
+    duplicates = 0
+    for events in results:
         # Gather events by summary (i.e., door name)
-        for event in new_events:
+        for event in events:
+            if event['id'] in seen:
+                duplicates += 1
+                continue
+            seen.add(event['id'])
+
             # Google calendar events are returned in UTC. Convert them
-            # to python datetimes.
+            # to python datetimes, and also to UTC epoch seconds (which
+            # is what we use to compare against Verkada events).
             dt = datetime.fromisoformat(event['start']['dateTime'])
             event['start'] = dt.astimezone(timezone.utc)
+            event['start_epoch'] = int(dt.timestamp())
             dt = datetime.fromisoformat(event['end']['dateTime'])
             event['end'] = dt.astimezone(timezone.utc)
+            event['end_epoch'] = int(dt.timestamp())
             output[event["summary"]].append(event)
 
-        # Continues to process events if there are more to process
-        page_token = events_result.get('nextPageToken')
-        if not page_token:
-            break
+    _write_density(config, output)
 
-    logging.debug("Google Calendar events downloaded")
-    logging.debug(pformat(output))
+    Log.debug_dump("Google Calendar events downloaded", output)
+    Log.summary("Google Calendar download",
+                shards=len(shards),
+                duplicates=duplicates,
+                doors=len(output),
+                events=sum(len(events) for events in output.values()))
 
     return output
 
-def add(verkada_event, service, args, config):
-    logging.info(f"Adding Google Calendar event: {verkada_event['name']} / {verkada_event['door_status']}, starting {verkada_event['start_time']}")
-
+def _google_event(verkada_event, config):
     color = config[f'color {verkada_event["door_status"]}']
 
-    google_event = {
+    return {
         "summary": verkada_event["name"],
         "start": {
             "dateTime": verkada_event["start_time"].isoformat(),
@@ -85,12 +285,335 @@ def add(verkada_event, service, args, config):
         "colorId": color,
     }
 
-    service.events().insert(calendarId=args.google_calendar_id,
-                            body=google_event).execute()
+def add(verkada_event, service, args, config):
+    logging.debug("Adding Google Calendar event: %s / %s, starting %s",
+                  verkada_event['name'], verkada_event['door_status'],
+                  verkada_event['start_time'])
+
+    _execute(service.events().insert(calendarId=args.google_calendar_id,
+                                     body=_google_event(verkada_event, config)),
+             "events.insert")
 
 def delete(google_event, service, args, config):
     desc = google_event.get('description', '')
-    logging.info(f"Removing Google Calendar event: {google_event['summary']} / {desc}, starting {google_event['start']}")
+    logging.debug("Removing Google Calendar event: %s / %s, starting %s",
+                  google_event['summary'], desc, google_event['start'])
+
+    _execute(service.events().delete(calendarId=args.google_calendar_id,
+                                     eventId=google_event["id"]),
+             "events.delete")
+
+# Apply groups of ("delete", Google event) / ("add", Verkada event)
+# operations (see main.schedule_changes()) in order, stopping early
+# when the per-run API budget or time limit is used up, or when Google
+# is still rate limiting us after all retries (e.g., the daily quota is
+# exhausted).  A group is not started unless it fits in what is left of
+# the budget, so that an event is not deleted without its replacement
+# being added; only a group that is larger than the whole budget is
+# split, after as many of its operations as fit (which still adds the
+# replacement before deleting).  The remaining operations are left for
+# the next run, which will find them again when it compares the
+# calendars.  Returns the number of operations applied.
+def apply(service, args, config, groups):
+    budget = config['api budget']
+    time_limit = config['apply time limit']
+    start = perf_counter()
+    applied = 0
+
+    for group in groups:
+        if budget and applied + len(group) > budget:
+            if applied > 0 or len(group) <= budget:
+                logging.warning(f"Used up the API budget of {budget} operations for this run")
+                return applied
+            group = group[:budget]
+        if time_limit and perf_counter() - start >= time_limit:
+            logging.warning(f"Used up the time limit of {time_limit} seconds for applying changes in this run")
+            return applied
+
+        for action, event in group:
+            if Log.trace_enabled():
+                Log.trace(action, event)
+            try:
+                if action == 'delete':
+                    delete(event, service, args, config)
+                else:
+                    add(event, service, args, config)
+            except HttpError as e:
+                if not _retryable(e):
+                    raise
+                logging.warning(f"Google API is still rate limiting us (HTTP {e.resp.status}); deferring the remaining changes")
+                return applied
+            applied += 1
+
+    return applied
+
+#-----------------------------------------------------------------
+
+# Bulk rebuild
+#
+# When the diff is close to the size of the whole calendar (e.g., on
+# first onboarding, or after a change that moves every event), deleting
+# and inserting events one at a time costs an API call for every old
+# event plus one for every new event.  A rebuild instead starts from an
+# empty calendar and fills it with batched inserts, so it costs about
+# one API call per new event:
+#
+# - "clear": empty the calendar with calendars.clear, then bulk-load
+#   it.  Google only allows clearing the primary calendar of an account
+#   (i.e., the service account's own calendar), and clearing removes
+#   *all* of its events, including those outside the sync window.
+# - "swap": create a new (shadow) calendar, bulk-load it, check that it
+#   has the expected number of events, copy the sharing rules (ACLs) of
+#   the current calendar to it, and switch over to it.  The calendar ID
+#   in use is recorded in the state directory.  A shadow calendar from
+#   a previous swap is deleted afterwards; the originally configured
+#   calendar is left alone.
+
+# Stored in the state directory: the calendar in use after a swap
+_calendar_state_basename = 'google-calendar.json'
+
+def _read_calendar_state(config):
+    if config['state dir'] is None:
+        return {}
+    filename = os.path.join(config['state dir'], _calendar_state_basename)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as fp:
+        return json.load(fp)
+
+def _write_calendar_state(config, state):
+    os.makedirs(config['state dir'], exist_ok=True)
+    filename = os.path.join(config['state dir'], _calendar_state_basename)
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as fp:
+        json.dump(state, fp)
+    os.replace(tmp, filename)
+
+# The ID of the calendar to synchronize: the configured calendar, or the
+# calendar that replaced it in a swap rebuild
+def active_calendar_id(args, config):
+    state = _read_calendar_state(config)
+    if state.get('configured') == args.google_calendar_id:
+        return state['active']
+    return args.google_calendar_id
+
+def should_rebuild(config, num_changes, num_events):
+    if config['rebuild mode'] is None or config['rebuild diff ratio'] <= 0:
+        return False
+    if num_events == 0:
+        return False
+    # A rebuild cannot be done halfway, so don't start one that would
+    # not fit in the API budget
+    if config['api budget'] and num_events > config['api budget']:
+        return False
+    return num_changes >= config['rebuild diff ratio'] * num_events
+
+# The batch endpoint is not derived from the API endpoint, so it must
+# be given explicitly when using an alternate base URL
+def _new_batch(service, args):
+    if args.google_base_url:
+        base_url = args.google_base_url.rstrip('/')
+        return BatchHttpRequest(batch_uri=f"{base_url}/batch/calendar/v3")
+    return service.new_batch_http_request()
+
+# Execute a batch request, retrying the whole batch if it is rate
+# limited or hits a server error
+def _execute_batch_request(batch):
+    delay = 1
+    for attempt in range(1, _max_attempts + 1):
+        start = perf_counter()
+        try:
+            batch.execute()
+        except HttpError as e:
+            Metrics.api_call('google', 'batch', e.resp.status,
+                             perf_counter() - start)
+            if not _retryable(e) or attempt == _max_attempts:
+                raise
+
+            logging.warning(f"Google API returned HTTP {e.resp.status} for a batch request; retrying in {delay} seconds")
+            Metrics.retry('google', 'batch')
+            sleep(delay)
+            delay *= 2
+            continue
+
+        Metrics.api_call('google', 'batch', 200, perf_counter() - start)
+        return
+
+# Make one API request per item, config['google batch size'] requests
+# per batch.  Individual requests that are rate limited are retried (in
+# later batches) with exponential backoff.  Returns the number of
+# requests that failed.
+def _execute_batched(service, args, config, items, make_request, endpoint):
+    size = config['google batch size']
+    pending = items
+    failed = 0
+    delay = 1
+    for attempt in range(1, _max_attempts + 1):
+        retry = []
+        for i in range(0, len(pending), size):
+            chunk = pending[i:i + size]
+
+            def _callback(request_id, response, exception, chunk=chunk):
+                nonlocal failed
+                if exception is None:
+                    Metrics.api_call('google', endpoint, 200, 0)
+                    return
+
+                Metrics.api_call('google', endpoint, exception.resp.status, 0)
+                if _retryable(exception) and attempt < _max_attempts:
+                    retry.append(chunk[int(request_id)])
+                else:
+                    logging.error(f"Google API {endpoint} request failed: {exception}")
+                    failed += 1
+
+            batch = _new_batch(service, args)
+            for j, item in enumerate(chunk):
+                batch.add(make_request(item), callback=_callback,
+                          request_id=str(j))
+            _execute_batch_request(batch)
+
+        if not retry:
+            break
+
+        logging.warning(f"Google API rate limited {len(retry)} {endpoint} requests; retrying in {delay} seconds")
+        for _ in retry:
+            Metrics.retry('google', endpoint)
+        sleep(delay)
+        delay *= 2
+        pending = retry
+
+    return failed
+
+def _bulk_load(service, args, config, calendar_id, events):
+    logging.info(f"Inserting {len(events)} events into Google Calendar {calendar_id}")
+    return _execute_batched(
+        service, args, config, events,
+        lambda event: service.events().insert(calendarId=calendar_id,
+                                              body=_google_event(event, config)),
+        "events.insert")
+
+# The number of events on a calendar in the time range covered by
+# "events" (which is not quite the sync window: the merged events are
+# in the doors' timezones)
+def _count_events(service, calendar_id, events):
+    if not events:
+        return 0
+    first = datetime.fromtimestamp(min(e['start_epoch'] for e in events),
+                                   timezone.utc)
+    last = datetime.fromtimestamp(max(e['end_epoch'] for e in events),
+                                  timezone.utc)
+    return len(_download_shard(service, calendar_id, first, last,
+                               fields="nextPageToken,items(id)"))
+
+def _list_acl(service, calendar_id):
+    rules = []
+    page_token = None
+    while True:
+        result = _execute(service.acl().list(calendarId=calendar_id,
+                                             pageToken=page_token),
+                          "acl.list")
+        rules.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return rules
+
+def _rebuild_clear(service, args, config, events):
+    calendar_id = args.google_calendar_id
+    try:
+        _execute(service.calendars().clear(calendarId=calendar_id),
+                 "calendars.clear")
+    except HttpError as e:
+        logging.warning(f"Cannot clear Google Calendar {calendar_id} (HTTP {e.resp.status}; only a primary calendar can be cleared); applying the changes one at a time instead")
+        return False
+
+    # The calendar has been cleared, so there is no going back: even if
+    # something went wrong, the next run will fix up the difference.
+    failed = _bulk_load(service, args, config, calendar_id, events)
+    count = _count_events(service, calendar_id, events)
+    if failed or count != len(events):
+        logging.error(f"After rebuilding, Google Calendar {calendar_id} has {count} events; expected {len(events)}")
+    return True
+
+def _rebuild_swap(service, args, config, events):
+    if config['state dir'] is None:
+        logging.warning("rebuild_mode = swap requires state_dir; applying the changes one at a time instead")
+        return False
+
+    old_id = args.google_calendar_id
+    try:
+        old = _execute(service.calendars().get(calendarId=old_id),
+                       "calendars.get")
+        rules = _list_acl(service, old_id)
+    except HttpError as e:
+        logging.warning(f"Cannot read the sharing settings of Google Calendar {old_id} (HTTP {e.resp.status}; swapping calendars requires permission to manage sharing); applying the changes one at a time instead")
+        return False
+
+    new = _execute(service.calendars().insert(body={
+        'summary': old.get('summary', old_id),
+        'description': old.get('description', ''),
+        'timeZone': old.get('timeZone', 'UTC'),
+    }), "calendars.insert")
+    new_id = new['id']
+    logging.info(f"Created shadow Google Calendar {new_id}")
+
+    failed = _bulk_load(service, args, config, new_id, events)
+    count = _count_events(service, new_id, events)
+    if failed or count != len(events):
+        logging.error(f"Shadow Google Calendar {new_id} has {count} events; expected {len(events)}.  Keeping Google Calendar {old_id}")
+        _execute(service.calendars().delete(calendarId=new_id),
+                 "calendars.delete")
+        return False
+
+    # Share the new calendar the same way as the old one (the new
+    # calendar's creator -- i.e., us -- is already its owner)
+    existing = {(rule['scope'].get('type'), rule['scope'].get('value'))
+                for rule in _list_acl(service, new_id)}
+    for rule in rules:
+        scope = rule['scope']
+        if (scope.get('type'), scope.get('value')) in existing:
+            continue
+        try:
+            _execute(service.acl().insert(calendarId=new_id,
+                                          body={'role': rule['role'],
+                                                'scope': scope},
+                                          sendNotifications=False),
+                     "acl.insert")
+        except HttpError as e:
+            logging.warning(f"Cannot copy sharing rule {rule['role']} / {scope} to Google Calendar {new_id}: HTTP {e.resp.status}")
+
+    state = _read_calendar_state(config)
+    configured_id = state['configured'] if state.get('active') == old_id else old_id
+    _write_calendar_state(config, {'configured': configured_id, 'active': new_id})
+    args.google_calendar_id = new_id
+
+    if old_id != configured_id:
+        # A shadow calendar from a previous swap
+        try:
+            _execute(service.calendars().delete(calendarId=old_id),
+                     "calendars.delete")
+        except HttpError as e:
+            logging.warning(f"Cannot delete old shadow Google Calendar {old_id}: HTTP {e.resp.status}")
+    else:
+        logging.warning(f"Google Calendar {old_id} will no longer be updated; it has been replaced by {new_id}")
+
+    return True
+
+# Rebuild the calendar from scratch with the merged Verkada events.
+# Returns True if the calendar was rebuilt, or False if the changes
+# still need to be applied one at a time.
+def rebuild(service, args, config, verkada_events):
+    events = []
+    for door_name, door_events in verkada_events.items():
+        for event in door_events:
+            event['name'] = door_name
+            events.append(event)
+
+    mode = config['rebuild mode']
+    logging.info(f"Rebuilding Google Calendar {args.google_calendar_id} ({mode}) with {len(events)} events")
+    if mode == 'clear':
+        rebuilt = _rebuild_clear(service, args, config, events)
+    else:
+        rebuilt = _rebuild_swap(service, args, config, events)
 
-    service.events().delete(calendarId=args.google_calendar_id,
-                            eventId=google_event["id"]).execute()
+    Log.summary("Rebuild", mode=mode, events=len(events), rebuilt=rebuilt)
+    return rebuilt
@@ -0,0 +1,88 @@
+import json
+import random
+import logging
+
+from pprint import pformat
+
+# Helpers so that (potentially very large) log output is only
+# formatted when the corresponding log level is actually enabled.
+#
+# Large Verkada organizations can have many thousands of doors and
+# exception events; formatting all of that data for debug output that
+# nobody sees takes a noticeable share of the runtime and memory.
+
+_trace_fp = None
+_trace_sample_rate = 0.0
+_trace_random = random.Random()
+
+# Wrapper that defers calling func(*args) until the object is turned
+# into a string -- which the logging module only does if the record
+# is actually emitted.  E.g.:
+#
+#   logging.debug("Doors: %s", Log.lazy(pformat, doors))
+class _Lazy:
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+def lazy(func, *args):
+    return _Lazy(func, *args)
+
+def setup(args):
+    global _trace_fp
+    global _trace_sample_rate
+
+    if args.trace_file:
+        logging.info(f"Writing sampled JSON trace to {args.trace_file} (sample rate: {args.trace_sample_rate})")
+        _trace_fp = open(args.trace_file, 'w')
+        _trace_sample_rate = args.trace_sample_rate
+
+def close():
+    global _trace_fp
+
+    if _trace_fp:
+        _trace_fp.close()
+        _trace_fp = None
+
+def debug_enabled():
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+# Emit a title and a pretty-printed dump of an object, but only if
+# debug logging is enabled.
+def debug_dump(title, obj):
+    if debug_enabled():
+        logging.debug(title)
+        logging.debug(pformat(obj))
+
+def _write_trace(record):
+    _trace_fp.write(json.dumps(record, default=str))
+    _trace_fp.write('\n')
+
+# Emit a one-line summary of a pipeline stage at INFO level, e.g.:
+#
+#   Log.summary("Verkada doors", doors=1234)
+#
+# Summaries are always written to the JSON trace (if enabled).
+def summary(stage, **counts):
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        text = ', '.join(f"{key}={value}" for key, value in counts.items())
+        logging.info(f"{stage}: {text}")
+
+    if _trace_fp:
+        _write_trace({'type': 'summary', 'stage': stage, **counts})
+
+def trace_enabled():
+    return _trace_fp is not None
+
+# Write a sampled record to the JSON trace (if enabled).  Callers in
+# hot loops should check trace_enabled() before building the record.
+def trace(stage, record):
+    if _trace_fp is None:
+        return
+    if _trace_random.random() >= _trace_sample_rate:
+        return
+
+    _write_trace({'type': 'trace', 'stage': stage, **record})
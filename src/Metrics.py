@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Simple in-process instrumentation: wall time per pipeline stage,
+# event counts, and API calls (by service, endpoint, and HTTP status).
+# At the end of a run, the results can be written as a Prometheus
+# textfile (e.g., for the node_exporter textfile collector) and/or a
+# JSON summary.
+
+_stages = {}
+_stage_order = []
+_counts = {}
+_api_calls = defaultdict(int)
+_api_seconds = defaultdict(float)
+_api_bytes = defaultdict(int)
+_api_retries = defaultdict(int)
+# API calls may be made from multiple threads (e.g., the sharded Google
+# Calendar download)
+_api_lock = threading.Lock()
+_start_time = time.time()
+
+# Time a stage of the pipeline, e.g.:
+#
+#   with Metrics.stage("compare"):
+#       ...
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if name not in _stages:
+            _stage_order.append(name)
+            _stages[name] = 0.0
+        _stages[name] += elapsed
+        logging.info("Stage %s took %.3f seconds", name, elapsed)
+
+def count(name, value):
+    _counts[name] = value
+
+def api_call(service, endpoint, status, seconds, num_bytes=0):
+    key = (service, endpoint, str(status))
+    with _api_lock:
+        _api_calls[key] += 1
+        _api_seconds[key] += seconds
+        _api_bytes[(service, endpoint)] += num_bytes
+
+def retry(service, endpoint):
+    with _api_lock:
+        _api_retries[(service, endpoint)] += 1
+
+# Peak resident set size of this process, in bytes
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes; macOS reports bytes
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+def summary():
+    return {
+        'start_time': _start_time,
+        'stages': {name: _stages[name] for name in _stage_order},
+        'counts': dict(_counts),
+        'api_calls': [
+            {
+                'service': service,
+                'endpoint': endpoint,
+                'status': status,
+                'calls': calls,
+                'seconds': _api_seconds[(service, endpoint, status)],
+            }
+            for (service, endpoint, status), calls in sorted(_api_calls.items())
+        ],
+        'api_bytes': [
+            {'service': service, 'endpoint': endpoint, 'bytes': num_bytes}
+            for (service, endpoint), num_bytes in sorted(_api_bytes.items())
+        ],
+        'api_retries': [
+            {'service': service, 'endpoint': endpoint, 'retries': retries}
+            for (service, endpoint), retries in sorted(_api_retries.items())
+        ],
+        'api_calls_total': sum(_api_calls.values()),
+        'peak_rss_bytes': peak_rss(),
+    }
+
+# Write to a temporary file and rename it into place so that readers
+# (e.g., the Prometheus textfile collector) never see a partial file.
+def _write_atomically(filename, text):
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp, filename)
+
+def write_json(filename):
+    logging.info(f"Writing metrics JSON summary to {filename}")
+    _write_atomically(filename, json.dumps(summary(), indent=4) + '\n')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return '{' + text + '}'
+
+def write_prometheus(filename):
+    logging.info(f"Writing Prometheus metrics to {filename}")
+    lines = []
+
+    def _metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    _metric('vercalbot_stage_seconds', 'gauge',
+            'Wall time spent in each stage of the sync',
+            [(_labels(stage=name), _stages[name]) for name in _stage_order])
+    _metric('vercalbot_events', 'gauge',
+            'Number of events seen in each stage of the sync',
+            [(_labels(kind=name), value) for name, value in _counts.items()])
+    _metric('vercalbot_api_calls_total', 'counter',
+            'API calls by service, endpoint, and HTTP status',
+            [(_labels(service=s, endpoint=e, status=st), calls)
+             for (s, e, st), calls in sorted(_api_calls.items())])
+    _metric('vercalbot_api_call_seconds_total', 'counter',
+            'Wall time spent in API calls by service, endpoint, and HTTP status',
+            [(_labels(service=s, endpoint=e, status=st), _api_seconds[(s, e, st)])
+             for (s, e, st) in sorted(_api_calls.keys())])
+    _metric('vercalbot_api_bytes_total', 'counter',
+            'Bytes received from API calls by service and endpoint',
+            [(_labels(service=s, endpoint=e), num_bytes)
+             for (s, e), num_bytes in sorted(_api_bytes.items())])
+    _metric('vercalbot_api_retries_total', 'counter',
+            'API call retries by service and endpoint',
+            [(_labels(service=s, endpoint=e), retries)
+             for (s, e), retries in sorted(_api_retries.items())])
+    _metric('vercalbot_peak_rss_bytes', 'gauge',
+            'Peak resident set size of the sync process',
+            [('', peak_rss())])
+    _metric('vercalbot_last_run_timestamp_seconds', 'gauge',
+            'Time when the last sync started',
+            [('', _start_time)])
+
+    _write_atomically(filename, '\n'.join(lines) + '\n')
+
+def write(args):
+    if args.metrics_json:
+        write_json(args.metrics_json)
+    if args.metrics_prom:
+        write_prometheus(args.metrics_prom)
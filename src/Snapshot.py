@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import logging
+
+from array import array
+
+# A compact binary snapshot of the merged schedule (i.e., the output of
+# Verkada.merge_data()), which can be loaded with zero copies via mmap.
+#
+# Layout (every section starts on an 8 byte boundary):
+#
+#   header          see _header below
+#   door offsets    uint64[num doors + 1]: door i's intervals are
+#                   [door_offsets[i], door_offsets[i + 1])
+#   string offsets  uint64[num strings + 1] into the string blob
+#   starts          int64[num intervals]: UTC epoch seconds
+#   ends            int64[num intervals]: UTC epoch seconds
+#   statuses        uint8[num intervals]: index into the status names
+#   string blob     UTF-8: all the door names, then all the site
+#                   names, then all the timezone names, then all the
+#                   status names ('' means none)
+#
+# Each door's intervals are sorted and do not overlap.
+#
+# The header holds a digest of the inputs that the merged schedule was
+# computed from (see digest()), so that a snapshot of stale data is
+# never used, and a CRC-32 of everything after the header, so that a
+# damaged snapshot is never used.  Arrays are in the byte order of the
+# machine that wrote them; a snapshot from a machine with a different
+# byte order is rejected (and will simply be rewritten).
+
+# Bump the version whenever the layout -- or the meaning of the merged
+# schedule -- changes
+_magic = b'VCBSNAP\0'
+_version = 2
+_header = struct.Struct('<8sIIIIQqqQ32sI4x')
+_byte_orders = {'little': 1, 'big': 2}
+
+_snapshot_filename = 'merged-schedule.snapshot'
+
+def filename(config):
+    return os.path.join(config['state dir'], _snapshot_filename)
+
+# A digest of the inputs to Verkada.merge_data() (which must be
+# computed before merge_data() modifies them).  Values that JSON cannot
+# represent (dates, times, timezones) are compared by their string
+# form.
+def digest(*inputs):
+    text = json.dumps([_version, inputs], default=str, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+class Snapshot:
+    def __init__(self, fp, verify=True):
+        self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            self._parse(verify)
+        except ValueError:
+            self.close()
+            raise
+
+    # Slice a memoryview of the mmap (views are tracked so that they
+    # can all be released before the mmap is closed)
+    def _view(self, start, end, fmt='B'):
+        view = memoryview(self._mmap)[start:end].cast(fmt)
+        self._views.append(view)
+        return view
+
+    def _parse(self, verify):
+        size = len(self._mmap)
+        if size < _header.size:
+            raise ValueError("Snapshot is truncated")
+
+        (magic, version, byte_order, num_doors, num_statuses,
+         num_intervals, self.first_epoch, self.last_epoch, string_bytes,
+         self.digest, checksum) = _header.unpack_from(self._mmap)
+        if magic != _magic:
+            raise ValueError("Not a VerCalBot snapshot")
+        if version != _version:
+            raise ValueError(f"Snapshot version {version} is not supported (expected {_version})")
+        if byte_order != _byte_orders[sys.byteorder]:
+            raise ValueError("Snapshot was written with a different byte order")
+
+        num_strings = 3 * num_doors + num_statuses
+        offset = _header.size
+        sections = []
+        for fmt, count, item_size in [('Q', num_doors + 1, 8),
+                                      ('Q', num_strings + 1, 8),
+                                      ('q', num_intervals, 8),
+                                      ('q', num_intervals, 8),
+                                      ('B', num_intervals, 1)]:
+            offset = _align(offset)
+            sections.append((offset, offset + count * item_size, fmt))
+            offset += count * item_size
+        if offset + string_bytes != size:
+            raise ValueError("Snapshot is truncated")
+
+        if verify and zlib.crc32(self._view(_header.size, size)) != checksum:
+            raise ValueError("Snapshot checksum does not match")
+
+        (self.door_offsets, string_offsets, self.starts, self.ends,
+         self.statuses) = [self._view(*section) for section in sections]
+
+        # The door table is small; decode it so that doors can be looked
+        # up by name.  The intervals stay in the mmap.
+        strings = [self._mmap[offset + string_offsets[i]:offset + string_offsets[i + 1]].decode('utf-8') or None
+                   for i in range(num_strings)]
+        self.names = strings[:num_doors]
+        self.sites = strings[num_doors:2 * num_doors]
+        self.time_zones = strings[2 * num_doors:3 * num_doors]
+        self.status_names = strings[3 * num_doors:]
+        self.door_ids = {name: i for i, name in enumerate(self.names)}
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def num_intervals(self):
+        return len(self.starts)
+
+    # Door i's intervals as a list of merged events (as returned by
+    # Verkada.merge_data(), but without the datetimes)
+    def events(self, i):
+        starts = self.starts
+        ends = self.ends
+        statuses = self.statuses
+        status_names = self.status_names
+        return [{
+            'door_status': status_names[statuses[j]],
+            'start_epoch': starts[j],
+            'end_epoch': ends[j],
+        } for j in range(self.door_offsets[i], self.door_offsets[i + 1])]
+
+def load(filename, verify=True):
+    with open(filename, 'rb') as fp:
+        return Snapshot(fp, verify)
+
+# Write a snapshot.  "doors" is a list of (name, site name, timezone
+# name, events) tuples, where the events are as returned by
+# Verkada.merge_data().
+def write(filename, input_digest, first_epoch, last_epoch, doors, status_names):
+    status_codes = {name: i for i, name in enumerate(status_names)}
+
+    door_offsets = array('Q', [0])
+    starts = array('q')
+    ends = array('q')
+    statuses = array('B')
+    for _, _, _, events in doors:
+        for event in events:
+            starts.append(event['start_epoch'])
+            ends.append(event['end_epoch'])
+            statuses.append(status_codes[event['door_status']])
+        door_offsets.append(len(starts))
+
+    strings = ([name for name, _, _, _ in doors] +
+               [site or '' for _, site, _, _ in doors] +
+               [tz or '' for _, _, tz, _ in doors] +
+               list(status_names))
+    encoded = [s.encode('utf-8') for s in strings]
+    string_offsets = array('Q', [0])
+    for s in encoded:
+        string_offsets.append(string_offsets[-1] + len(s))
+    blob = b''.join(encoded)
+
+    body = bytearray()
+    for section in [door_offsets, string_offsets, starts, ends, statuses]:
+        # Sections are aligned relative to the start of the file; the
+        # header size is a multiple of 8
+        body.extend(b'\0' * (_align(len(body)) - len(body)))
+        body.extend(section.tobytes())
+    body.extend(blob)
+
+    header = _header.pack(_magic, _version, _byte_orders[sys.byteorder],
+                          len(doors), len(status_names), len(starts),
+                          first_epoch, last_epoch, len(blob),
+                          input_digest, zlib.crc32(body))
+
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'wb') as fp:
+        fp.write(header)
+        fp.write(body)
+    os.replace(tmp, filename)
+    logging.info(f"Wrote merged schedule snapshot to {filename} ({len(header) + len(body)} bytes)")
@@ -0,0 +1,14 @@
+import zoneinfo
+
+from functools import lru_cache
+from datetime import timezone
+
+# Timezones are looked up by name for every camera, door, and schedule
+# entry, and for every door read back from the merged schedule
+# snapshot; resolve each name only once.  A door without a timezone
+# (None) is in UTC.
+@lru_cache(maxsize=None)
+def lookup(name):
+    if name is None:
+        return timezone.utc
+    return zoneinfo.ZoneInfo(name)
@@ -1,15 +1,22 @@
+import os
 import json
-import pytz
+import heapq
 import requests
 import logging
-import zoneinfo
 
-from datetime import date, time, datetime, timedelta
+from datetime import date, time, datetime, timedelta, timezone
+from functools import lru_cache
+from time import perf_counter, sleep
 
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from collections import defaultdict
 from pprint import pformat
 
+import Log
+import Metrics
+import Snapshot
+import TimeZones
+
 _weights = [
     'locked',
     'access_controlled',
@@ -17,6 +24,8 @@ _weights = [
     'unlocked',
 ]
 
+_weight_index = {status: i for i, status in enumerate(_weights)}
+
 _weekday_map = {
     "MO": 0,
     "TU": 1,
@@ -27,22 +36,90 @@ _weekday_map = {
     "SU": 6,
 }
 
+_day_name_map = {
+    "Monday": 0,
+    "Tuesday": 1,
+    "Wednesday": 2,
+    "Thursday": 3,
+    "Friday": 4,
+    "Saturday": 5,
+    "Sunday": 6,
+}
+
+_minutes_per_day = 24 * 60
+_minutes_per_week = 7 * _minutes_per_day
+
 # This key is used on door exception calendars to store the lists of
 # exploded exception events.  We use all-caps to denote that this
 # information we put on the dictionary (as opposed to information that
 # was downloaded via the Verkada API).
 _exploded_key = 'EXPLODED EXCEPTIONS'
 
+# Similar to _exploded_key, this key is used on doors to store the
+# list of events from the door's regular (weekly) schedule.
+_regular_key = 'REGULAR SCHEDULE'
+
+_epoch = datetime(1970, 1, 1)
+_one_second = timedelta(seconds=1)
+
+# Convert a naive (local) datetime in the given timezone to an integer
+# number of seconds since the UNIX epoch (i.e., UTC).  All sorting,
+# merging, and comparing of events is done on these integers, which is
+# both faster and less error-prone than comparing timezone-aware
+# datetimes across different zones.
+#
+# DST handling:
+#
+# - Ambiguous local times (the hour that is repeated when DST ends)
+#   resolve to their first occurrence (fold=0).
+# - Non-existent local times (the hour that is skipped when DST
+#   starts) are shifted forward by the size of the gap (e.g., 02:30 on
+#   a spring-forward day becomes 03:30).  zoneinfo does this for us:
+#   for a time in the gap with fold=0, it uses the pre-transition
+#   offset.
+def _to_epoch(naive, tz):
+    offset = naive.replace(tzinfo=tz, fold=0).utcoffset()
+    return (naive - offset - _epoch) // _one_second
+
+# Maximum number of attempts for a single Verkada API request that is
+# rate limited (HTTP 429) or hits a server error (HTTP 5xx)
+_max_attempts = 5
+
+# Issue a single Verkada API request, retrying (with exponential
+# backoff, or whatever the server asks for via Retry-After) when rate
+# limited or on server errors.  Every attempt is recorded in the
+# metrics.
+def _request(session, method, endpoint):
+    delay = 1
+    for attempt in range(1, _max_attempts + 1):
+        start = perf_counter()
+        response = session.request(method, f"{session.verkada_base_url}/{endpoint}")
+        Metrics.api_call('verkada', endpoint, response.status_code,
+                         perf_counter() - start,
+                         len(response.content))
+
+        st = response.status_code
+        if (st != 429 and st < 500) or attempt == _max_attempts:
+            return response
+
+        retry_after = response.headers.get('Retry-After')
+        wait = float(retry_after) if retry_after and retry_after.isdigit() else delay
+        logging.warning(f"Verkada API returned HTTP {st} for {endpoint}; retrying in {wait} seconds")
+        Metrics.retry('verkada', endpoint)
+        sleep(wait)
+        delay *= 2
+
 # Creates the initial token and logs in using the api key, returns the
 # newly opened session
 def login(args):
     logging.info("Logging in to Verkada")
     session = requests.Session()
+    session.verkada_base_url = args.verkada_base_url.rstrip('/')
     session.headers.update({
         "accept": "application/json",
         "x-api-key": args.verkada_api_key,
     })
-    response = session.post("https://api.verkada.com/token")
+    response = _request(session, "POST", "token")
     st = response.status_code
     if st >= 200 and st < 300:
         all_data = json.loads(response.text)
@@ -58,8 +135,8 @@ def login(args):
 
 # Generic helper for Verakada API endpoints
 def _get(session, endpoint):
-    logging.debug(f"GET Verkada API endpoint: {endpoint}")
-    response = session.get(f"https://api.verkada.com/{endpoint}")
+    logging.debug("GET Verkada API endpoint: %s", endpoint)
+    response = _request(session, "GET", endpoint)
 
     st = response.status_code
     if st >= 200 and st < 300:
@@ -82,6 +159,11 @@ def get_sites(session):
     all_data = json.loads(response.text)
     cameras = all_data.get("cameras", [])
 
+    return _transform_sites(cameras)
+
+# Transform the raw Verkada camera data into a dictionary of site IDs
+# -> timezones
+def _transform_sites(cameras):
     # We don't care about the cameras, so strip the sites information
     # out of the cameras list and just return a list of sites.
     output = {}
@@ -91,11 +173,11 @@ def get_sites(session):
         # therefore have its site_id be None (and no timezone).  So --
         # skip those.
         if site_id and site_id not in output:
-            tz = zoneinfo.ZoneInfo(camera['timezone'])
+            tz = TimeZones.lookup(camera['timezone'])
             output[site_id] = tz
 
-    logging.debug("Transformed Verkada sites")
-    logging.debug(pformat(output))
+    Log.debug_dump("Transformed Verkada sites", output)
+    Log.summary("Verkada sites", cameras=len(cameras), sites=len(output))
 
     return output
 
@@ -107,8 +189,12 @@ def get_doors(session, sites):
     all_data = json.loads(response.text)
     all_doors = all_data.get("doors", [])
 
-    logging.debug("Raw Verkada doors")
-    logging.debug(pformat(all_doors))
+    return _transform_doors(all_doors, sites)
+
+# Transform the raw Verkada door data into a dictionary of door IDs ->
+# doors
+def _transform_doors(all_doors, sites):
+    Log.debug_dump("Raw Verkada doors", all_doors)
 
     # Transform the doors into a dictionary indexed by door UUID.
     # Also link up the door with its corresponding timezone from the
@@ -121,7 +207,7 @@ def get_doors(session, sites):
         # the off chance that they don't, fall back to the old method
         # of getting the timezone from the site.
         if 'timezone' in door:
-            door['PYTZ'] = zoneinfo.ZoneInfo(door['timezone'])
+            door['PYTZ'] = TimeZones.lookup(door['timezone'])
         else:
             sid = door['site']['site_id']
             if sid in sites:
@@ -132,20 +218,57 @@ def get_doors(session, sites):
 
         output[door['door_id']] = door
 
-    logging.debug("Transformed Verkada doors")
-    logging.debug(pformat(output))
+    Log.debug_dump("Transformed Verkada doors", output)
+    Log.summary("Verkada doors", doors=len(output))
 
     return output
 
 # Retrieves Verkada door schedule
-# There is currently no API for this, so we fake loading it (from a file)
+#
+# There is currently no Verkada API for this, so we load it from a
+# JSON file (see data/verkada-door-schedule.json for an example).  The
+# result is a dictionary indexed by door name, each containing a list
+# of regular schedule entries with days / times converted to integers
+# that are easy to compile into weekly templates.
 def get_door_schedule(args, session):
-    # TODO This functionality is currently not implemented.
-    # Contributions would be welcomed.
-    #logging.info("Downloading Verkada regular schedule")
-    #with open(args.verkada_door_schedule) as fp:
-    #    return json.load(fp)
-    return {}
+    if not args.verkada_door_schedule:
+        logging.info("No Verkada regular door schedule file specified")
+        return {}
+
+    logging.info(f"Loading Verkada regular door schedule: {args.verkada_door_schedule}")
+    with open(args.verkada_door_schedule) as fp:
+        all_data = json.load(fp)
+
+    def _parse_minute(text):
+        t = datetime.strptime(text, "%H:%M").time()
+        return t.hour * 60 + t.minute
+
+    output = {}
+    for door in all_data.get('doors', []):
+        entries = []
+        for entry in door.get('schedule', []):
+            status = entry['status']
+            if status not in _weights:
+                logging.error(f"Unknown door status in regular schedule for {door['name']}: {status}")
+                logging.error("Cannot continue")
+                exit(1)
+
+            entries.append({
+                'door_status': status,
+                'days': [_day_name_map[day] for day in entry['days']],
+                'start_minute': _parse_minute(entry['start_time']),
+                'end_minute': _parse_minute(entry['end_time']),
+                'time_zone': entry.get('time_zone'),
+            })
+
+        output[door['name']] = entries
+
+    Log.debug_dump("Transformed Verkada regular door schedule", output)
+    Log.summary("Verkada regular schedule",
+                doors=len(output),
+                entries=sum(len(entries) for entries in output.values()))
+
+    return output
 
 # Retrieves all exception calendars
 #
@@ -158,8 +281,13 @@ def get_door_exception_calendars(session):
     all_data = json.loads(response.text)
     all_exception_cals = all_data.get("door_exception_calendars", [])
 
-    logging.debug("Raw exception calendars returned from Verkada")
-    logging.debug(pformat(all_exception_cals))
+    return _transform_exception_calendars(all_exception_cals)
+
+# Transform the raw Verkada door exception calendar data into a
+# dictionary of exception calendar IDs -> exception calendars
+def _transform_exception_calendars(all_exception_cals):
+    Log.debug_dump("Raw exception calendars returned from Verkada",
+                   all_exception_cals)
 
     # Just to be consistent with the other APIs, transform this list
     # of exception calendars into a dictionary indexed by UUID.  Also
@@ -200,14 +328,242 @@ def get_door_exception_calendars(session):
 
         output[exception_cal['door_exception_calendar_id']] = exception_cal
 
+    Log.summary("Verkada exception calendars",
+                calendars=len(output),
+                exceptions=sum(len(cal.get('exceptions', [])) for cal in output.values()))
+
     return output
 
 #-----------------------------------------------------------------
 
-# TODO: This is currently not implemented
-# Contributions would be welcomed.
-def _apply_regular_schedule_to_doors(doors, schedule):
-    pass
+# Resolve a list of (start, end, weight index) intervals -- which may
+# overlap -- into a sorted list of non-overlapping (start, end, weight
+# index) intervals.  Where intervals overlap, the status with the
+# highest weight wins (same priority as _merge_overlapping_exceptions()).
+def _resolve_intervals(intervals):
+    deltas = defaultdict(lambda: [0] * len(_weights))
+    for start, end, weight in intervals:
+        if start < end:
+            deltas[start][weight] += 1
+            deltas[end][weight] -= 1
+
+    output = []
+    active = [0] * len(_weights)
+    open_start = None
+    open_weight = None
+    for point in sorted(deltas):
+        for weight, delta in enumerate(deltas[point]):
+            active[weight] += delta
+
+        winner = None
+        for weight in range(len(_weights) - 1, -1, -1):
+            if active[weight] > 0:
+                winner = weight
+                break
+
+        if winner == open_weight:
+            continue
+        if open_weight is not None:
+            output.append((open_start, point, open_weight))
+        open_start = point
+        open_weight = winner
+
+    return tuple(output)
+
+# Compile a door's regular schedule entries into a weekly template: a
+# sorted tuple of non-overlapping (start, end, weight index) intervals,
+# measured in minutes since Monday 00:00 (local time).  Intervals are
+# split at (local) midnight, so that -- like the exploded exception
+# events -- each one falls within a single day; longer events are made
+# by _coalesce_events(), according to the coalesce_span setting.
+def _compile_weekly_template(entries):
+    raw = []
+    for entry in entries:
+        weight = _weights.index(entry['door_status'])
+        start = entry['start_minute']
+        end = entry['end_minute']
+        # An entry that ends "before" it starts runs past midnight
+        if end <= start:
+            end += _minutes_per_day
+
+        for day in entry['days']:
+            s = day * _minutes_per_day + start
+            e = day * _minutes_per_day + end
+            # Sunday entries that run past midnight wrap around to the
+            # beginning of the week
+            if e > _minutes_per_week:
+                raw.append((s, _minutes_per_week, weight))
+                raw.append((0, e - _minutes_per_week, weight))
+            else:
+                raw.append((s, e, weight))
+
+    output = []
+    for start, end, weight in _resolve_intervals(raw):
+        while start < end:
+            midnight = (start // _minutes_per_day + 1) * _minutes_per_day
+            output.append((start, min(end, midnight), weight))
+            start = midnight
+
+    return tuple(output)
+
+# Lay a weekly template out across every week of the config-specified
+# date range.  The output is a sorted list of (start, end, weight
+# index) tuples of not-timezone-specific (naive) datetimes; see
+# _apply_regular_schedule_to_doors() for where they are converted to
+# UTC for a specific door.
+def _expand_weekly_template(config, template):
+    output = []
+    first_date = config['first date']
+    last_date = config['last date']
+    monday = datetime.combine(first_date - timedelta(days=first_date.weekday()),
+                              time(0, 0, 0))
+    one_week = timedelta(days=7)
+    offsets = [(timedelta(minutes=s), timedelta(minutes=e), w)
+               for s, e, w in template]
+
+    # Clip the occurrences to the (local) days in the range we care
+    # about.  Since template intervals never span midnight, this is
+    # the same rule as for the exception events: keep the occurrences
+    # that start within the range.
+    window_start = datetime.combine(first_date, time(0, 0, 0))
+    window_end = datetime.combine(last_date + timedelta(days=1), time(0, 0, 0))
+
+    while monday < window_end:
+        for start_offset, end_offset, weight in offsets:
+            start = max(monday + start_offset, window_start)
+            end = min(monday + end_offset, window_end)
+            if start < end:
+                output.append((start, end, weight))
+        monday += one_week
+
+    return output
+
+# Apply the regular (weekly) schedule to each door.
+#
+# Each door's weekly schedule is compiled exactly once into a
+# template.  Doors with identical schedules share the same template
+# (and the same expansion across the date range), so that organizations
+# with many identically-scheduled doors only pay for a handful of
+# expansions.
+def _apply_regular_schedule_to_doors(config, doors, schedule):
+    logging.debug("Applying regular schedule to each door...")
+
+    templates = {}
+    expansions = {}
+    converted = {}
+    found_names = set()
+    for door in doors.values():
+        door[_regular_key] = []
+        entries = schedule.get(door['name'])
+        if not entries:
+            continue
+        found_names.add(door['name'])
+
+        key = tuple(sorted((e['door_status'], tuple(sorted(e['days'])),
+                            e['start_minute'], e['end_minute'])
+                           for e in entries))
+        if key not in templates:
+            templates[key] = _compile_weekly_template(entries)
+            expansions[key] = _expand_weekly_template(config, templates[key])
+
+        if 'PYTZ' not in door:
+            tz_name = entries[0]['time_zone']
+            if tz_name is None:
+                logging.error(f"Cannot determine the timezone of door {door['name']}; skipping its regular schedule")
+                continue
+            door['PYTZ'] = TimeZones.lookup(tz_name)
+        door_tz = door['PYTZ']
+
+        # Doors with the same template in the same timezone also share
+        # the conversion to UTC.
+        tz_key = (key, door_tz)
+        if tz_key not in converted:
+            converted[tz_key] = [
+                (_weights[weight], _to_epoch(start, door_tz), _to_epoch(end, door_tz))
+                for start, end, weight in expansions[key]
+            ]
+
+        door[_regular_key] = [
+            {
+                'door_status': status,
+                'start_epoch': start,
+                'end_epoch': end,
+            }
+            for status, start, end in converted[tz_key]
+        ]
+
+    for name in set(schedule.keys()) - found_names:
+        logging.warning(f"Regular schedule found for unknown door: {name}")
+
+    Log.summary("Regular schedule",
+                doors=len(found_names),
+                templates=len(templates),
+                events=sum(len(door[_regular_key]) for door in doors.values()))
+
+# Lay the (already merged) exception events of each door over that
+# door's regular schedule, in a single linear pass over both sorted
+# lists.  At any given moment, the status with the highest weight wins;
+# ties go to the exception.
+#
+# This pass also runs for doors without a regular schedule: it
+# guarantees that each door's final timeline is sorted and has no
+# overlapping events, even where _merge_overlapping_exceptions() leaves
+# some overlap (e.g., between more than two overlapping exceptions).
+# The door index (DoorIndex.py) relies on this.
+def _overlay_regular_schedule(doors):
+    for door in doors.values():
+        regular = door[_regular_key]
+        exceptions = door[_exploded_key]
+        if not exceptions:
+            door[_exploded_key] = list(regular)
+            continue
+
+        # Both lists are sorted by start time, so the boundaries of
+        # each list are (nearly) sorted already; sorting them is
+        # effectively linear, and merging the two is linear.  Empty
+        # events are skipped (their end boundary would otherwise sort
+        # before their start boundary).
+        def _boundaries(events, source):
+            for i, event in enumerate(events):
+                if event['start_epoch'] < event['end_epoch']:
+                    key = (_weight_index[event['door_status']], source, i)
+                    yield (event['start_epoch'], 1, key)
+                    yield (event['end_epoch'], 0, key)
+
+        boundaries = heapq.merge(sorted(_boundaries(regular, 0)),
+                                 sorted(_boundaries(exceptions, 1)))
+
+        # The active set holds (weight index, source, index) tuples, so
+        # the winner at any moment is simply the max of the set.
+        output = []
+        active = set()
+        open_key = None
+        open_start = None
+        pending = next(boundaries, None)
+        while pending is not None:
+            point = pending[0]
+            while pending is not None and pending[0] == point:
+                _, is_start, key = pending
+                if is_start:
+                    active.add(key)
+                else:
+                    active.discard(key)
+                pending = next(boundaries, None)
+
+            winner_key = max(active) if active else None
+            if winner_key == open_key:
+                continue
+
+            if open_key is not None and open_start < point:
+                output.append({
+                    'door_status': _weights[open_key[0]],
+                    'start_epoch': open_start,
+                    'end_epoch': point,
+                })
+            open_key = winner_key
+            open_start = point
+
+        door[_exploded_key] = output
 
 #-----------------------------------------------------------------
 
@@ -220,9 +576,8 @@ def _explode_exceptions(config, exceptions):
     # Recurring event
     def _handle_recurring(config, event, output):
         def _handle_recurring_daily(config, event, start, end, until, output):
-            logging.debug("Exploding recurring daily event")
-            logging.debug(f"Start: {start}")
-            logging.debug(f"Until: {until}")
+            logging.debug("Exploding recurring daily event: start %s, until %s",
+                          start, until)
 
             current_date = start
             one_day = timedelta(days=1)
@@ -322,8 +677,8 @@ def _explode_exceptions(config, exceptions):
             'end_time' : datetime.combine(event['date'], event['end_time']),
         }
 
-        logging.debug(f"Exploded non-recurring event: {event}")
-        logging.debug(f"Converted to item: {item}")
+        if Log.trace_enabled():
+            Log.trace("explode", {'event': event, 'item': item})
         output.append(item)
 
     #-----------------------------------------------------------------
@@ -336,7 +691,7 @@ def _explode_exceptions(config, exceptions):
     for calendar in exceptions.values():
         exploded_events = []
         for exception_event in calendar.get('exceptions', []):
-            logging.debug(f"Exploding: {pformat(exception_event)}")
+            logging.debug("Exploding: %s", Log.lazy(pformat, exception_event))
             if exception_event["recurrence_rule"] is None:
                 _handle_nonrecurring(config, exception_event, exploded_events)
             else:
@@ -358,12 +713,20 @@ def _explode_exceptions(config, exceptions):
         # get a final list of sorted exception events.
         calendar[_exploded_key] = exploded_events
 
+    Log.summary("Exploded exceptions",
+                calendars=len(exceptions),
+                events=sum(len(cal[_exploded_key]) for cal in exceptions.values()))
+
 # This function takes the not-timezone-specific dates / times and
 # applies them to the specific timezones of each door to which they
-# are mapped.
+# are mapped, converting each one to UTC epoch seconds.
 def _apply_exploded_exceptions_to_doors(doors, exceptions):
     logging.debug("Applying exploded lists of exceptions to each door...")
 
+    # Many doors typically share both an exception calendar and a
+    # timezone; only convert each calendar once per timezone.
+    converted = {}
+
     for door in doors.values():
         door[_exploded_key] = []
 
@@ -378,11 +741,20 @@ def _apply_exploded_exceptions_to_doors(doors, exceptions):
 
             door = doors[door_id]
             door_tz = door['PYTZ']
-            for exception_event in calendar[_exploded_key]:
+            key = (calendar['door_exception_calendar_id'], door_tz)
+            if key not in converted:
+                converted[key] = [
+                    (exception_event['door_status'],
+                     _to_epoch(exception_event['start_time'], door_tz),
+                     _to_epoch(exception_event['end_time'], door_tz))
+                    for exception_event in calendar[_exploded_key]
+                ]
+
+            for status, start, end in converted[key]:
                 new_event = {
-                    'door_status' : exception_event['door_status'],
-                    'start_time' : exception_event['start_time'].replace(tzinfo=door_tz),
-                    'end_time' : exception_event['end_time'].replace(tzinfo=door_tz),
+                    'door_status' : status,
+                    'start_epoch' : start,
+                    'end_epoch' : end,
                 }
                 door[_exploded_key].append(new_event)
 
@@ -395,10 +767,13 @@ def _apply_exploded_exceptions_to_doors(doors, exceptions):
         if len(door[_exploded_key]) == 0:
             continue
 
-        door[_exploded_key].sort(key=lambda x: x['start_time'])
+        door[_exploded_key].sort(key=lambda x: x['start_epoch'])
 
 # Now that all the exception events on a given door have been sorted
-# by start_time, find and merge overlapping exception events.
+# by start_epoch, find and merge overlapping exception events.
+#
+# Exploded exception events never span midnight, so two overlapping
+# events are necessarily on the same (local) date.
 def _merge_overlapping_exceptions(doors):
     for door in doors.values():
         previous = None
@@ -411,38 +786,37 @@ def _merge_overlapping_exceptions(doors):
                 previous = current
                 continue
 
-            if previous['end_time'].date() == current['start_time'].date() and \
-               previous['end_time'] > current['start_time']:
-                if previous['end_time'] >= current['end_time']:
+            if previous['end_epoch'] > current['start_epoch']:
+                if previous['end_epoch'] >= current['end_epoch']:
                     if _weights.index(previous['door_status']) < _weights.index(current['door_status']):
                         new_exception_list[-1] = {
                             'door_status': previous['door_status'],
-                            'start_time': previous['start_time'],
-                            'end_time': current['start_time']
+                            'start_epoch': previous['start_epoch'],
+                            'end_epoch': current['start_epoch']
                         }
                         new_exception_list.append(current)
                         new_exception_list.append({
                             'door_status': previous['door_status'],
-                            'start_time': current['end_time'],
-                            'end_time': previous['end_time']
+                            'start_epoch': current['end_epoch'],
+                            'end_epoch': previous['end_epoch']
                         })
                         previous = new_exception_list[-1]
 
                     else:
-                        current['start_time'] = previous['end_time']
-                        if current['start_time'] < current['end_time']:
+                        current['start_epoch'] = previous['end_epoch']
+                        if current['start_epoch'] < current['end_epoch']:
                             new_exception_list.append(current)
                             previous = current
 
                 else:
                     if _weights.index(previous['door_status']) < _weights.index(current['door_status']):
-                        new_exception_list[-1]['end_time'] = current['start_time']
+                        new_exception_list[-1]['end_epoch'] = current['start_epoch']
                         new_exception_list.append(current)
                         previous = current
 
                     else:
-                        current['start_time'] = previous['end_time']
-                        if current['start_time'] < current['end_time']:
+                        current['start_epoch'] = previous['end_epoch']
+                        if current['start_epoch'] < current['end_epoch']:
                             new_exception_list.append(current)
                             previous = current
 
@@ -452,6 +826,89 @@ def _merge_overlapping_exceptions(doors):
 
         door[_exploded_key] = new_exception_list
 
+#-----------------------------------------------------------------
+
+# The UTC epoch seconds of midnight at the start of the given (local)
+# day in the given timezone
+@lru_cache(maxsize=4096)
+def _local_midnight(day, tz):
+    return _to_epoch(datetime.combine(day, time(0, 0, 0)), tz)
+
+# The [start, end) UTC epoch seconds of the config-specified date range
+# in the given timezone: the merged events of a door in that timezone
+# all start within it
+def door_window(config, tz):
+    return (_local_midnight(config['first date'], tz),
+            _local_midnight(config['last date'] + timedelta(days=1), tz))
+
+# Group a door's sorted, non-overlapping events into runs of
+# back-to-back events with the same status that can be shown as a
+# single event.  A run may not span more than config['coalesce span']:
+# None (never combine events), 'day' (a run must end by midnight after
+# its start, in the door's timezone), or a number of seconds.
+#
+# This is used on both the merged Verkada events and the downloaded
+# Google Calendar events (whose status is in their 'description'), so
+# that both are compared in the same normalized form.
+def coalesce_runs(config, events, tz, status_key='door_status'):
+    span = config['coalesce span']
+    if span is None:
+        return [[event] for event in events]
+
+    runs = []
+    run_status = None
+    run_end = None
+    limit = None
+    for event in events:
+        status = event.get(status_key)
+        if runs and status == run_status and event['start_epoch'] == run_end:
+            # Most runs are a single event, so only work out how far
+            # this run may extend once there is something to add to it
+            if limit is None:
+                run_start = runs[-1][0]['start_epoch']
+                if span == 'day':
+                    day = datetime.fromtimestamp(run_start, tz).date()
+                    limit = _local_midnight(day + timedelta(days=1), tz)
+                else:
+                    limit = run_start + span
+            if event['end_epoch'] <= limit:
+                runs[-1].append(event)
+                run_end = event['end_epoch']
+                continue
+
+        runs.append([event])
+        run_status = status
+        run_end = event['end_epoch']
+        limit = None
+
+    return runs
+
+# After the overlay, pieces of the timeline often touch other pieces
+# with the same status (e.g., an exception split by a higher priority
+# exception, or back-to-back daily occurrences).  Combine them so that
+# each becomes a single Google Calendar event.
+def _coalesce_events(config, doors):
+    before = 0
+    after = 0
+    for door in doors.values():
+        events = door[_exploded_key]
+        door_tz = door.get('PYTZ', timezone.utc)
+        output = []
+        for run in coalesce_runs(config, events, door_tz):
+            if len(run) == 1:
+                output.append(run[0])
+            else:
+                output.append({
+                    'door_status': run[0]['door_status'],
+                    'start_epoch': run[0]['start_epoch'],
+                    'end_epoch': run[-1]['end_epoch'],
+                })
+        before += len(events)
+        after += len(output)
+        door[_exploded_key] = output
+
+    Log.summary("Coalesce", events_before=before, events_after=after)
+
 # Note: Verkada doors have site information, which, in turn, have
 # timezone information corresponding to where the door is physically
 # located.  Verkada door exception calendars do *not* have timezone
@@ -469,15 +926,101 @@ def _merge_overlapping_exceptions(doors):
 # recurring event which, itself, may have exceptions.
 def merge_data(args, config, doors, schedule, exceptions):
     logging.info("Processing Verkada data")
-    _apply_regular_schedule_to_doors(doors, schedule)
+
+    # If nothing has changed since the last run, start from the
+    # snapshot of the merged schedule instead of re-expanding everything
+    input_digest = None
+    if config.get('state dir'):
+        input_digest = Snapshot.digest(config['first date'], config['last date'],
+                                       config['coalesce span'],
+                                       doors, schedule, exceptions)
+        output = _read_snapshot(config, input_digest)
+        if output is not None:
+            return output
+
+    _apply_regular_schedule_to_doors(config, doors, schedule)
     _explode_exceptions(config, exceptions)
     _apply_exploded_exceptions_to_doors(doors, exceptions)
     _merge_overlapping_exceptions(doors)
+    _overlay_regular_schedule(doors)
+    _coalesce_events(config, doors)
 
     # Make a dictionary indexed by door name containing each door's
-    # list of exception events
+    # list of exception events.  Now that all the merging is done,
+    # convert the UTC epoch seconds back to datetimes (in the door's
+    # timezone) for display and for writing to the Google Calendar.
     output = {}
     for door in doors.values():
+        door_tz = door.get('PYTZ', timezone.utc)
+        for event in door[_exploded_key]:
+            event['start_time'] = datetime.fromtimestamp(event['start_epoch'], door_tz)
+            event['end_time'] = datetime.fromtimestamp(event['end_epoch'], door_tz)
         output[door['name']] = door[_exploded_key]
 
+    Log.summary("Merged Verkada data",
+                doors=len(output),
+                events=sum(len(events) for events in output.values()))
+
+    if input_digest is not None:
+        _write_snapshot(config, input_digest, doors, output)
+
+    return output
+
+# The [start, end) UTC epoch seconds of the date range across all the
+# doors, each in its own timezone
+def _window_epochs(config, doors):
+    time_zones = {door.get('PYTZ') or timezone.utc for door in doors.values()}
+    windows = [door_window(config, tz) for tz in time_zones] or \
+        [door_window(config, timezone.utc)]
+    return (min(start for start, _ in windows),
+            max(end for _, end in windows))
+
+def _write_snapshot(config, input_digest, doors, output):
+    # One row per door name (like the output of merge_data())
+    rows = {}
+    for door in doors.values():
+        site = door.get('site') or {}
+        door_tz = door.get('PYTZ')
+        rows[door['name']] = (door['name'],
+                              site.get('name') or site.get('site_id'),
+                              door_tz.key if door_tz is not None else None,
+                              output[door['name']])
+
+    first_epoch, last_epoch = _window_epochs(config, doors)
+    os.makedirs(config['state dir'], exist_ok=True)
+    Snapshot.write(Snapshot.filename(config), input_digest,
+                   first_epoch, last_epoch, list(rows.values()), _weights)
+
+# Returns the merged schedule from the snapshot, or None if there is no
+# usable snapshot for these inputs
+def _read_snapshot(config, input_digest):
+    filename = Snapshot.filename(config)
+    if not os.path.exists(filename):
+        return None
+    try:
+        snapshot = Snapshot.load(filename)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring merged schedule snapshot {filename}: {e}")
+        return None
+
+    try:
+        if snapshot.digest != input_digest:
+            logging.info("Verkada data has changed since the merged schedule snapshot was written")
+            return None
+
+        output = {}
+        for i, name in enumerate(snapshot.names):
+            door_tz = TimeZones.lookup(snapshot.time_zones[i])
+            events = snapshot.events(i)
+            for event in events:
+                event['start_time'] = datetime.fromtimestamp(event['start_epoch'], door_tz)
+                event['end_time'] = datetime.fromtimestamp(event['end_epoch'], door_tz)
+            output[name] = events
+    finally:
+        snapshot.close()
+
+    Log.summary("Merged Verkada data (from snapshot)",
+                doors=len(output),
+                events=sum(len(events) for events in output.values()))
+
     return output
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Answer "what state is door X in at time T / over this range" from the
+# merged schedule snapshot that the sync writes to the state directory,
+# either from the command line or as a small HTTP server:
+#
+#   doorStatus.py --config config.ini --door "Front door" --at 2025-06-02T09:00
+#   doorStatus.py --config config.ini --site "Main campus" \
+#       --start 2025-06-02T00:00 --end 2025-06-03T00:00
+#   doorStatus.py --config config.ini --serve 8080
+#
+# The HTTP server answers:
+#
+#   GET /doors
+#   GET /doors/<door name>?at=<time>
+#   GET /doors/<door name>?start=<time>&end=<time>
+#   GET /sites/<site name>?at=<time>
+#   GET /sites/<site name>?start=<time>&end=<time>
+#
+# Times are ISO 8601; times without a timezone are taken to be UTC.
+# The snapshot is reloaded whenever the sync rewrites it.
+
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import Config
+import Snapshot
+import DoorIndex
+
+def _parse_time(text):
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def _to_json(result):
+    if isinstance(result, datetime):
+        return result.isoformat()
+    if isinstance(result, dict):
+        return {key: _to_json(value) for key, value in result.items()}
+    if isinstance(result, list):
+        return [_to_json(value) for value in result]
+    return result
+
+# Run a door or site query.  Exactly one of door / site, and either
+# "at" or both "start" and "end", must be given.
+def query(index, door=None, site=None, at=None, start=None, end=None):
+    if (door is None) == (site is None):
+        raise ValueError("Specify exactly one of a door or a site")
+    if at is not None:
+        if start is not None or end is not None:
+            raise ValueError("Specify either a time, or a start and end time, not both")
+        if door is not None:
+            return index.status_at(door, at)
+        return index.site_status_at(site, at)
+    if start is None or end is None:
+        raise ValueError("Specify either a time, or a start and end time")
+    if door is not None:
+        return index.statuses_between(door, start, end)
+    return index.site_statuses_between(site, start, end)
+
+#-----------------------------------------------------------------
+
+# Keeps the most recent door index loaded, reloading it when the sync
+# replaces the file.  Requests acquire() the index and release() it
+# when they are done, so that a replaced index (and its mmap) is closed
+# as soon as no request is using it.
+class _IndexCache:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.index = None
+        # Number of requests using each index
+        self.users = {}
+
+    def acquire(self):
+        mtime = os.stat(Snapshot.filename(self.config)).st_mtime
+        with self.lock:
+            if mtime != self.mtime:
+                logging.info("Loading door index")
+                old = self.index
+                self.index = DoorIndex.load(self.config)
+                self.mtime = mtime
+                if old is not None and old not in self.users:
+                    old.close()
+            self.users[self.index] = self.users.get(self.index, 0) + 1
+            return self.index
+
+    def release(self, index):
+        with self.lock:
+            self.users[index] -= 1
+            if self.users[index] == 0:
+                del self.users[index]
+                if index is not self.index:
+                    index.close()
+
+def _make_handler(cache):
+    class DoorStatusHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(_to_json(body)).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+        def do_GET(self):
+            try:
+                index = cache.acquire()
+            except (OSError, ValueError) as e:
+                self._send(503, {'error': f"Door index unavailable: {e}"})
+                return
+
+            try:
+                self._answer(index)
+            finally:
+                cache.release(index)
+
+        def _answer(self, index):
+            parts = urlsplit(self.path)
+            path = [unquote(p) for p in parts.path.strip('/').split('/')]
+            params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+
+            try:
+                if path == ['doors']:
+                    self._send(200, {'doors': sorted(index.doors)})
+                    return
+                if len(path) != 2 or path[0] not in ('doors', 'sites'):
+                    self._send(404, {'error': 'Not found'})
+                    return
+
+                times = {key: _parse_time(params[key])
+                         for key in ('at', 'start', 'end') if key in params}
+                kind = 'door' if path[0] == 'doors' else 'site'
+                result = query(index, **{kind: path[1]}, **times)
+            except KeyError as e:
+                self._send(404, {'error': str(e.args[0])})
+                return
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+
+            self._send(200, {
+                kind: path[1],
+                'window_start': datetime.fromtimestamp(index.first_epoch, timezone.utc),
+                'window_end': datetime.fromtimestamp(index.last_epoch, timezone.utc),
+                'result': result,
+            })
+
+    return DoorStatusHandler
+
+def serve(config, host, port):
+    server = ThreadingHTTPServer((host, port), _make_handler(_IndexCache(config)))
+    logging.info(f"Serving door status queries on http://{host}:{port}")
+    server.serve_forever()
+
+#-----------------------------------------------------------------
+
+def setup_cli():
+    parser = argparse.ArgumentParser(description='Query the door status index written by the VerCalBot')
+
+    parser.add_argument('--config',
+                        required=True,
+                        help='Filename of config INI file (state_dir must be set)')
+    parser.add_argument('--door',
+                        help='Name of the door to query')
+    parser.add_argument('--site',
+                        help='Name of the site to query (all doors at the site)')
+    parser.add_argument('--at',
+                        help='Query the status at this time (ISO 8601)')
+    parser.add_argument('--start',
+                        help='Query the statuses from this time (ISO 8601)')
+    parser.add_argument('--end',
+                        help='Query the statuses until this time (ISO 8601)')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='Serve queries over HTTP on this port')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to serve HTTP queries on (default: 127.0.0.1)')
+    parser.add_argument('--verbose',
+                        action=argparse.BooleanOptionalAction)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        logging.error(f"Cannot find {args.config}")
+        exit(1)
+
+    return args
+
+def main():
+    args = setup_cli()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    config = Config.read_config(args)
+    if config['state dir'] is None:
+        logging.error("state_dir is not set in the config file")
+        exit(1)
+
+    if args.serve:
+        serve(config, args.host, args.serve)
+        return
+
+    try:
+        index = DoorIndex.load(config)
+    except (OSError, ValueError) as e:
+        logging.error(f"Cannot load the door index: {e}")
+        exit(1)
+
+    try:
+        times = {key: _parse_time(getattr(args, key))
+                 for key in ('at', 'start', 'end') if getattr(args, key)}
+        result = query(index, door=args.door, site=args.site, **times)
+    except (KeyError, ValueError) as e:
+        logging.error(e.args[0])
+        exit(1)
+
+    json.dump(_to_json(result), sys.stdout, indent=4)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,21 @@
 
 import os
 import json
+import time
+import pstats
 import logging
+import cProfile
 import argparse
 
 from pprint import pformat
+from bisect import bisect_left, bisect_right
+from datetime import timezone
+from collections import defaultdict
 
+import Log
 import Config
+import Metrics
+import EmailDispatcher
 import GoogleCalendar
 import Verkada
 
@@ -19,6 +28,7 @@ def setup_logging(args):
         level = logging.DEBUG
 
     logging.basicConfig(level=level)
+    Log.setup(args)
 
 def setup_cli():
     parser = argparse.ArgumentParser()
@@ -28,8 +38,7 @@ def setup_cli():
                         help='Filename of config INI file')
 
     parser.add_argument('--google-creds',
-                        required=True,
-                        help='Google credentials JSON file')
+                        help='Google credentials JSON file (required unless --google-base-url is given)')
 
     default_val = os.environ.get("GOOGLE_CALENDAR_ID", None)
     required_val = False if default_val else True
@@ -38,14 +47,11 @@ def setup_cli():
                         required=required_val,
                         help='Google Calendar ID')
 
-    # TODO: This functionality is currently unimplemented.
-    # Intent: Load the "regular" schedule from a JSON file because
-    # -- as of May 2025 -- there's no Verkada API to download that
-    # information directly from Verkada.
-    # Contributions would be welcome.
-    #parser.add_argument('--verkada-door-schedule',
-    #                    required=True,
-    #                    help='Load Verkada door schedule from this JSON file')
+    # Load the "regular" schedule from a JSON file because -- as of
+    # May 2025 -- there's no Verkada API to download that information
+    # directly from Verkada.
+    parser.add_argument('--verkada-door-schedule',
+                        help='Load Verkada regular door schedule from this JSON file')
 
     default_val = os.environ.get("VERKADA_API_KEY", None)
     required_val = False if default_val else True
@@ -54,6 +60,19 @@ def setup_cli():
                         default=default_val,
                         help='Verkada API key (defaults to VERKADA_API_KEY env var, if set)')
 
+    default_val = os.environ.get("VERKADA_BASE_URL", "https://api.verkada.com")
+    parser.add_argument('--verkada-base-url',
+                        default=default_val,
+                        help='Verkada API base URL (defaults to VERKADA_BASE_URL env var, if set, or https://api.verkada.com)')
+
+    parser.add_argument('--google-base-url',
+                        default=os.environ.get("GOOGLE_BASE_URL", None),
+                        help='Alternate Google API base URL, e.g., a local stand-in server for testing (defaults to GOOGLE_BASE_URL env var, if set).  Google credentials are not used when this is set.')
+
+    parser.add_argument('--smtp-password',
+                        default=os.environ.get("SMTP_PASSWORD", None),
+                        help='SMTP password for sending email notifications (defaults to SMTP_PASSWORD env var, if set)')
+
     parser.add_argument('--dry-run',
                         action=argparse.BooleanOptionalAction)
 
@@ -62,12 +81,30 @@ def setup_cli():
     parser.add_argument('--debug',
                         action=argparse.BooleanOptionalAction)
 
+    parser.add_argument('--trace-file',
+                        help='Write a sampled JSON trace (one record per line) to this file')
+    parser.add_argument('--metrics-prom',
+                        help='Write run metrics to this file in Prometheus textfile format')
+    parser.add_argument('--metrics-json',
+                        help='Write run metrics to this file as a JSON summary')
+    parser.add_argument('--profile',
+                        help='Run under cProfile and write the stats to this file (and a text summary to FILE.txt)')
+
+    parser.add_argument('--trace-sample-rate',
+                        type=float,
+                        default=0.01,
+                        help='Fraction of per-event records to write to the JSON trace (default: 0.01)')
+
     args = parser.parse_args()
 
     setup_logging(args)
 
-    # Sanity check
-    if not os.path.exists(args.google_creds):
+    # Sanity check (credentials are not used with an alternate Google
+    # API base URL)
+    if not args.google_creds and not args.google_base_url:
+        logging.error("--google-creds is required")
+        exit(1)
+    if args.google_creds and not os.path.exists(args.google_creds):
         logging.error(f"Cannot find {args.google_creds}")
         exit(1)
 
@@ -87,99 +124,189 @@ def compare(config, google_events, verkada_events):
 
     # For every door in the Verkada events:
     for door_name in verkada_events:
+        # Only the events that start within the door's (local) date
+        # range are compared.  The Verkada events all do; Google
+        # Calendar events outside of it (which are downloaded because
+        # the download covers every timezone) are left alone.
+        door_tz = verkada_events[door_name][0]['start_time'].tzinfo \
+            if verkada_events[door_name] else timezone.utc
+        window_start, window_end = Verkada.door_window(config, door_tz)
+        door_verkada_events = [event for event in verkada_events[door_name]
+                               if window_start <= event['start_epoch'] < window_end]
+
         # If there are no events with this door name in Google
         # Calendar, just add all the Verkada events for that door
         if door_name not in google_events:
-            for event in verkada_events[door_name]:
+            for event in door_verkada_events:
                 event["name"] = door_name
 
-            to_add.extend(verkada_events[door_name])
+            to_add.extend(door_verkada_events)
             continue
 
-        # Otherwise, we have to do a more detailed comparison.
-        for ve in verkada_events[door_name]:
-            found = False
-            for ge in google_events[door_name]:
-                # Note: both the Verkada and Google event lists
-                # are sorted.  Given that there might be a lot of
-                # events, we can at least take one simple shortcut
-                # to cut the loop iterations.
-                if ve['start_time'] > ge['start']:
-                    break
-
-                # If we find this Verkada event in the list of Google
-                # events, then remove it from the list of Google
-                # events and move on to the next Verkada event
-                if ve["door_status"] == ge["description"] and \
-                   ve["start_time"] == ge["start"] and \
-                   ve["end_time"] == ge["end"]:
-                    # If we did find this Verkada event, then remove
-                    # it from the list of Google events so that we
-                    # don't have to search it again (and we
-                    # effectively mark it as "found", so that it won't
-                    # be matched again).
-                    google_events[door_name].remove(ge)
-                    found = True
-                    break
-
-            # If we didn't find the Verkada event in the Google events
-            # for this door, add it.
-            if not found:
+        # Otherwise, we have to do a more detailed comparison.  Bring
+        # this door's Google events into the same normalized form as
+        # the Verkada events (i.e., coalesce back-to-back events with
+        # the same status, in the door's timezone), and index the
+        # resulting runs of Google events by (status, start, end) --
+        # where start and end are UTC epoch seconds -- so that each
+        # Verkada event can be matched with a single lookup.  A run of
+        # Google events that matches is left alone; one that doesn't is
+        # deleted in its entirety.
+        door_google_events = [event for event in google_events[door_name]
+                              if window_start <= event['start_epoch'] < window_end]
+        remaining = defaultdict(list)
+        for run in Verkada.coalesce_runs(config, door_google_events,
+                                         door_tz, 'description'):
+            key = (run[0].get("description"), run[0]["start_epoch"],
+                   run[-1]["end_epoch"])
+            remaining[key].append(run)
+
+        for ve in door_verkada_events:
+            # If we find this Verkada event in the Google events,
+            # remove it from the index so that it won't be matched
+            # again (i.e., it is effectively marked as "found").
+            # Otherwise, add it.
+            key = (ve["door_status"], ve["start_epoch"], ve["end_epoch"])
+            matches = remaining.get(key)
+            if matches:
+                matches.pop()
+            else:
                 ve["name"] = door_name
                 to_add.append(ve)
 
         # After we're done examining all the Verkada events for this
-        # door name, anything that's left in google_events for this
-        # door name should be deleted
-        to_delete.extend(google_events[door_name])
-
-    logging.debug("Google events to delete from the Google Calendar")
-    logging.debug(pformat(to_delete))
-    logging.debug("Verkada events to add to the Google Calendar")
-    logging.debug(pformat(to_add))
+        # door name, anything that's left in the index for this door
+        # name should be deleted.  Show them in the door's timezone
+        # (like the events being added), e.g., in the email digest.
+        for matches in remaining.values():
+            for run in matches:
+                for event in run:
+                    event['start'] = event['start'].astimezone(door_tz)
+                    event['end'] = event['end'].astimezone(door_tz)
+                to_delete.extend(run)
+
+    Log.debug_dump("Google events to delete from the Google Calendar",
+                   to_delete)
+    Log.debug_dump("Verkada events to add to the Google Calendar",
+                   to_add)
+    Log.summary("Compare", to_delete=len(to_delete), to_add=len(to_add))
 
     return to_delete, to_add
 
-def main():
-    args = setup_cli()
-
+# Order the changes from compare() by how soon they matter, so that
+# the near term is correct even if a run cannot apply all of them:
+# events that are in progress or upcoming come first, soonest first,
+# then past events, most recent first.
+#
+# A replaced event's delete is grouped with the adds that overlap it
+# (and only those: a door's whole timeline shifted by an hour is many
+# small groups, not one big one).  Each add is in at most one group,
+# with the soonest delete that it overlaps.  Within a group, the
+# operations are in the same order, except that the delete comes right
+# after the first add -- so that a group cut short by the API budget
+# (see GoogleCalendar.apply()) never deletes an event without adding
+# its replacement.  Returns a list of groups, each a list of
+# ("delete", event) / ("add", event) operations.
+def schedule_changes(to_delete, to_add, now):
+    def _key(event):
+        if event['end_epoch'] > now:
+            return (0, max(event['start_epoch'] - now, 0))
+        return (1, now - event['end_epoch'])
+
+    doors = defaultdict(lambda: ([], []))
+    for event in to_delete:
+        doors[event.get('summary')][0].append(event)
+    for event in to_add:
+        doors[event['name']][1].append(event)
+
+    groups = []
+    for deletes, adds in doors.values():
+        # A door's events to add come from its merged timeline, so they
+        # do not overlap: sorted by start, they are sorted by end, too
+        adds.sort(key=lambda x: x['start_epoch'])
+        starts = [event['start_epoch'] for event in adds]
+        ends = [event['end_epoch'] for event in adds]
+        grouped = [False] * len(adds)
+
+        for event in sorted(deletes, key=_key):
+            lo = bisect_right(ends, event['start_epoch'])
+            hi = bisect_left(starts, event['end_epoch'])
+            replacements = []
+            for i in range(lo, hi):
+                if not grouped[i]:
+                    grouped[i] = True
+                    replacements.append(('add', adds[i]))
+            replacements.sort(key=lambda x: _key(x[1]))
+            groups.append(replacements[:1] + [('delete', event)] + replacements[1:])
+
+        groups.extend([('add', event)] for i, event in enumerate(adds)
+                      if not grouped[i])
+
+    groups.sort(key=lambda group: min(_key(event) for _, event in group))
+    return groups
+
+def sync(args):
     logging.info(f"Reading config: {args.config}")
     config = Config.read_config(args)
 
+    # Email notifications are sent in the background
+    if not args.dry_run:
+        EmailDispatcher.start(args, config)
+
+    # After a swap rebuild, we synchronize a different calendar than
+    # the one that was configured
+    args.google_calendar_id = GoogleCalendar.active_calendar_id(args, config)
+
     # Get a dictionary of door names, each containing a sorted list of
     # events starting from 5 days ago.
-    google_service = GoogleCalendar.login(args)
-    google_events = GoogleCalendar.download(google_service, args, config)
-
-    verkada_service = Verkada.login(args)
-    # Get a listing of sites (which contain timezone information).
-    #
-    # As of May 2025, obtaining the Verkada sites (in order to get the
-    # timezones where doors are physically located) requires access to
-    # the Cameras APId, and therefore the API key used must have read
-    # permissions on the Camera API.  This may change in future
-    # Verkada functionality.
-    verkada_sites = Verkada.get_sites(verkada_service)
-    # Get the listing of doors, and merge in the size/timezone info
-    verkada_doors = Verkada.get_doors(verkada_service,
-                                      verkada_sites)
-    # Get the main schedule of the doors
-    verkada_schedule = \
-        Verkada.get_door_schedule(args, verkada_service)
-    # Get all the door exception calendars
-    verkada_exceptions = \
-        Verkada.get_door_exception_calendars(verkada_service)
+    with Metrics.stage("google_download"):
+        google_service = GoogleCalendar.login(args)
+        google_events = GoogleCalendar.download(google_service, args, config)
+    Metrics.count("google_events",
+                  sum(len(events) for events in google_events.values()))
+
+    with Metrics.stage("verkada_fetch"):
+        verkada_service = Verkada.login(args)
+        # Get a listing of sites (which contain timezone information).
+        #
+        # As of May 2025, obtaining the Verkada sites (in order to get
+        # the timezones where doors are physically located) requires
+        # access to the Cameras APId, and therefore the API key used
+        # must have read permissions on the Camera API.  This may
+        # change in future Verkada functionality.
+        verkada_sites = Verkada.get_sites(verkada_service)
+        # Get the listing of doors, and merge in the size/timezone info
+        verkada_doors = Verkada.get_doors(verkada_service,
+                                          verkada_sites)
+        # Get the main schedule of the doors
+        verkada_schedule = \
+            Verkada.get_door_schedule(args, verkada_service)
+        # Get all the door exception calendars
+        verkada_exceptions = \
+            Verkada.get_door_exception_calendars(verkada_service)
+    Metrics.count("verkada_doors", len(verkada_doors))
+    Metrics.count("verkada_exception_calendars", len(verkada_exceptions))
 
     # Merge all the Verkada data together to get a final dictionary of
     # door names, each containing a sorted list of exception events.
-    verkada_events = \
-        Verkada.merge_data(args, config,
-                           verkada_doors, verkada_schedule, verkada_exceptions)
-
-    to_delete, to_add = compare(config, google_events, verkada_events)
+    with Metrics.stage("merge_data"):
+        verkada_events = \
+            Verkada.merge_data(args, config,
+                               verkada_doors, verkada_schedule, verkada_exceptions)
+    num_verkada_events = sum(len(events) for events in verkada_events.values())
+    Metrics.count("verkada_events", num_verkada_events)
+
+    with Metrics.stage("compare"):
+        to_delete, to_add = compare(config, google_events, verkada_events)
+    Metrics.count("to_delete", len(to_delete))
+    Metrics.count("to_add", len(to_add))
 
     if len(to_delete) == 0 and len(to_add) == 0:
         logging.info("Google calendar and Verkada calendars are already in sync.  Hooray!")
+        Metrics.count("pending_operations", 0)
+        # There may still be a digest of changes from previous runs
+        # that is now due to be sent
+        EmailDispatcher.notify(config, to_delete, to_add)
     elif args.dry_run:
         # If we're in dry-run mode, just print out the changes
         logging.basicConfig(level=logging.INFO, force=True)
@@ -188,14 +315,60 @@ def main():
         logging.info("Dry run: Verkada events that would have been added")
         logging.info(pformat(to_add))
     else:
-        # Update the calendar
-        for event in to_delete:
-            logging.debug(event)
-            GoogleCalendar.delete(event, google_service, args, config)
-        for event in to_add:
-            logging.debug(event)
-            GoogleCalendar.add(event, google_service, args, config)
+        # If almost everything is changing, it's cheaper to rebuild
+        # the calendar from scratch
+        rebuilt = False
+        if GoogleCalendar.should_rebuild(config, len(to_delete) + len(to_add),
+                                         num_verkada_events):
+            with Metrics.stage("rebuild"):
+                rebuilt = GoogleCalendar.rebuild(google_service, args, config,
+                                                 verkada_events)
+
+        # Update the calendar, soonest changes first
+        if not rebuilt:
+            with Metrics.stage("apply"):
+                groups = schedule_changes(to_delete, to_add, time.time())
+                num_applied = GoogleCalendar.apply(google_service, args,
+                                                   config, groups)
+            operations = [operation for group in groups for operation in group]
+            applied = operations[:num_applied]
+            to_delete = [event for action, event in applied if action == 'delete']
+            to_add = [event for action, event in applied if action == 'add']
+            pending = len(operations) - num_applied
+            if pending:
+                logging.warning(f"{pending} changes to the Google Calendar are pending; they will be applied by later runs")
+        else:
+            pending = 0
+        Metrics.count("pending_operations", pending)
+        Log.summary("Apply", deleted=len(to_delete), added=len(to_add),
+                    pending=pending)
+        EmailDispatcher.notify(config, to_delete, to_add)
         logging.info("Finished synchronizing Google calendar and Verkada calendars")
 
+# Write the raw cProfile data (for use with pstats, snakeviz, etc.) as
+# well as a human-readable listing of the hottest functions.
+def write_profile(profiler, filename):
+    logging.info(f"Writing cProfile data to {filename} and {filename}.txt")
+    profiler.dump_stats(filename)
+    with open(f"{filename}.txt", "w") as fp:
+        stats = pstats.Stats(profiler, stream=fp)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(40)
+
+def main():
+    args = setup_cli()
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(sync, args)
+        write_profile(profiler, args.profile)
+    else:
+        sync(args)
+
+    with Metrics.stage("email"):
+        EmailDispatcher.close()
+    Metrics.write(args)
+    Log.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# Benchmark the stages of the sync pipeline against synthetic
+# organizations of increasing size, and check the results against a
+# baseline file to catch performance regressions.
+#
+# Each stage is timed separately (on a fresh copy of its input):
+#
+# - Verkada._explode_exceptions()
+# - Verkada._apply_exploded_exceptions_to_doors()
+# - Verkada._merge_overlapping_exceptions()
+# - Verkada.merge_data() (including the regular schedule)
+# - Verkada.merge_data(), starting from the merged schedule snapshot
+# - main.compare()
+#
+# Examples:
+#
+#   # Record a new baseline
+#   python3 tests/benchmark.py --update-baseline
+#
+#   # Compare against the baseline; exits with status 1 if any stage
+#   # is more than 25% slower (or uses more than 25% more memory)
+#   python3 tests/benchmark.py --threshold 0.25
+
+import os
+import sys
+import copy
+import json
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Verkada
+import main as vercalbot
+
+import verkadaSyntheticData
+
+_default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'benchmarkBaseline.json')
+
+# Scale points are "DOORSxCALENDARS"
+_default_scales = '100x20,500x100,2000x400'
+
+def _prepare(scale, config, snapshot_config, args):
+    num_doors, num_calendars = [int(x) for x in scale.split('x')]
+    data = verkadaSyntheticData.generate(num_doors, num_calendars,
+                                         config['first date'],
+                                         config['last date'],
+                                         exceptions_per_calendar=args.exceptions_per_calendar,
+                                         seed=args.seed)
+
+    # The transforms modify the raw data in place, so always work on a
+    # copy of it
+    def _transform():
+        raw = copy.deepcopy(data)
+        doors = Verkada._transform_doors(raw['doors']['doors'], sites)
+        exceptions = Verkada._transform_exception_calendars(
+            raw['door_exception_calendars']['door_exception_calendars'])
+        return doors, exceptions
+
+    sites = Verkada._transform_sites(data['cameras']['cameras'])
+    doors, exceptions = _transform()
+
+    # Load the regular schedule the same way get_door_schedule() does
+    schedule_file = os.path.join(args.workdir, f"schedule-{scale}.json")
+    with open(schedule_file, 'w') as fp:
+        json.dump(data['schedule'], fp)
+    schedule_args = argparse.Namespace(verkada_door_schedule=schedule_file)
+    schedule = Verkada.get_door_schedule(schedule_args, None)
+
+    # Snapshot the input of each stage by running the pipeline once
+    inputs = {}
+    inputs['explode'] = copy.deepcopy(exceptions)
+    Verkada._explode_exceptions(config, exceptions)
+    inputs['apply'] = copy.deepcopy((doors, exceptions))
+    Verkada._apply_exploded_exceptions_to_doors(doors, exceptions)
+    inputs['merge overlapping'] = copy.deepcopy(doors)
+
+    doors, exceptions = _transform()
+    inputs['merge_data'] = copy.deepcopy((doors, schedule, exceptions))
+    # This also writes the merged schedule snapshot
+    verkada_events = Verkada.merge_data(None, snapshot_config, doors, schedule, exceptions)
+    google_events = verkadaSyntheticData.google_events_from(verkada_events,
+                                                            seed=args.seed)
+    inputs['compare'] = copy.deepcopy((google_events, verkada_events))
+
+    num_events = sum(len(events) for events in verkada_events.values())
+    return inputs, num_events
+
+def _stages(config, snapshot_config):
+    return {
+        '_explode_exceptions':
+            lambda x: Verkada._explode_exceptions(config, x['explode']),
+        '_apply_exploded_exceptions_to_doors':
+            lambda x: Verkada._apply_exploded_exceptions_to_doors(*x['apply']),
+        '_merge_overlapping_exceptions':
+            lambda x: Verkada._merge_overlapping_exceptions(x['merge overlapping']),
+        'merge_data':
+            lambda x: Verkada.merge_data(None, config, *x['merge_data']),
+        'merge_data (from snapshot)':
+            lambda x: Verkada.merge_data(None, snapshot_config, *x['merge_data']),
+        'compare':
+            lambda x: vercalbot.compare(config, *x['compare']),
+    }
+
+# Run func on a fresh copy of the inputs.  The copy is not timed.
+def _time_once(func, inputs, key):
+    fresh = copy.deepcopy({key: inputs[key]})
+    start = time.perf_counter()
+    func(fresh)
+    return time.perf_counter() - start
+
+def _peak_memory(func, inputs, key):
+    fresh = copy.deepcopy({key: inputs[key]})
+    tracemalloc.start()
+    func(fresh)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+_stage_inputs = {
+    '_explode_exceptions': 'explode',
+    '_apply_exploded_exceptions_to_doors': 'apply',
+    '_merge_overlapping_exceptions': 'merge overlapping',
+    'merge_data': 'merge_data',
+    'merge_data (from snapshot)': 'merge_data',
+    'compare': 'compare',
+}
+
+def run(args):
+    today = date.today()
+    config = {
+        'first date': today - timedelta(days=args.days_past),
+        'last date': today + timedelta(days=args.days_future),
+        'coalesce span': args.coalesce_span,
+    }
+
+    results = {}
+    for scale in args.scales.split(','):
+        snapshot_config = dict(config)
+        snapshot_config['state dir'] = os.path.join(args.workdir, f"state-{scale}")
+        inputs, num_events = _prepare(scale, config, snapshot_config, args)
+        print(f"Scale {scale}: {num_events} merged events")
+
+        results[scale] = {}
+        for name, func in _stages(config, snapshot_config).items():
+            key = _stage_inputs[name]
+            # Use the best of several runs to reduce noise
+            seconds = min(_time_once(func, inputs, key)
+                          for _ in range(args.repeat))
+            peak = _peak_memory(func, inputs, key)
+            results[scale][name] = {
+                'seconds': seconds,
+                'peak_bytes': peak,
+            }
+            print(f"  {name:40s} {seconds:10.4f} s {peak / 1024 / 1024:10.2f} MiB")
+
+    return results
+
+# The arguments that change the synthetic data; results are only
+# comparable with a baseline recorded with the same ones
+def _data_args(args):
+    return {
+        'exceptions_per_calendar': args.exceptions_per_calendar,
+        'days_past': args.days_past,
+        'days_future': args.days_future,
+        'seed': args.seed,
+        'coalesce_span': args.coalesce_span,
+    }
+
+def check(results, baseline, args):
+    # A stage that is not compared must fail the check, not pass it
+    # silently
+    recorded = baseline.get('args', {})
+    for key, value in _data_args(args).items():
+        if recorded.get(key) != value:
+            return [f"Baseline was recorded with {key}={recorded.get(key)!r}, "
+                    f"not {value!r}; run with --update-baseline"]
+
+    failures = []
+    num_compared = 0
+    for scale, stages in results.items():
+        for name, result in stages.items():
+            base = baseline.get('results', {}).get(scale, {}).get(name)
+            if base is None:
+                failures.append(f"{scale} {name}: not in the baseline")
+                continue
+            num_compared += 1
+
+            limit = base['seconds'] * (1 + args.threshold)
+            if result['seconds'] > limit:
+                failures.append(f"{scale} {name}: {result['seconds']:.4f} s > {limit:.4f} s "
+                                f"(baseline {base['seconds']:.4f} s)")
+
+            limit = base['peak_bytes'] * (1 + args.memory_threshold)
+            if result['peak_bytes'] > limit:
+                failures.append(f"{scale} {name}: {result['peak_bytes']} bytes > {int(limit)} bytes "
+                                f"(baseline {base['peak_bytes']} bytes)")
+
+    if num_compared == 0:
+        failures.append("Nothing was compared against the baseline")
+
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VerCalBot sync pipeline')
+    parser.add_argument('--scales', default=_default_scales,
+                        help=f'Comma-separated list of DOORSxCALENDARS scale points (default: {_default_scales})')
+    parser.add_argument('--exceptions-per-calendar', type=int, default=8)
+    parser.add_argument('--days-past', type=int, default=42)
+    parser.add_argument('--days-future', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--coalesce-span', default='day',
+                        type=lambda x: None if x == 'none' else x if x == 'day' else int(float(x) * 3600),
+                        help='Coalesce span, as in the config file: "none", "day", or hours (default: day)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Time each stage this many times and keep the best (default: 3)')
+    parser.add_argument('--baseline', default=_default_baseline,
+                        help='Baseline results JSON file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Write the results to the baseline file instead of checking against it')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed fractional slowdown vs. the baseline (default: 0.25)')
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help='Allowed fractional increase in peak memory vs. the baseline (default: 0.25)')
+    parser.add_argument('--workdir',
+                        help='Directory for temporary files (default: a new temporary directory)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # Without a baseline there is nothing to check against; fail rather
+    # than letting a regression check pass silently
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"No baseline file {args.baseline}; run with --update-baseline first")
+        exit(1)
+
+    if args.workdir:
+        results = run(args)
+    else:
+        with tempfile.TemporaryDirectory(prefix='vercalbot-benchmark-') as workdir:
+            args.workdir = workdir
+            results = run(args)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump({
+                'python': sys.version,
+                'args': _data_args(args),
+                'results': results,
+            }, fp, indent=4)
+        print(f"Wrote baseline to {args.baseline}")
+        return
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+
+    failures = check(results, baseline, args)
+    if failures:
+        print("Benchmark check failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        exit(1)
+
+    print("No performance regressions found")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+# A local, in-memory stand-in for the parts of the Google Calendar v3
+# API that VerCalBot uses:
+#
+# - events.list (with timeMin / timeMax, orderBy=startTime,
+#   pagination, sync tokens, and the "fields" parameter)
+# - events.get / insert / delete / patch
+# - calendars.get / insert / delete / clear (like Google, only the
+#   "primary" calendar can be cleared)
+# - acl.list / insert
+# - batch requests (multipart/mixed, up to 1000 requests per batch)
+#
+# Run VerCalBot against it with --google-base-url.
+
+import json
+import time
+import uuid
+import argparse
+import threading
+
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlsplit, parse_qs
+from email.parser import BytesParser
+
+import fakeServer
+
+_prefix = '/calendar/v3'
+_batch_paths = ['/batch/calendar/v3', '/batch']
+_max_batch_size = 1000
+_default_page_size = 250
+_max_page_size = 2500
+_default_owner = 'owner@example.com'
+
+def _error(status, reason, message):
+    return status, {
+        'error': {
+            'code': status,
+            'message': message,
+            'errors': [{'reason': reason, 'message': message}],
+        }
+    }
+
+def _epoch(when):
+    if not when or 'dateTime' not in when:
+        return None
+    return datetime.fromisoformat(when['dateTime']).timestamp()
+
+def _split_fields(text):
+    parts = []
+    depth = 0
+    current = ''
+    for c in text:
+        if c == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        current += c
+    if current:
+        parts.append(current)
+    return parts
+
+# Apply a (simple subset of the) Google API "fields" partial response
+# syntax, e.g., "nextPageToken,items(id,summary)"
+def _apply_fields(obj, fields):
+    if not fields:
+        return obj
+
+    output = {}
+    for field in _split_fields(fields):
+        field = field.strip()
+        if '(' in field:
+            name, sub = field[:-1].split('(', 1)
+            if name in obj:
+                value = obj[name]
+                if isinstance(value, list):
+                    output[name] = [_apply_fields(item, sub) for item in value]
+                else:
+                    output[name] = _apply_fields(value, sub)
+        else:
+            name = field.split('/')[0]
+            if name in obj:
+                output[name] = obj[name]
+    return output
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calendars = {}
+        self.seq = 0
+        self.counts = {}
+        # Calendar ID -> metadata, and calendar ID -> ACL rules.
+        # Calendars spring into existence (owned by _default_owner)
+        # when they are first used.
+        self.metadata = {}
+        self.acls = {}
+
+    def _calendar(self, cal_id):
+        if cal_id not in self.calendars:
+            self.calendars[cal_id] = {}
+            self.metadata[cal_id] = {
+                'kind': 'calendar#calendar',
+                'id': cal_id,
+                'summary': cal_id,
+                'timeZone': 'UTC',
+            }
+            self.acls[cal_id] = [{
+                'kind': 'calendar#aclRule',
+                'id': f"user:{_default_owner}",
+                'role': 'owner',
+                'scope': {'type': 'user', 'value': _default_owner},
+            }]
+        return self.calendars[cal_id]
+
+    # Share a calendar (e.g., to check that a swap rebuild copies the
+    # sharing rules)
+    def share(self, cal_id, role, scope_type, value):
+        with self.lock:
+            self._calendar(cal_id)
+            self._insert_acl(cal_id, {'role': role,
+                                      'scope': {'type': scope_type, 'value': value}})
+
+    def _count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _public(self, event):
+        return {key: value for key, value in event.items()
+                if not key.startswith('_')}
+
+    # All the events (not deleted) on a calendar
+    def events(self, cal_id):
+        with self.lock:
+            return [self._public(e) for e in self._calendar(cal_id).values()
+                    if e['status'] != 'cancelled']
+
+    def list_events(self, cal_id, query):
+        self._count('events.list')
+        events = self._calendar(cal_id)
+
+        sync_token = query.get('syncToken')
+        if sync_token is not None:
+            if 'timeMin' in query or 'timeMax' in query or 'orderBy' in query:
+                return _error(400, 'invalid', 'syncToken cannot be combined with timeMin, timeMax, or orderBy')
+            if not sync_token.isdigit() or int(sync_token) > self.seq:
+                return _error(410, 'fullSyncRequired', 'Sync token is no longer valid, a full sync is required.')
+            since = int(sync_token)
+            items = [e for e in events.values() if e['_seq'] > since]
+        else:
+            show_deleted = query.get('showDeleted') == 'true'
+            items = [e for e in events.values()
+                     if show_deleted or e['status'] != 'cancelled']
+            # Like Google: timeMin bounds the event end, timeMax bounds
+            # the event start
+            if 'timeMin' in query:
+                time_min = datetime.fromisoformat(query['timeMin']).timestamp()
+                items = [e for e in items if e['_end'] > time_min]
+            if 'timeMax' in query:
+                time_max = datetime.fromisoformat(query['timeMax']).timestamp()
+                items = [e for e in items if e['_start'] < time_max]
+
+        if query.get('orderBy') == 'startTime':
+            items.sort(key=lambda e: (e['_start'], e['id']))
+        else:
+            items.sort(key=lambda e: e['id'])
+
+        page_size = min(int(query.get('maxResults', _default_page_size)), _max_page_size)
+        offset = 0
+        page_token = query.get('pageToken')
+        if page_token:
+            if not page_token.startswith('page-') or not page_token[5:].isdigit():
+                return _error(400, 'invalid', 'Invalid page token')
+            offset = int(page_token[5:])
+
+        page = items[offset:offset + page_size]
+        result = {
+            'kind': 'calendar#events',
+            'items': [self._public(e) for e in page],
+        }
+        if offset + page_size < len(items):
+            result['nextPageToken'] = f"page-{offset + page_size}"
+        else:
+            result['nextSyncToken'] = str(self.seq)
+        return 200, result
+
+    def get_event(self, cal_id, event_id):
+        self._count('events.get')
+        event = self._calendar(cal_id).get(event_id)
+        if event is None:
+            return _error(404, 'notFound', 'Not Found')
+        return 200, self._public(event)
+
+    def _set_times(self, event):
+        event['_start'] = _epoch(event.get('start'))
+        event['_end'] = _epoch(event.get('end'))
+        if event['_start'] is None or event['_end'] is None:
+            return _error(400, 'required', 'Missing start or end time')
+        if event['_end'] < event['_start']:
+            return _error(400, 'timeRangeEmpty', 'The specified time range is empty.')
+        return None
+
+    def insert_event(self, cal_id, body):
+        self._count('events.insert')
+        event = dict(body)
+        event['id'] = event.get('id') or uuid.uuid4().hex
+        event['kind'] = 'calendar#event'
+        event['status'] = 'confirmed'
+        error = self._set_times(event)
+        if error:
+            return error
+
+        events = self._calendar(cal_id)
+        if event['id'] in events and events[event['id']]['status'] != 'cancelled':
+            return _error(409, 'duplicate', 'The requested identifier already exists.')
+
+        self.seq += 1
+        event['_seq'] = self.seq
+        event['updated'] = datetime.now(timezone.utc).isoformat()
+        events[event['id']] = event
+        return 200, self._public(event)
+
+    def patch_event(self, cal_id, event_id, body):
+        self._count('events.patch')
+        event = self._calendar(cal_id).get(event_id)
+        if event is None or event['status'] == 'cancelled':
+            return _error(404, 'notFound', 'Not Found')
+
+        updated = dict(event)
+        updated.update(body)
+        error = self._set_times(updated)
+        if error:
+            return error
+
+        self.seq += 1
+        updated['_seq'] = self.seq
+        updated['updated'] = datetime.now(timezone.utc).isoformat()
+        self._calendar(cal_id)[event_id] = updated
+        return 200, self._public(updated)
+
+    def delete_event(self, cal_id, event_id):
+        self._count('events.delete')
+        event = self._calendar(cal_id).get(event_id)
+        if event is None:
+            return _error(404, 'notFound', 'Not Found')
+        if event['status'] == 'cancelled':
+            return _error(410, 'deleted', 'Resource has been deleted')
+
+        self.seq += 1
+        event['status'] = 'cancelled'
+        event['_seq'] = self.seq
+        return 204, None
+
+    def get_calendar(self, cal_id):
+        self._count('calendars.get')
+        if cal_id not in self.calendars:
+            return _error(404, 'notFound', 'Not Found')
+        return 200, self.metadata[cal_id]
+
+    def insert_calendar(self, body):
+        self._count('calendars.insert')
+        if not body.get('summary'):
+            return _error(400, 'required', 'Missing title.')
+        cal_id = f"{uuid.uuid4().hex}@group.calendar.google.com"
+        self._calendar(cal_id)
+        self.metadata[cal_id].update({
+            'summary': body['summary'],
+            'description': body.get('description', ''),
+            'timeZone': body.get('timeZone', 'UTC'),
+        })
+        return 200, self.metadata[cal_id]
+
+    def delete_calendar(self, cal_id):
+        self._count('calendars.delete')
+        if cal_id not in self.calendars or cal_id == 'primary':
+            return _error(404, 'notFound', 'Not Found')
+        del self.calendars[cal_id]
+        del self.metadata[cal_id]
+        del self.acls[cal_id]
+        return 204, None
+
+    def clear_calendar(self, cal_id):
+        self._count('calendars.clear')
+        if cal_id != 'primary':
+            return _error(400, 'invalid', 'Only primary calendars can be cleared.')
+        for event in self._calendar(cal_id).values():
+            if event['status'] != 'cancelled':
+                self.seq += 1
+                event['status'] = 'cancelled'
+                event['_seq'] = self.seq
+        return 204, None
+
+    def list_acl(self, cal_id):
+        self._count('acl.list')
+        if cal_id not in self.calendars:
+            return _error(404, 'notFound', 'Not Found')
+        return 200, {'kind': 'calendar#acl', 'items': list(self.acls[cal_id])}
+
+    def _insert_acl(self, cal_id, body):
+        scope = body.get('scope') or {}
+        rule = {
+            'kind': 'calendar#aclRule',
+            'id': f"{scope.get('type')}:{scope.get('value')}",
+            'role': body.get('role'),
+            'scope': scope,
+        }
+        rules = [r for r in self.acls[cal_id] if r['id'] != rule['id']]
+        rules.append(rule)
+        self.acls[cal_id] = rules
+        return rule
+
+    def insert_acl(self, cal_id, body):
+        self._count('acl.insert')
+        if cal_id not in self.calendars:
+            return _error(404, 'notFound', 'Not Found')
+        if body.get('role') not in ('none', 'freeBusyReader', 'reader', 'writer', 'owner'):
+            return _error(400, 'invalid', 'Invalid role')
+        return 200, self._insert_acl(cal_id, body)
+
+    # Route a single API request.  Returns (HTTP status, body).
+    def dispatch(self, method, path, query, body):
+        if not path.startswith(_prefix + '/'):
+            return _error(404, 'notFound', 'Not Found')
+        parts = [unquote(p) for p in path[len(_prefix) + 1:].split('/')]
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return _error(400, 'parseError', 'Parse Error')
+
+        with self.lock:
+            if parts == ['calendars'] and method == 'POST':
+                return self.insert_calendar(data)
+
+            if len(parts) == 2 and parts[0] == 'calendars':
+                if method == 'GET':
+                    return self.get_calendar(parts[1])
+                if method == 'DELETE':
+                    return self.delete_calendar(parts[1])
+
+            if len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'clear':
+                if method == 'POST':
+                    return self.clear_calendar(parts[1])
+
+            if len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'acl':
+                if method == 'GET':
+                    return self.list_acl(parts[1])
+                if method == 'POST':
+                    return self.insert_acl(parts[1], data)
+
+            if len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'events':
+                cal_id = parts[1]
+                if method == 'GET':
+                    return self.list_events(cal_id, query)
+                if method == 'POST':
+                    return self.insert_event(cal_id, data)
+
+            if len(parts) == 4 and parts[0] == 'calendars' and parts[2] == 'events':
+                cal_id, event_id = parts[1], parts[3]
+                if method == 'GET':
+                    return self.get_event(cal_id, event_id)
+                if method == 'DELETE':
+                    return self.delete_event(cal_id, event_id)
+                if method in ('PATCH', 'PUT'):
+                    return self.patch_event(cal_id, event_id, data)
+
+        return _error(404, 'notFound', 'Not Found')
+
+def _parse_http_part(payload):
+    head, _, body = payload.replace('\r\n', '\n').partition('\n\n')
+    lines = head.split('\n')
+    method, uri, _ = lines[0].split(' ', 2)
+    parts = urlsplit(uri)
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    return method, parts.path, query, body.strip()
+
+_reasons = {
+    200: 'OK',
+    204: 'No Content',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    409: 'Conflict',
+    410: 'Gone',
+    429: 'Too Many Requests',
+}
+
+def make_handler(store, faults):
+    class GoogleCalendarHandler(fakeServer.Handler):
+        def _respond(self, method):
+            path, query = self.parse_url()
+            body = self.read_body()
+
+            if method == 'POST' and path in _batch_paths:
+                self._batch(body)
+                return
+
+            fault = self.faults.check()
+            if fault:
+                status, body, headers = self.fault_response(fault)
+                self.send(status, body, headers)
+                return
+
+            status, result = store.dispatch(method, path, query, body)
+            if status == 200:
+                result = _apply_fields(result, query.get('fields'))
+            self.send(status, result)
+
+        def _batch(self, body):
+            content_type = self.headers.get('Content-Type', '')
+            message = BytesParser().parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body)
+            if not message.is_multipart():
+                self.send(*_error(400, 'invalid', 'Batch requests must be multipart/mixed'))
+                return
+
+            requests = message.get_payload()
+            if len(requests) > _max_batch_size:
+                self.send(*_error(400, 'invalid', f'A batch can contain at most {_max_batch_size} requests'))
+                return
+
+            self.faults.delay()
+
+            boundary = f"batch_{uuid.uuid4().hex}"
+            chunks = []
+            for part in requests:
+                content_id = part.get('Content-ID', '').strip('<>')
+                method, path, query, inner_body = _parse_http_part(part.get_payload())
+
+                fault = self.faults.check(delay=False)
+                headers = {}
+                if fault:
+                    status, result, headers = self.fault_response(fault)
+                else:
+                    status, result = store.dispatch(method, path, query, inner_body)
+                    if status == 200:
+                        result = _apply_fields(result, query.get('fields'))
+
+                data = json.dumps(result) if result is not None else ''
+                response = f"HTTP/1.1 {status} {_reasons.get(status, '')}\r\n"
+                for key, value in headers.items():
+                    response += f"{key}: {value}\r\n"
+                if data:
+                    response += "Content-Type: application/json; charset=UTF-8\r\n"
+                response += f"Content-Length: {len(data)}\r\n\r\n{data}"
+
+                chunks.append(f"--{boundary}\r\n"
+                              "Content-Type: application/http\r\n"
+                              f"Content-ID: <response-{content_id}>\r\n\r\n"
+                              f"{response}\r\n")
+            chunks.append(f"--{boundary}--\r\n")
+
+            self.send(200, ''.join(chunks).encode('utf-8'),
+                      content_type=f"multipart/mixed; boundary={boundary}")
+
+        def do_GET(self):
+            self._respond('GET')
+
+        def do_POST(self):
+            self._respond('POST')
+
+        def do_PUT(self):
+            self._respond('PUT')
+
+        def do_PATCH(self):
+            self._respond('PATCH')
+
+        def do_DELETE(self):
+            self._respond('DELETE')
+
+    GoogleCalendarHandler.faults = faults
+    return GoogleCalendarHandler
+
+def start(store=None, faults=None, host='127.0.0.1', port=0):
+    if store is None:
+        store = Store()
+    if faults is None:
+        faults = fakeServer.Faults()
+    server = fakeServer.start(make_handler(store, faults), host, port)
+    server.store = store
+    server.faults = faults
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in Google Calendar API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    fakeServer.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = start(faults=fakeServer.faults_from_args(args),
+                   host=args.host, port=args.port)
+    print(f"Fake Google Calendar API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(server.faults.stats())
+        print(server.store.counts)
+
+if __name__ == "__main__":
+    main()
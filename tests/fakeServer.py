@@ -0,0 +1,138 @@
+# Common plumbing for the local stand-in Verkada and Google Calendar
+# servers (fakeVerkadaServer.py and fakeGoogleCalendarServer.py):
+# a threaded HTTP server whose handlers can inject latency, random
+# HTTP 429 responses, and simulate an API quota.
+
+import json
+import time
+import random
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+class Faults:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 quota=None, retry_after=0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota = quota
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.injected_429s = 0
+        self.quota_exceeded = 0
+
+    # Called once per API request (note that each request inside a
+    # Google batch request counts separately, but the latency is only
+    # injected once for the whole batch).  Returns None if the request
+    # should be served, or an (HTTP status, reason, message) tuple if
+    # it should be rejected.
+    def check(self, delay=True):
+        with self.lock:
+            self.requests += 1
+            if self.quota is not None and self.requests > self.quota:
+                self.quota_exceeded += 1
+                return (403, 'rateLimitExceeded', 'Quota exceeded')
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.injected_429s += 1
+                return (429, 'rateLimitExceeded', 'Rate limit exceeded')
+
+        if delay:
+            self.delay()
+        return None
+
+    def delay(self):
+        with self.lock:
+            latency = self.latency_ms
+            if self.jitter_ms:
+                latency += self.random.uniform(0, self.jitter_ms)
+        if latency:
+            time.sleep(latency / 1000)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'injected_429s': self.injected_429s,
+            'quota_exceeded': self.quota_exceeded,
+        }
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='Delay every request by this many milliseconds')
+    parser.add_argument('--jitter-ms', type=float, default=0,
+                        help='Add up to this many milliseconds of random delay to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests to reject with HTTP 429')
+    parser.add_argument('--quota', type=int, default=None,
+                        help='Reject all requests after this many')
+    parser.add_argument('--retry-after', type=int, default=0,
+                        help='Retry-After value (seconds) to send with HTTP 429 responses')
+
+def faults_from_args(args):
+    return Faults(latency_ms=args.latency_ms,
+                  jitter_ms=args.jitter_ms,
+                  error_rate=args.error_rate,
+                  quota=args.quota,
+                  retry_after=args.retry_after)
+
+class Handler(BaseHTTPRequestHandler):
+    # Subclasses set these
+    faults = None
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def parse_url(self):
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        return parts.path, query
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send(self, status, body=None, headers=None, content_type='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def fault_response(self, fault):
+        status, reason, message = fault
+        headers = {}
+        if status == 429:
+            headers['Retry-After'] = str(self.faults.retry_after)
+        return status, {
+            'error': {
+                'code': status,
+                'message': message,
+                'errors': [{'reason': reason, 'message': message}],
+            }
+        }, headers
+
+# Start an HTTP server with the given handler class in a background
+# thread.  Returns the server; its URL is server.url.
+def start(handler_class, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    server.url = f"http://{host}:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the parts of the Verkada API that VerCalBot
+# uses, serving data generated by verkadaSyntheticData.py (or loaded
+# from a JSON file that it generated):
+#
+# - POST /token
+# - GET  /cameras/v1/devices
+# - GET  /access/v1/doors
+# - GET  /access/v1/door/exception_calendar
+#
+# Run VerCalBot against it with --verkada-base-url.
+
+import json
+import time
+import uuid
+import argparse
+
+from datetime import date, timedelta
+
+import fakeServer
+import verkadaSyntheticData
+
+def make_handler(data, faults, api_key=None):
+    token = str(uuid.uuid4())
+    payloads = {
+        '/cameras/v1/devices': json.dumps(data['cameras']).encode('utf-8'),
+        '/access/v1/doors': json.dumps(data['doors']).encode('utf-8'),
+        '/access/v1/door/exception_calendar': json.dumps(data['door_exception_calendars']).encode('utf-8'),
+    }
+
+    class VerkadaHandler(fakeServer.Handler):
+        def _check_fault(self):
+            fault = self.faults.check()
+            if fault:
+                status, body, headers = self.fault_response(fault)
+                self.send(status, body, headers)
+                return True
+            return False
+
+        def do_POST(self):
+            path, _ = self.parse_url()
+            self.read_body()
+            if self._check_fault():
+                return
+            if path != '/token':
+                self.send(404, {'message': 'Not found'})
+                return
+            if api_key is not None and self.headers.get('x-api-key') != api_key:
+                self.send(401, {'message': 'Invalid API key'})
+                return
+            self.send(200, {'token': token})
+
+        def do_GET(self):
+            path, _ = self.parse_url()
+            if self._check_fault():
+                return
+            if self.headers.get('x-verkada-auth') != token:
+                self.send(401, {'message': 'Invalid or missing token'})
+                return
+            if path not in payloads:
+                self.send(404, {'message': 'Not found'})
+                return
+            self.send(200, payloads[path])
+
+    VerkadaHandler.faults = faults
+    return VerkadaHandler
+
+def start(data, faults=None, api_key=None, host='127.0.0.1', port=0):
+    if faults is None:
+        faults = fakeServer.Faults()
+    server = fakeServer.start(make_handler(data, faults, api_key), host, port)
+    server.faults = faults
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in Verkada API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--data',
+                        help='Serve this JSON file (from verkadaSyntheticData.py) instead of generating data')
+    parser.add_argument('--doors', type=int, default=100)
+    parser.add_argument('--calendars', type=int, default=20)
+    parser.add_argument('--exceptions-per-calendar', type=int, default=8)
+    parser.add_argument('--days-past', type=int, default=42)
+    parser.add_argument('--days-future', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--api-key',
+                        help='Require this API key (default: accept any)')
+    fakeServer.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    if args.data:
+        with open(args.data) as fp:
+            data = json.load(fp)
+    else:
+        today = date.today()
+        data = verkadaSyntheticData.generate(args.doors, args.calendars,
+                                             today - timedelta(days=args.days_past),
+                                             today + timedelta(days=args.days_future),
+                                             exceptions_per_calendar=args.exceptions_per_calendar,
+                                             seed=args.seed)
+
+    server = start(data, fakeServer.faults_from_args(args), args.api_key,
+                   args.host, args.port)
+    print(f"Fake Verkada API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(server.faults.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# End-to-end load test: start the local stand-in Verkada and Google
+# Calendar servers, run a full main.main() against them, and check
+# that the resulting calendar matches the merged Verkada data.  The
+# sync is then run a second time, which should find nothing to do.
+#
+# Since the calendar starts out empty, the first sync rebuilds it (see
+# --rebuild-mode).  With "swap", the calendar's sharing rules must be
+# copied to the new calendar; with "clear", the calendar must be the
+# primary calendar (--calendar-id primary).
+#
+# Example (10,000 doors, 50ms of latency on every Google request, and
+# 1% of Google requests rejected with HTTP 429):
+#
+#   python3 tests/loadTest.py --doors 10000 --google-latency-ms 50 \
+#       --google-error-rate 0.01
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import tempfile
+
+from collections import Counter
+from datetime import date, timedelta, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Config
+import Metrics
+import Verkada
+import GoogleCalendar
+import main as vercalbot
+
+import fakeServer
+import fakeVerkadaServer
+import fakeGoogleCalendarServer
+import verkadaSyntheticData
+
+_shared_with = 'front-desk@example.com'
+
+def _write_config(workdir, args):
+    filename = os.path.join(workdir, 'config.ini')
+    with open(filename, 'w') as fp:
+        fp.write(f"""[General]
+days_to_schedule_in_the_past = {args.days_past}
+days_to_schedule_in_the_future = {args.days_future}
+send_emails = False
+state_dir = state
+
+[Google]
+color_unlocked = 10
+color_locked = 11
+color_access_controlled = 8
+color_card_and_code = 5
+rebuild_mode = {args.rebuild_mode}
+api_budget = {args.api_budget}
+
+[Email]
+sender = sender@example.com
+recipient = someone-to-notify@example.com
+subject = Notice of schedule change
+body = The door schedule has changed.
+logo_path = your-logo.png
+""")
+    return filename
+
+# Compute what the calendar should contain, independently of the sync
+def _expected_events(data, config_file, schedule_file):
+    args = argparse.Namespace(config=config_file,
+                              verkada_door_schedule=schedule_file)
+    config = Config.read_config(args)
+    raw = copy.deepcopy(data)
+    sites = Verkada._transform_sites(raw['cameras']['cameras'])
+    doors = Verkada._transform_doors(raw['doors']['doors'], sites)
+    exceptions = Verkada._transform_exception_calendars(
+        raw['door_exception_calendars']['door_exception_calendars'])
+    schedule = Verkada.get_door_schedule(args, None)
+    merged = Verkada.merge_data(args, config, doors, schedule, exceptions)
+
+    return Counter((name, event['door_status'], event['start_epoch'], event['end_epoch'])
+                   for name, events in merged.items()
+                   for event in events)
+
+def _actual_events(store, calendar_id):
+    return Counter((event['summary'], event['description'],
+                    int(datetime.fromisoformat(event['start']['dateTime']).timestamp()),
+                    int(datetime.fromisoformat(event['end']['dateTime']).timestamp()))
+                   for event in store.events(calendar_id))
+
+# The calendar that the bot is synchronizing (which changes after a
+# swap rebuild)
+def _active_calendar_id(config_file, calendar_id):
+    config = Config.read_config(argparse.Namespace(config=config_file))
+    return GoogleCalendar.active_calendar_id(
+        argparse.Namespace(google_calendar_id=calendar_id), config)
+
+def _run_sync(label, argv):
+    print(f"{label}...")
+    sys.argv = argv
+    start = time.perf_counter()
+    vercalbot.main()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed:.2f} seconds")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end VerCalBot load test against local stand-in servers')
+    parser.add_argument('--doors', type=int, default=10000)
+    parser.add_argument('--calendars', type=int, default=200)
+    parser.add_argument('--exceptions-per-calendar', type=int, default=2)
+    parser.add_argument('--days-past', type=int, default=1)
+    parser.add_argument('--days-future', type=int, default=7)
+    parser.add_argument('--with-schedule', action='store_true',
+                        help='Also load a regular door schedule (many more events)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--calendar-id', default='load-test@group.calendar.google.com')
+    parser.add_argument('--rebuild-mode', default='swap',
+                        choices=['none', 'clear', 'swap'])
+    parser.add_argument('--api-budget', type=int, default=0,
+                        help='Per-run API budget; the calendar is then populated over several syncs')
+    for prefix in ['verkada', 'google']:
+        parser.add_argument(f'--{prefix}-latency-ms', type=float, default=0)
+        parser.add_argument(f'--{prefix}-error-rate', type=float, default=0.0)
+        parser.add_argument(f'--{prefix}-quota', type=int, default=None)
+    parser.add_argument('--metrics-json',
+                        help='Write the metrics of the first sync to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vercalbot-load-test-')
+    today = date.today()
+    data = verkadaSyntheticData.generate(args.doors, args.calendars,
+                                         today - timedelta(days=args.days_past),
+                                         today + timedelta(days=args.days_future),
+                                         exceptions_per_calendar=args.exceptions_per_calendar,
+                                         seed=args.seed)
+
+    config_file = _write_config(workdir, args)
+    schedule_file = None
+    if args.with_schedule:
+        schedule_file = os.path.join(workdir, 'schedule.json')
+        with open(schedule_file, 'w') as fp:
+            json.dump(data['schedule'], fp)
+
+    verkada = fakeVerkadaServer.start(data, fakeServer.Faults(
+        latency_ms=args.verkada_latency_ms,
+        error_rate=args.verkada_error_rate,
+        quota=args.verkada_quota))
+    google = fakeGoogleCalendarServer.start(faults=fakeServer.Faults(
+        latency_ms=args.google_latency_ms,
+        error_rate=args.google_error_rate,
+        quota=args.google_quota))
+    google.store.share(args.calendar_id, 'reader', 'user', _shared_with)
+    print(f"Fake Verkada API: {verkada.url}")
+    print(f"Fake Google Calendar API: {google.url}")
+
+    argv = ['main.py',
+            '--config', config_file,
+            '--google-calendar-id', args.calendar_id,
+            '--google-base-url', google.url,
+            '--verkada-api-key', 'load-test',
+            '--verkada-base-url', verkada.url]
+    if schedule_file:
+        argv += ['--verkada-door-schedule', schedule_file]
+
+    first_argv = argv + (['--metrics-json', args.metrics_json] if args.metrics_json else [])
+    first = _run_sync("First sync (populating the calendar)", first_argv)
+
+    # With an API budget, keep syncing until nothing is pending; each
+    # sync must make progress
+    pending = Metrics._counts.get('pending_operations', 0)
+    num_syncs = 1
+    while pending:
+        print(f"{pending} changes pending")
+        num_syncs += 1
+        first += _run_sync(f"Sync {num_syncs} (continuing to populate the calendar)", argv)
+        previous = pending
+        pending = Metrics._counts.get('pending_operations', 0)
+        if pending >= previous:
+            print(f"FAILED: sync {num_syncs} left {pending} changes pending (was {previous})")
+            exit(1)
+
+    expected = _expected_events(data, config_file, schedule_file)
+    calendar_id = _active_calendar_id(config_file, args.calendar_id)
+    actual = _actual_events(google.store, calendar_id)
+    shared = any(rule['scope'].get('value') == _shared_with
+                 for rule in google.store.acls.get(calendar_id, []))
+    missing = expected - actual
+    extra = actual - expected
+    print(f"Expected {sum(expected.values())} events; calendar has {sum(actual.values())}")
+
+    counts_after_first = dict(google.store.counts)
+    second = _run_sync("Second sync (should find nothing to do)", argv)
+    writes = sum(google.store.counts.get(name, 0) - counts_after_first.get(name, 0)
+                 for name in ['events.insert', 'events.delete', 'events.patch'])
+
+    print(f"Verkada server: {verkada.faults.stats()}")
+    print(f"Google server: {google.faults.stats()}")
+    print(f"Google API calls (first sync): {counts_after_first}")
+
+    verkada.shutdown()
+    google.shutdown()
+
+    if missing or extra:
+        print(f"FAILED: {sum(missing.values())} events missing, {sum(extra.values())} unexpected events")
+        exit(1)
+    if writes:
+        print(f"FAILED: second sync made {writes} changes to the calendar")
+        exit(1)
+    if not shared:
+        print(f"FAILED: calendar {calendar_id} is not shared with {_shared_with}")
+        exit(1)
+
+    print(f"PASSED: first sync {first:.2f} seconds, second sync {second:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
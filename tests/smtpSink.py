@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# A local SMTP sink for testing VerCalBot's email notifications: it
+# accepts (and keeps) every message, accepts any AUTH credentials, and
+# counts connections so that connection reuse can be checked.  It does
+# not support STARTTLS, so set "smtp_starttls = False" in the config
+# when using it.
+#
+# Example:
+#
+#   python3 tests/smtpSink.py --port 2525 --output-dir /tmp/emails
+
+import os
+import time
+import argparse
+import threading
+import socketserver
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('utf-8'))
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            # Undo the SMTP dot-stuffing
+            if line.startswith(b'..'):
+                line = line[1:]
+            lines.append(line)
+        return b''.join(lines)
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connected()
+        self._reply("220 localhost VerCalBot SMTP sink")
+
+        envelope = {'from': None, 'to': []}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self._reply("250-localhost")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif verb == 'HELO':
+                self._reply("250 localhost")
+            elif verb == 'AUTH':
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == 'MAIL':
+                envelope = {'from': command.split(':', 1)[-1].strip(), 'to': []}
+                self._reply("250 OK")
+            elif verb == 'RCPT':
+                envelope['to'].append(command.split(':', 1)[-1].strip())
+                self._reply("250 OK")
+            elif verb == 'DATA':
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                sink.store(envelope, self._read_data())
+                envelope = {'from': None, 'to': []}
+                self._reply("250 OK")
+            elif verb == 'RSET':
+                envelope = {'from': None, 'to': []}
+                self._reply("250 OK")
+            elif verb == 'NOOP':
+                self._reply("250 OK")
+            elif verb == 'QUIT':
+                self._reply("221 Bye")
+                break
+            else:
+                self._reply("502 Command not implemented")
+
+class Sink:
+    def __init__(self, output_dir=None):
+        self.lock = threading.Lock()
+        self.output_dir = output_dir
+        self.messages = []
+        self.connections = 0
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+
+    def store(self, envelope, data):
+        with self.lock:
+            self.messages.append({
+                'from': envelope['from'],
+                'to': envelope['to'],
+                'data': data,
+            })
+            num = len(self.messages)
+        if self.output_dir:
+            filename = os.path.join(self.output_dir, f"message-{num:04d}.eml")
+            with open(filename, 'wb') as fp:
+                fp.write(data)
+
+# Start an SMTP sink in a background thread.  Returns the server; the
+# received messages are in server.sink.messages.
+def start(output_dir=None, host='127.0.0.1', port=0):
+    server = socketserver.ThreadingTCPServer((host, port), SinkHandler)
+    server.daemon_threads = True
+    server.sink = Sink(output_dir)
+    server.host = host
+    server.port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink for testing email notifications')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--output-dir',
+                        help='Write each received message to a .eml file in this directory')
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    server = start(args.output_dir, args.host, args.port)
+    print(f"SMTP sink listening on {server.host}:{server.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sink = server.sink
+        print(f"{len(sink.messages)} messages over {sink.connections} connections")
+
+if __name__ == "__main__":
+    main()
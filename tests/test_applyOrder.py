@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Checks of the deadline ordering of calendar changes
+# (main.schedule_changes()) and of applying them under a per-run API
+# budget (GoogleCalendar.apply()).
+#
+#   python3 -m pytest tests/test_applyOrder.py
+
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import GoogleCalendar
+import main as vercalbot
+
+_now = 1000000
+_hour = 3600
+_day = 24 * _hour
+
+def _delete(name, door, start, end):
+    return {'id': name, 'summary': door, 'description': 'locked',
+            'start_epoch': _now + start, 'end_epoch': _now + end}
+
+def _add(name, door, start, end):
+    return {'id': name, 'name': door, 'door_status': 'unlocked',
+            'start_epoch': _now + start, 'end_epoch': _now + end}
+
+def _names(groups):
+    return [[(action, event['id']) for action, event in group] for group in groups]
+
+class ScheduleChangesTest(unittest.TestCase):
+    def test_soonest_first_then_most_recent_past(self):
+        groups = vercalbot.schedule_changes(
+            [],
+            [_add('far', 'A', 100 * _day, 100 * _day + _hour),
+             _add('past', 'A', -2 * _day, -2 * _day + _hour),
+             _add('tomorrow', 'A', _day, _day + _hour),
+             _add('now', 'A', -_hour, _hour),
+             _add('yesterday', 'A', -_day, -_day + _hour)],
+            _now)
+        self.assertEqual(_names(groups), [[('add', 'now')], [('add', 'tomorrow')],
+                                          [('add', 'far')], [('add', 'yesterday')],
+                                          [('add', 'past')]])
+
+    def test_replacement_is_grouped_with_overlapping_adds(self):
+        groups = vercalbot.schedule_changes(
+            [_delete('old', 'A', _day, _day + 8 * _hour),
+             _delete('other door', 'B', _day, _day + 8 * _hour)],
+            [_add('new', 'A', _day + _hour, _day + 9 * _hour),
+             _add('later', 'A', _day + 9 * _hour, _day + 10 * _hour)],
+            _now)
+        self.assertEqual(sorted(_names(groups)),
+                         [[('add', 'later')],
+                          [('add', 'new'), ('delete', 'old')],
+                          [('delete', 'other door')]])
+
+    def test_delete_follows_its_first_replacement(self):
+        groups = vercalbot.schedule_changes(
+            [_delete('old', 'A', _day, _day + 8 * _hour)],
+            [_add('new2', 'A', _day + 4 * _hour, _day + 9 * _hour),
+             _add('new1', 'A', _day - _hour, _day + 4 * _hour)],
+            _now)
+        self.assertEqual(_names(groups), [[('add', 'new1'), ('delete', 'old'),
+                                           ('add', 'new2')]])
+
+    def test_overlapping_changes_are_not_chained(self):
+        # a1 overlaps both deletes, but is only added once, with the
+        # sooner one; d2 does not pull d1's group into its own
+        groups = vercalbot.schedule_changes(
+            [_delete('d2', 'A', 4 * _hour, 8 * _hour),
+             _delete('d1', 'A', 0, 4 * _hour)],
+            [_add('a1', 'A', 2 * _hour, 6 * _hour),
+             _add('a2', 'A', 6 * _hour, 10 * _hour)],
+            _now)
+        self.assertEqual(_names(groups), [[('add', 'a1'), ('delete', 'd1')],
+                                          [('add', 'a2'), ('delete', 'd2')]])
+
+#-----------------------------------------------------------------
+
+class ApplyTest(unittest.TestCase):
+    def _apply(self, groups, budget=0, time_limit=0):
+        done = []
+        config = {'api budget': budget, 'apply time limit': time_limit}
+        with mock.patch.object(GoogleCalendar, 'delete',
+                               lambda event, *args: done.append(('delete', event['id']))), \
+             mock.patch.object(GoogleCalendar, 'add',
+                               lambda event, *args: done.append(('add', event['id']))):
+            applied = GoogleCalendar.apply(None, None, config, groups)
+        self.assertEqual(applied, len(done))
+        return done
+
+    def _groups(self):
+        return vercalbot.schedule_changes(
+            [_delete('old', 'A', _day, _day + _hour)],
+            [_add('now', 'A', 0, _hour),
+             _add('new', 'A', _day, _day + _hour),
+             _add('far', 'A', 30 * _day, 30 * _day + _hour)],
+            _now)
+
+    def test_no_budget_applies_everything(self):
+        self.assertEqual(len(self._apply(self._groups())), 4)
+
+    def test_budget_does_not_split_a_replacement(self):
+        # With a budget of 2, the replacement (2 operations) does not
+        # fit after the first add; it is left for the next run
+        self.assertEqual(self._apply(self._groups(), budget=2), [('add', 'now')])
+        self.assertEqual(self._apply(self._groups(), budget=3),
+                         [('add', 'now'), ('add', 'new'), ('delete', 'old')])
+
+    def test_group_larger_than_budget_is_split(self):
+        groups = vercalbot.schedule_changes(
+            [_delete('old', 'A', 0, 2 * _hour)],
+            [_add('new1', 'A', 0, _hour), _add('new2', 'A', _hour, 2 * _hour)],
+            _now)
+        self.assertEqual(self._apply(groups, budget=2),
+                         [('add', 'new1'), ('delete', 'old')])
+        # Too small a budget for even one replacement: add first
+        self.assertEqual(self._apply(groups, budget=1), [('add', 'new1')])
+
+    def test_shifted_timeline(self):
+        # A door's daily events, from 12 days ago to 59 days ahead, all
+        # move an hour later: with a budget of 100, the 50 soonest days
+        # are replaced, and every event deleted has its replacement
+        days = range(-12, 60)
+        groups = vercalbot.schedule_changes(
+            [_delete(f"old {i}", 'A', i * _day + 8 * _hour, i * _day + 17 * _hour)
+             for i in days],
+            [_add(f"new {i}", 'A', i * _day + 9 * _hour, i * _day + 18 * _hour)
+             for i in days],
+            _now)
+        self.assertEqual(len(groups), len(days))
+
+        done = self._apply(groups, budget=100)
+        self.assertEqual(len(done), 100)
+        self.assertEqual(done, [(action, f"{name} {i}") for i in range(50)
+                                for action, name in (('add', 'new'), ('delete', 'old'))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Checks of the door status index (DoorIndex.py) at the edges of its
+# intervals: on a boundary, in a gap, and outside the window; and of
+# the doorStatus.py queries that use it.
+#
+#   python3 -m pytest tests/test_doorIndex.py
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Snapshot
+import DoorIndex
+import doorStatus
+
+_statuses = ['locked', 'access_controlled', 'card_and_code', 'unlocked']
+
+# Front door: unlocked [1000, 2000), locked [2000, 3000), then a gap,
+# then card_and_code [4000, 5000).  Side door: locked [1500, 2500).
+_first_epoch = 0
+_last_epoch = 10000
+_doors = [
+    ('Front', 'Main campus', 'America/New_York', [
+        {'door_status': 'unlocked', 'start_epoch': 1000, 'end_epoch': 2000},
+        {'door_status': 'locked', 'start_epoch': 2000, 'end_epoch': 3000},
+        {'door_status': 'card_and_code', 'start_epoch': 4000, 'end_epoch': 5000},
+    ]),
+    ('Side', 'Main campus', None, [
+        {'door_status': 'locked', 'start_epoch': 1500, 'end_epoch': 2500},
+    ]),
+    ('Shed', None, None, []),
+]
+
+def _statuses_of(intervals):
+    return [interval['door_status'] for interval in intervals]
+
+class DoorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        config = {'state dir': self.dir}
+        Snapshot.write(Snapshot.filename(config), Snapshot.digest('test'),
+                       _first_epoch, _last_epoch, _doors, _statuses)
+        self.index = DoorIndex.load(config)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_status_inside_interval(self):
+        result = self.index.status_at('Front', 1500)
+        self.assertEqual(result['door_status'], 'unlocked')
+        self.assertEqual(result['start'].timestamp(), 1000)
+        self.assertEqual(result['end'].timestamp(), 2000)
+
+    def test_status_on_boundary_is_the_later_interval(self):
+        # Intervals are [start, end)
+        self.assertEqual(self.index.status_at('Front', 1000)['door_status'], 'unlocked')
+        self.assertEqual(self.index.status_at('Front', 2000)['door_status'], 'locked')
+        self.assertEqual(self.index.status_at('Front', 1999)['door_status'], 'unlocked')
+
+    def test_status_in_gap(self):
+        self.assertIsNone(self.index.status_at('Front', 3000))
+        self.assertIsNone(self.index.status_at('Front', 3500))
+        self.assertEqual(self.index.status_at('Front', 4000)['door_status'], 'card_and_code')
+
+    def test_status_before_and_after_window(self):
+        self.assertIsNone(self.index.status_at('Front', -100))
+        self.assertIsNone(self.index.status_at('Front', 999))
+        self.assertIsNone(self.index.status_at('Front', 5000))
+        self.assertIsNone(self.index.status_at('Front', 20000))
+
+    def test_door_without_events(self):
+        self.assertIsNone(self.index.status_at('Shed', 1500))
+        self.assertEqual(self.index.statuses_between('Shed', 0, 10000), [])
+
+    def test_datetime_query(self):
+        when = datetime.fromtimestamp(2500, timezone.utc)
+        self.assertEqual(self.index.status_at('Front', when)['door_status'], 'locked')
+
+    def test_result_is_in_door_timezone(self):
+        result = self.index.status_at('Front', 1500)
+        self.assertEqual(str(result['start'].tzinfo), 'America/New_York')
+        self.assertEqual(self.index.status_at('Side', 1500)['start'].tzinfo, timezone.utc)
+
+    def test_range_touching_boundaries_is_half_open(self):
+        # [2000, 4000) overlaps only the locked interval: the unlocked
+        # one ends at 2000, and the card_and_code one starts at 4000
+        self.assertEqual(_statuses_of(self.index.statuses_between('Front', 2000, 4000)),
+                         ['locked'])
+        self.assertEqual(_statuses_of(self.index.statuses_between('Front', 1999, 4001)),
+                         ['unlocked', 'locked', 'card_and_code'])
+
+    def test_range_in_gap(self):
+        self.assertEqual(self.index.statuses_between('Front', 3000, 4000), [])
+
+    def test_range_outside_window(self):
+        self.assertEqual(self.index.statuses_between('Front', -500, 0), [])
+        self.assertEqual(self.index.statuses_between('Front', 5000, 20000), [])
+        self.assertEqual(_statuses_of(self.index.statuses_between('Front', -500, 20000)),
+                         ['unlocked', 'locked', 'card_and_code'])
+
+    def test_site_queries(self):
+        self.assertEqual(sorted(self.index.sites), ['Main campus'])
+        result = self.index.site_status_at('Main campus', 2200)
+        self.assertEqual({name: r['door_status'] for name, r in result.items()},
+                         {'Front': 'locked', 'Side': 'locked'})
+        result = self.index.site_statuses_between('Main campus', 2500, 3000)
+        self.assertEqual({name: _statuses_of(r) for name, r in result.items()},
+                         {'Front': ['locked'], 'Side': []})
+
+    def test_unknown_door_and_site(self):
+        with self.assertRaises(KeyError):
+            self.index.status_at('Nowhere', 1500)
+        with self.assertRaises(KeyError):
+            self.index.site_status_at('Nowhere', 1500)
+
+#-----------------------------------------------------------------
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {'state dir': self.dir}
+        Snapshot.write(Snapshot.filename(self.config), Snapshot.digest('test'),
+                       _first_epoch, _last_epoch, _doors, _statuses)
+        self.index = DoorIndex.load(self.config)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_time_or_range(self):
+        self.assertEqual(doorStatus.query(self.index, door='Front', at=1500)['door_status'],
+                         'unlocked')
+        self.assertEqual(_statuses_of(doorStatus.query(self.index, door='Front',
+                                                       start=1500, end=2500)),
+                         ['unlocked', 'locked'])
+        with self.assertRaises(ValueError):
+            doorStatus.query(self.index, door='Front', at=1500, start=1000)
+        with self.assertRaises(ValueError):
+            doorStatus.query(self.index, door='Front', at=1500, start=1000, end=2000)
+        with self.assertRaises(ValueError):
+            doorStatus.query(self.index, door='Front', start=1000)
+        with self.assertRaises(ValueError):
+            doorStatus.query(self.index, door='Front', site='Main campus', at=1500)
+
+    def _main(self, *argv):
+        config_file = os.path.join(self.dir, 'config.ini')
+        open(config_file, 'w').close()
+        with mock.patch.object(sys, 'argv', ['doorStatus.py', '--config', config_file, *argv]), \
+             mock.patch.object(doorStatus.Config, 'read_config', lambda args: self.config):
+            doorStatus.main()
+
+    def test_cli_reports_bad_time(self):
+        with self.assertLogs(level='ERROR') as logs, self.assertRaises(SystemExit) as e:
+            self._main('--door', 'Front', '--at', 'notatime')
+        self.assertEqual(e.exception.code, 1)
+        self.assertIn('notatime', logs.output[0])
+
+    def test_cli_reports_time_and_range(self):
+        with self.assertLogs(level='ERROR'), self.assertRaises(SystemExit) as e:
+            self._main('--door', 'Front', '--at', '2026-01-01T00:00',
+                       '--start', '2026-01-01T00:00', '--end', '2026-01-02T00:00')
+        self.assertEqual(e.exception.code, 1)
+
+if __name__ == '__main__':
+    unittest.main()
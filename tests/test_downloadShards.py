@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Checks of the sharded Google Calendar download: how the window is
+# split into shards (GoogleCalendar._plan_shards()), and that
+# download() merges the shards without duplicates.
+#
+#   python3 -m pytest tests/test_downloadShards.py
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import GoogleCalendar
+
+def _midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+# The download window for config (see GoogleCalendar.download())
+def _window(config):
+    return (_midnight(config['first date'] - timedelta(days=1)),
+            _midnight(config['last date'] + timedelta(days=2)))
+
+class PlanShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {
+            'first date': date(2026, 10, 1),
+            'last date': date(2026, 10, 10),
+            'state dir': self.dir,
+            'google download max shards': 8,
+            'google download events per shard': 250,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _history(self, counts):
+        density = {(self.config['first date'] + timedelta(days=i)).isoformat(): count
+                   for i, count in enumerate(counts)}
+        with open(GoogleCalendar._state_filename(self.config), 'w') as fp:
+            json.dump({'events_per_day': density}, fp)
+
+    def _plan(self):
+        first, last = _window(self.config)
+        shards = GoogleCalendar._plan_shards(self.config, first, last)
+        # The shards always cover the whole window, in order
+        self.assertEqual(shards[0][0], first)
+        self.assertEqual(shards[-1][1], last)
+        for (_, end), (start, _) in zip(shards, shards[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual((start.hour, start.minute, start.second), (0, 0, 0))
+        return shards
+
+    def _cuts(self, shards):
+        return [start.date() for start, _ in shards[1:]]
+
+    def test_no_history_uses_max_shards(self):
+        self.config['google download max shards'] = 4
+        shards = self._plan()
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(self._cuts(shards), [date(2026, 10, 4), date(2026, 10, 6),
+                                              date(2026, 10, 9)])
+
+    def test_no_more_shards_than_days(self):
+        self.config['last date'] = date(2026, 10, 3)
+        self.assertEqual(len(self._plan()), 3)
+
+    def test_history_chooses_number_of_shards(self):
+        # 1000 events at 250 per shard: 4 shards, evenly cut
+        self._history([100] * 10)
+        shards = self._plan()
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(self._cuts(shards), [date(2026, 10, 4), date(2026, 10, 6),
+                                              date(2026, 10, 9)])
+
+        # Rounded up
+        self._history([101] * 10)
+        self.assertEqual(len(self._plan()), 5)
+
+        # ...but no more than the maximum
+        self.config['google download max shards'] = 3
+        self.assertEqual(len(self._plan()), 3)
+
+    def test_history_balances_cuts(self):
+        # All the events are in the second half of the window
+        self._history([0] * 5 + [200] * 5)
+        shards = self._plan()
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(self._cuts(shards), [date(2026, 10, 8), date(2026, 10, 9),
+                                              date(2026, 10, 10)])
+
+    def test_trailing_empty_days(self):
+        # 500 events at 200 per shard: 3 shards, and no extra cut once
+        # the running total has reached all the events
+        self.config['google download events per shard'] = 200
+        self._history([100] * 5 + [0] * 5)
+        shards = self._plan()
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(self._cuts(shards), [date(2026, 10, 3), date(2026, 10, 5)])
+
+    def test_unknown_days_are_average(self):
+        # The last 5 days were not in the previous window
+        self._history([100] * 5)
+        self.assertEqual(len(self._plan()), 4)
+
+    def test_no_events(self):
+        self._history([0] * 10)
+        self.assertEqual(len(self._plan()), 1)
+
+    def test_one_day_window(self):
+        self.config['last date'] = self.config['first date']
+        self.assertEqual(len(self._plan()), 1)
+        self._history([1000])
+        self.assertEqual(len(self._plan()), 1)
+
+    def test_unreadable_history_is_ignored(self):
+        self.config['google download max shards'] = 2
+        with open(GoogleCalendar._state_filename(self.config), 'w') as fp:
+            fp.write('not json')
+        self.assertEqual(len(self._plan()), 2)
+
+#-----------------------------------------------------------------
+
+def _google_event(event_id, door, start, end):
+    return {'id': event_id, 'summary': door, 'description': 'locked',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': end.isoformat()}}
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {
+            'first date': date(2026, 10, 1),
+            'last date': date(2026, 10, 2),
+            'state dir': self.dir,
+            'google download max shards': 2,
+            'google download events per shard': 250,
+        }
+        self.args = argparse.Namespace(google_calendar_id='calendar')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_event_across_shard_boundary_is_kept_once(self):
+        first, last = _window(self.config)
+        shards = GoogleCalendar._plan_shards(self.config, first, last)
+        self.assertEqual(len(shards), 2)
+        boundary = shards[1][0]
+
+        hour = timedelta(hours=1)
+        before = _google_event('before', 'Front', boundary - 3 * hour, boundary - 2 * hour)
+        across = _google_event('across', 'Front', boundary - hour, boundary + hour)
+        after = _google_event('after', 'Front', boundary + 2 * hour, boundary + 3 * hour)
+        side = _google_event('side', 'Side', boundary + hour, boundary + 2 * hour)
+
+        # Google returns the events that overlap each shard
+        def _download_shard(service, calendar_id, time_min, time_max):
+            self.assertEqual(calendar_id, 'calendar')
+            if time_min == first:
+                return [dict(before), dict(across)]
+            return [dict(across), dict(after), dict(side)]
+
+        with mock.patch.object(GoogleCalendar, '_download_shard', _download_shard), \
+             mock.patch.object(GoogleCalendar, '_build_service', lambda args: None):
+            output = GoogleCalendar.download(None, self.args, self.config)
+
+        self.assertEqual({door: [event['id'] for event in events]
+                          for door, events in output.items()},
+                         {'Front': ['before', 'across', 'after'], 'Side': ['side']})
+        event = output['Front'][1]
+        self.assertEqual(event['start_epoch'], int((boundary - hour).timestamp()))
+        self.assertEqual(event['end_epoch'], int((boundary + hour).timestamp()))
+        self.assertEqual(event['start'], boundary - hour)
+
+        # The density of this download is kept for the next plan
+        with open(GoogleCalendar._state_filename(self.config)) as fp:
+            density = json.load(fp)['events_per_day']
+        self.assertEqual(sum(density.values()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
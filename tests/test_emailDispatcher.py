@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Checks of the email digests (EmailDispatcher.py) against the local
+# SMTP sink (smtpSink.py): connection reuse, the per-door digest, and
+# that a spooled digest is only cleared once it has been sent.
+#
+#   python3 -m pytest tests/test_emailDispatcher.py
+
+import os
+import sys
+import json
+import time
+import email
+import shutil
+import socket
+import argparse
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import EmailDispatcher
+
+import smtpSink
+
+def _delete(door, status, start, end):
+    return {'id': f"{door}-{start}", 'summary': door, 'description': status,
+            'start_epoch': start, 'end_epoch': end}
+
+def _add(door, status, start, end):
+    return {'name': door, 'door_status': status,
+            'start_epoch': start, 'end_epoch': end}
+
+# A port that nothing is listening on
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _parts(message):
+    msg = email.message_from_bytes(message['data'])
+    parts = {part.get_content_type(): part.get_payload(decode=True).decode('utf-8')
+             for part in msg.walk() if not part.is_multipart()}
+    return msg, parts
+
+class EmailDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = smtpSink.start()
+        template = os.path.join(self.dir, 'template.html')
+        with open(template, 'w') as fp:
+            fp.write("<html><body>Door changes:\n${changes}\n</body></html>")
+        self.config = {
+            'send emails': True,
+            'smtp server': self.server.host,
+            'smtp port': self.server.port,
+            'smtp starttls': False,
+            'smtp auth': False,
+            'smtp username': None,
+            'sender': 'vercalbot@example.com',
+            'recipient': 'a@example.com b@example.com',
+            'subject': 'Door schedule changes',
+            'body': 'The door schedule changed:',
+            'template path': template,
+            'logo path': None,
+            'digest interval minutes': 0,
+            'state dir': os.path.join(self.dir, 'state'),
+        }
+        self.args = argparse.Namespace(smtp_password=None)
+        EmailDispatcher._logo = None
+
+    def tearDown(self):
+        EmailDispatcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def _spool(self):
+        with open(os.path.join(self.config['state dir'],
+                               EmailDispatcher._spool_filename)) as fp:
+            return json.load(fp)
+
+    def test_messages_share_one_connection(self):
+        EmailDispatcher.start(self.args, self.config)
+        for i in range(3):
+            EmailDispatcher.notify(self.config, [], [_add('Front', 'unlocked', i, i + 1)])
+        EmailDispatcher.close()
+
+        sink = self.server.sink
+        self.assertEqual(len(sink.messages), 3)
+        self.assertEqual(sink.connections, 1)
+        self.assertEqual(sink.messages[0]['to'], ['<a@example.com>', '<b@example.com>'])
+
+    def test_digest_is_grouped_per_door(self):
+        EmailDispatcher.start(self.args, self.config)
+        EmailDispatcher.notify(self.config,
+                               [_delete('Side', 'locked', 7200, 10800)],
+                               [_add('Side', 'unlocked', 7200, 10800),
+                                _add('Front', 'card_and_code', 0, 3600)])
+        EmailDispatcher.close()
+
+        self.assertEqual(len(self.server.sink.messages), 1)
+        msg, parts = _parts(self.server.sink.messages[0])
+        self.assertEqual(msg['Subject'], 'Door schedule changes (3 changes, 2 doors)')
+
+        text = parts['text/plain']
+        self.assertTrue(text.startswith('The door schedule changed:'))
+        # Doors are in order, each followed by its own changes
+        front, side = text.index('Front:'), text.index('Side:')
+        self.assertLess(front, side)
+        self.assertIn('added: card_and_code', text[front:side])
+        self.assertIn('removed: locked', text[side:])
+        self.assertIn('added: unlocked', text[side:])
+
+        html = parts['text/html']
+        self.assertNotIn('${changes}', html)
+        self.assertTrue(html.startswith('<html><body>Door changes:'))
+        self.assertIn('<b>Front</b>', html)
+        self.assertIn('<b>Side</b>', html)
+
+    def test_spool_is_kept_until_sent(self):
+        self.config['digest interval minutes'] = 60
+
+        # Not due yet: the changes are only spooled
+        EmailDispatcher.start(self.args, self.config)
+        EmailDispatcher.notify(self.config, [], [_add('Front', 'locked', 0, 3600)])
+        EmailDispatcher.close()
+        self.assertEqual(self.server.sink.messages, [])
+        self.assertEqual(len(self._spool()['changes']), 1)
+
+        # Make the digest due
+        spool = self._spool()
+        spool['first_change'] = time.time() - 2 * 3600
+        EmailDispatcher._write_spool(os.path.join(self.config['state dir'],
+                                                  EmailDispatcher._spool_filename), spool)
+
+        # Sending fails: the spool (with the new change) is kept
+        config = dict(self.config, **{'smtp port': _closed_port()})
+        EmailDispatcher.start(self.args, config)
+        EmailDispatcher.notify(config, [], [_add('Side', 'locked', 0, 3600)])
+        EmailDispatcher.close()
+        self.assertEqual(len(self._spool()['changes']), 2)
+        self.assertIsNotNone(self._spool()['first_change'])
+
+        # Sending succeeds: the digest has both changes, and the spool
+        # is cleared
+        EmailDispatcher.start(self.args, self.config)
+        EmailDispatcher.notify(self.config, [], [])
+        EmailDispatcher.close()
+        self.assertEqual(len(self.server.sink.messages), 1)
+        msg, _ = _parts(self.server.sink.messages[0])
+        self.assertEqual(msg['Subject'], 'Door schedule changes (2 changes, 2 doors)')
+        self.assertEqual(self._spool(), {'first_change': None, 'changes': []})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# Checks of the UTC epoch conversion (including DST transitions) and of
+# main.compare(), which matches events on (status, start epoch, end
+# epoch).
+#
+#   python3 -m pytest tests/test_epochs.py
+
+import os
+import sys
+import unittest
+
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Verkada
+import main as vercalbot
+
+_new_york = ZoneInfo('America/New_York')
+
+def _utc_epoch(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+class ToEpochTest(unittest.TestCase):
+    def test_ordinary_time(self):
+        # EST is UTC-5
+        self.assertEqual(Verkada._to_epoch(datetime(2026, 1, 15, 9, 0), _new_york),
+                         _utc_epoch(2026, 1, 15, 14, 0))
+
+    def test_utc(self):
+        self.assertEqual(Verkada._to_epoch(datetime(2026, 1, 15, 9, 0), timezone.utc),
+                         _utc_epoch(2026, 1, 15, 9, 0))
+
+    def test_spring_forward_gap_moves_forward(self):
+        # 02:30 does not exist on 2026-03-08; it becomes 03:30 EDT
+        gap = Verkada._to_epoch(datetime(2026, 3, 8, 2, 30), _new_york)
+        after = Verkada._to_epoch(datetime(2026, 3, 8, 3, 30), _new_york)
+        self.assertEqual(gap, _utc_epoch(2026, 3, 8, 7, 30))
+        self.assertEqual(gap, after)
+
+    def test_fall_back_uses_first_occurrence(self):
+        # 01:30 happens twice on 2026-11-01; the first time is EDT
+        # (UTC-4), the second is EST (UTC-5)
+        self.assertEqual(Verkada._to_epoch(datetime(2026, 11, 1, 1, 30), _new_york),
+                         _utc_epoch(2026, 11, 1, 5, 30))
+
+    def test_day_across_spring_forward_is_23_hours(self):
+        start = Verkada._to_epoch(datetime(2026, 3, 8, 0, 0), _new_york)
+        end = Verkada._to_epoch(datetime(2026, 3, 9, 0, 0), _new_york)
+        self.assertEqual(end - start, 23 * 3600)
+
+#-----------------------------------------------------------------
+
+_config = {
+    'first date': date(2026, 1, 10),
+    'last date': date(2026, 1, 20),
+    'coalesce span': 'day',
+}
+
+def _verkada_event(status, start, end):
+    start_epoch = Verkada._to_epoch(start, _new_york)
+    end_epoch = Verkada._to_epoch(end, _new_york)
+    return {
+        'door_status': status,
+        'start_epoch': start_epoch,
+        'end_epoch': end_epoch,
+        'start_time': datetime.fromtimestamp(start_epoch, _new_york),
+        'end_time': datetime.fromtimestamp(end_epoch, _new_york),
+    }
+
+# A downloaded Google Calendar event (see GoogleCalendar.download())
+def _google_event(event_id, door, status, start, end):
+    start_epoch = Verkada._to_epoch(start, _new_york)
+    end_epoch = Verkada._to_epoch(end, _new_york)
+    return {
+        'id': event_id,
+        'summary': door,
+        'description': status,
+        'start': datetime.fromtimestamp(start_epoch, timezone.utc),
+        'end': datetime.fromtimestamp(end_epoch, timezone.utc),
+        'start_epoch': start_epoch,
+        'end_epoch': end_epoch,
+    }
+
+def _ids(events):
+    return sorted(event['id'] for event in events)
+
+class CompareTest(unittest.TestCase):
+    def test_identical_events_match(self):
+        verkada = {'Front': [_verkada_event('unlocked', datetime(2026, 1, 12, 8, 0),
+                                            datetime(2026, 1, 12, 17, 0))]}
+        google = {'Front': [_google_event('g1', 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 8, 0),
+                                          datetime(2026, 1, 12, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual(to_delete, [])
+        self.assertEqual(to_add, [])
+
+    def test_same_instant_in_another_timezone_matches(self):
+        # The Google event is stored in UTC; only the epochs matter
+        verkada = {'Front': [_verkada_event('locked', datetime(2026, 1, 12, 18, 0),
+                                            datetime(2026, 1, 12, 22, 0))]}
+        event = _google_event('g1', 'Front', 'locked',
+                              datetime(2026, 1, 12, 18, 0),
+                              datetime(2026, 1, 12, 22, 0))
+        self.assertEqual(event['start'].hour, 23)
+        to_delete, to_add = vercalbot.compare(_config, {'Front': [event]}, verkada)
+        self.assertEqual((to_delete, to_add), ([], []))
+
+    def test_status_change_replaces_event(self):
+        verkada = {'Front': [_verkada_event('locked', datetime(2026, 1, 12, 8, 0),
+                                            datetime(2026, 1, 12, 17, 0))]}
+        google = {'Front': [_google_event('g1', 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 8, 0),
+                                          datetime(2026, 1, 12, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual(_ids(to_delete), ['g1'])
+        self.assertEqual([e['door_status'] for e in to_add], ['locked'])
+        self.assertEqual(to_add[0]['name'], 'Front')
+        # Deleted events are shown in the door's timezone, too
+        self.assertEqual(to_delete[0]['start'].utcoffset(),
+                         to_add[0]['start_time'].utcoffset())
+        self.assertEqual(to_delete[0]['start'].hour, 8)
+
+    def test_time_change_replaces_event(self):
+        verkada = {'Front': [_verkada_event('unlocked', datetime(2026, 1, 12, 8, 0),
+                                            datetime(2026, 1, 12, 17, 1))]}
+        google = {'Front': [_google_event('g1', 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 8, 0),
+                                          datetime(2026, 1, 12, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual(_ids(to_delete), ['g1'])
+        self.assertEqual(len(to_add), 1)
+
+    def test_duplicate_google_event_is_deleted(self):
+        verkada = {'Front': [_verkada_event('unlocked', datetime(2026, 1, 12, 8, 0),
+                                            datetime(2026, 1, 12, 17, 0))]}
+        google = {'Front': [_google_event(event_id, 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 8, 0),
+                                          datetime(2026, 1, 12, 17, 0))
+                            for event_id in ('g1', 'g2')]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual(len(to_delete), 1)
+        self.assertEqual(to_add, [])
+
+    def test_unknown_door_is_deleted(self):
+        google = {'Gone': [_google_event('g1', 'Gone', 'locked',
+                                         datetime(2026, 1, 12, 8, 0),
+                                         datetime(2026, 1, 12, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, {'Front': []})
+        self.assertEqual(_ids(to_delete), ['g1'])
+        self.assertEqual(to_add, [])
+
+    def test_back_to_back_google_events_match_coalesced_event(self):
+        verkada = {'Front': [_verkada_event('unlocked', datetime(2026, 1, 12, 8, 0),
+                                            datetime(2026, 1, 12, 17, 0))]}
+        google = {'Front': [_google_event('g1', 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 8, 0),
+                                          datetime(2026, 1, 12, 12, 0)),
+                            _google_event('g2', 'Front', 'unlocked',
+                                          datetime(2026, 1, 12, 12, 0),
+                                          datetime(2026, 1, 12, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual((to_delete, to_add), ([], []))
+
+    def test_events_outside_the_door_window_are_left_alone(self):
+        # Before the first date (in the door's timezone)
+        google = {'Front': [_google_event('g1', 'Front', 'locked',
+                                          datetime(2026, 1, 9, 8, 0),
+                                          datetime(2026, 1, 9, 17, 0))]}
+        to_delete, to_add = vercalbot.compare(_config, google, {'Front': [
+            _verkada_event('locked', datetime(2026, 1, 10, 8, 0),
+                           datetime(2026, 1, 10, 17, 0))]})
+        self.assertEqual(to_delete, [])
+        self.assertEqual(len(to_add), 1)
+
+    def test_first_local_day_far_from_utc_matches(self):
+        # 05:00 on the first day in Sydney is the previous day in UTC
+        sydney = ZoneInfo('Australia/Sydney')
+        start = Verkada._to_epoch(datetime(2026, 1, 10, 5, 0), sydney)
+        end = Verkada._to_epoch(datetime(2026, 1, 10, 9, 0), sydney)
+        self.assertEqual(datetime.fromtimestamp(start, timezone.utc).date(),
+                         date(2026, 1, 9))
+        verkada = {'Harbour': [{
+            'door_status': 'unlocked',
+            'start_epoch': start,
+            'end_epoch': end,
+            'start_time': datetime.fromtimestamp(start, sydney),
+            'end_time': datetime.fromtimestamp(end, sydney),
+        }]}
+        google = {'Harbour': [{
+            'id': 'g1',
+            'summary': 'Harbour',
+            'description': 'unlocked',
+            'start': datetime.fromtimestamp(start, timezone.utc),
+            'end': datetime.fromtimestamp(end, timezone.utc),
+            'start_epoch': start,
+            'end_epoch': end,
+        }]}
+        to_delete, to_add = vercalbot.compare(_config, google, verkada)
+        self.assertEqual((to_delete, to_add), ([], []))
+
+if __name__ == '__main__':
+    unittest.main()
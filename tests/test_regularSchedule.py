@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Checks of the regular (weekly) door schedule: compiling entries into
+# a weekly template, laying the template out across the date range,
+# applying it to doors, and overlaying the exceptions on it.
+#
+#   python3 -m pytest tests/test_regularSchedule.py
+
+import os
+import sys
+import unittest
+
+from unittest import mock
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Verkada
+
+_new_york = ZoneInfo('America/New_York')
+_day = 24 * 60
+_week = 7 * _day
+
+_locked = Verkada._weight_index['locked']
+_card_and_code = Verkada._weight_index['card_and_code']
+_unlocked = Verkada._weight_index['unlocked']
+
+def _entry(status, days, start, end, time_zone='America/New_York'):
+    def _minute(text):
+        hour, minute = text.split(':')
+        return int(hour) * 60 + int(minute)
+    return {
+        'door_status': status,
+        'days': days,
+        'start_minute': _minute(start),
+        'end_minute': _minute(end),
+        'time_zone': time_zone,
+    }
+
+class ResolveIntervalsTest(unittest.TestCase):
+    def test_highest_weight_wins(self):
+        self.assertEqual(Verkada._resolve_intervals([(0, 100, _locked),
+                                                     (50, 150, _unlocked)]),
+                         ((0, 50, _locked), (50, 150, _unlocked)))
+        self.assertEqual(Verkada._resolve_intervals([(0, 100, _unlocked),
+                                                     (20, 50, _locked)]),
+                         ((0, 100, _unlocked),))
+
+    def test_touching_same_status_is_joined(self):
+        self.assertEqual(Verkada._resolve_intervals([(0, 10, _locked),
+                                                     (10, 20, _locked)]),
+                         ((0, 20, _locked),))
+
+    def test_gap_and_empty_interval(self):
+        self.assertEqual(Verkada._resolve_intervals([(0, 10, _locked),
+                                                     (20, 30, _locked),
+                                                     (40, 40, _unlocked)]),
+                         ((0, 10, _locked), (20, 30, _locked)))
+
+class CompileWeeklyTemplateTest(unittest.TestCase):
+    def test_day_entry(self):
+        template = Verkada._compile_weekly_template([
+            _entry('unlocked', [0, 2], '08:00', '17:00')])
+        self.assertEqual(template, ((8 * 60, 17 * 60, _unlocked),
+                                    (2 * _day + 8 * 60, 2 * _day + 17 * 60, _unlocked)))
+
+    def test_overnight_entry_is_split_at_midnight(self):
+        # Monday 22:00 to Tuesday 06:00
+        template = Verkada._compile_weekly_template([
+            _entry('locked', [0], '22:00', '06:00')])
+        self.assertEqual(template, ((22 * 60, _day, _locked),
+                                    (_day, _day + 6 * 60, _locked)))
+
+    def test_sunday_overnight_wraps_to_monday(self):
+        template = Verkada._compile_weekly_template([
+            _entry('unlocked', [6], '22:00', '02:00')])
+        self.assertEqual(template, ((0, 2 * 60, _unlocked),
+                                    (6 * _day + 22 * 60, _week, _unlocked)))
+
+    def test_all_week_is_split_into_days(self):
+        # Joined, this would be a single Monday-to-Monday block
+        template = Verkada._compile_weekly_template([
+            _entry('locked', list(range(7)), '00:00', '00:00')])
+        self.assertEqual(template, tuple((d * _day, (d + 1) * _day, _locked)
+                                         for d in range(7)))
+
+    def test_overlapping_entries(self):
+        template = Verkada._compile_weekly_template([
+            _entry('locked', [0], '00:00', '00:00'),
+            _entry('unlocked', [0], '08:00', '17:00')])
+        self.assertEqual(template, ((0, 8 * 60, _locked),
+                                    (8 * 60, 17 * 60, _unlocked),
+                                    (17 * 60, _day, _locked)))
+
+class ExpandWeeklyTemplateTest(unittest.TestCase):
+    def test_first_days_of_window_are_kept(self):
+        # 2026-10-21 is a Wednesday; Monday and Tuesday of that week are
+        # outside the window, but Wednesday to Sunday are not
+        config = {'first date': date(2026, 10, 21), 'last date': date(2026, 10, 30)}
+        template = Verkada._compile_weekly_template([
+            _entry('locked', list(range(7)), '00:00', '00:00')])
+        expansion = Verkada._expand_weekly_template(config, template)
+        self.assertEqual([start.date() for start, _, _ in expansion],
+                         [date(2026, 10, 21) + timedelta(days=i) for i in range(10)])
+        for start, end, _ in expansion:
+            self.assertEqual(end - start, timedelta(days=1))
+
+    def test_overnight_occurrences_are_clipped_to_window(self):
+        # Sunday 22:00 to Monday 02:00; the window is Monday to Sunday
+        config = {'first date': date(2026, 10, 19), 'last date': date(2026, 10, 25)}
+        template = Verkada._compile_weekly_template([
+            _entry('unlocked', [6], '22:00', '02:00')])
+        expansion = Verkada._expand_weekly_template(config, template)
+        self.assertEqual(expansion, [
+            (datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 19, 2, 0), _unlocked),
+            (datetime(2026, 10, 25, 22, 0), datetime(2026, 10, 26, 0, 0), _unlocked),
+        ])
+
+#-----------------------------------------------------------------
+
+def _doors(*names):
+    return {f"id-{name}": {'name': name} for name in names}
+
+def _events(door):
+    return [(event['door_status'], event['start_epoch'], event['end_epoch'])
+            for event in door[Verkada._regular_key]]
+
+def _epoch(*args):
+    return Verkada._to_epoch(datetime(*args), _new_york)
+
+class ApplyRegularScheduleTest(unittest.TestCase):
+    def test_dst_transition_days(self):
+        # Spring forward on 2026-03-08 (23 hours); fall back on
+        # 2026-11-01 (25 hours)
+        for day, hours in [(date(2026, 3, 8), 23), (date(2026, 11, 1), 25),
+                           (date(2026, 3, 9), 24)]:
+            config = {'first date': day, 'last date': day}
+            doors = _doors('Front')
+            Verkada._apply_regular_schedule_to_doors(config, doors, {
+                'Front': [_entry('locked', list(range(7)), '00:00', '00:00')]})
+            events = _events(doors['id-Front'])
+            self.assertEqual(len(events), 1)
+            status, start, end = events[0]
+            self.assertEqual(start, _epoch(day.year, day.month, day.day))
+            self.assertEqual(end - start, hours * 3600)
+
+    def test_entry_inside_spring_forward_gap(self):
+        # 02:30 does not exist on 2026-03-08; it becomes 03:30 EDT
+        config = {'first date': date(2026, 3, 8), 'last date': date(2026, 3, 8)}
+        doors = _doors('Front')
+        Verkada._apply_regular_schedule_to_doors(config, doors, {
+            'Front': [_entry('unlocked', [6], '02:30', '04:00')]})
+        self.assertEqual(_events(doors['id-Front']),
+                         [('unlocked', _epoch(2026, 3, 8, 3, 30), _epoch(2026, 3, 8, 4, 0))])
+
+    def test_identical_doors_share_template(self):
+        config = {'first date': date(2026, 10, 19), 'last date': date(2026, 10, 25)}
+        entries = [_entry('unlocked', [0, 1, 2, 3, 4], '08:00', '17:00')]
+        doors = _doors('A', 'B', 'C')
+        with mock.patch.object(Verkada, '_compile_weekly_template',
+                               wraps=Verkada._compile_weekly_template) as compile_template, \
+             mock.patch.object(Verkada, '_expand_weekly_template',
+                               wraps=Verkada._expand_weekly_template) as expand_template:
+            Verkada._apply_regular_schedule_to_doors(config, doors, {
+                'A': entries,
+                'B': [dict(entry) for entry in entries],
+                'C': [_entry('locked', [5], '00:00', '00:00')]})
+        self.assertEqual(compile_template.call_count, 2)
+        self.assertEqual(expand_template.call_count, 2)
+        self.assertEqual(_events(doors['id-A']), _events(doors['id-B']))
+        self.assertEqual(len(_events(doors['id-A'])), 5)
+        # Each door gets its own event dicts
+        self.assertIsNot(doors['id-A'][Verkada._regular_key][0],
+                         doors['id-B'][Verkada._regular_key][0])
+
+    def test_door_timezones(self):
+        config = {'first date': date(2026, 10, 19), 'last date': date(2026, 10, 19)}
+        entries = [_entry('unlocked', [0], '08:00', '17:00')]
+        doors = _doors('East', 'West')
+        Verkada._apply_regular_schedule_to_doors(config, doors, {
+            'East': entries,
+            'West': [dict(entry, time_zone='America/Los_Angeles') for entry in entries]})
+        (_, east, _), = _events(doors['id-East'])
+        (_, west, _), = _events(doors['id-West'])
+        self.assertEqual(west - east, 3 * 3600)
+
+#-----------------------------------------------------------------
+
+def _event(status, start, end):
+    return {'door_status': status, 'start_epoch': start, 'end_epoch': end}
+
+def _overlay(regular, exceptions):
+    doors = {'id': {'name': 'Front',
+                    Verkada._regular_key: regular,
+                    Verkada._exploded_key: exceptions}}
+    Verkada._overlay_regular_schedule(doors)
+    return [(e['door_status'], e['start_epoch'], e['end_epoch'])
+            for e in doors['id'][Verkada._exploded_key]]
+
+class OverlayRegularScheduleTest(unittest.TestCase):
+    def test_higher_priority_exception_wins(self):
+        self.assertEqual(_overlay([_event('locked', 0, 100)],
+                                  [_event('unlocked', 40, 60)]),
+                         [('locked', 0, 40), ('unlocked', 40, 60), ('locked', 60, 100)])
+
+    def test_higher_priority_regular_schedule_wins(self):
+        self.assertEqual(_overlay([_event('unlocked', 0, 100)],
+                                  [_event('locked', 40, 60)]),
+                         [('unlocked', 0, 100)])
+
+    def test_exception_wins_tie(self):
+        # Same status: the exception takes over where it starts
+        self.assertEqual(_overlay([_event('card_and_code', 0, 100)],
+                                  [_event('card_and_code', 40, 150)]),
+                         [('card_and_code', 0, 40), ('card_and_code', 40, 150)])
+
+    def test_gaps_and_no_regular_schedule(self):
+        self.assertEqual(_overlay([_event('locked', 0, 10), _event('locked', 20, 30)],
+                                  []),
+                         [('locked', 0, 10), ('locked', 20, 30)])
+        self.assertEqual(_overlay([], [_event('locked', 5, 15), _event('unlocked', 10, 12)]),
+                         [('locked', 5, 10), ('unlocked', 10, 12), ('locked', 12, 15)])
+
+    def test_many_overlapping_exceptions_do_not_overlap(self):
+        output = _overlay([_event('locked', 0, 100)],
+                          [_event('card_and_code', 10, 50),
+                           _event('unlocked', 20, 30),
+                           _event('access_controlled', 25, 70)])
+        self.assertEqual(output, [('locked', 0, 10), ('card_and_code', 10, 20),
+                                  ('unlocked', 20, 30), ('card_and_code', 30, 50),
+                                  ('access_controlled', 50, 70), ('locked', 70, 100)])
+        for previous, current in zip(output, output[1:]):
+            self.assertLessEqual(previous[2], current[1])
+
+if __name__ == '__main__':
+    unittest.main()
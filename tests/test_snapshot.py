@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# Checks of the merged schedule snapshot (Snapshot.py): a round trip
+# through write() / load(), and that stale or damaged snapshots are
+# rejected.
+#
+#   python3 -m pytest tests/test_snapshot.py
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Snapshot
+import Verkada
+import doorStatus
+
+_statuses = ['locked', 'access_controlled', 'card_and_code', 'unlocked']
+
+_doors = [
+    ('Front', 'Main campus', 'America/New_York', [
+        {'door_status': 'unlocked', 'start_epoch': 1000, 'end_epoch': 2000},
+        {'door_status': 'locked', 'start_epoch': 2000, 'end_epoch': 3000},
+    ]),
+    ('Café door', None, None, [
+        {'door_status': 'card_and_code', 'start_epoch': -500, 'end_epoch': 500},
+    ]),
+    ('Shed', None, None, []),
+]
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {'state dir': self.dir}
+        self.filename = Snapshot.filename(self.config)
+        self.digest = Snapshot.digest('inputs', 1)
+        Snapshot.write(self.filename, self.digest, 0, 10000, _doors, _statuses)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _rewrite(self, func):
+        with open(self.filename, 'rb') as fp:
+            data = bytearray(fp.read())
+        data = func(data)
+        with open(self.filename, 'wb') as fp:
+            fp.write(data)
+
+    def test_round_trip(self):
+        snapshot = Snapshot.load(self.filename)
+        try:
+            self.assertEqual(snapshot.digest, self.digest)
+            self.assertEqual((snapshot.first_epoch, snapshot.last_epoch), (0, 10000))
+            self.assertEqual(snapshot.names, ['Front', 'Café door', 'Shed'])
+            self.assertEqual(snapshot.sites, ['Main campus', None, None])
+            self.assertEqual(snapshot.time_zones, ['America/New_York', None, None])
+            self.assertEqual(snapshot.status_names, _statuses)
+            self.assertEqual(snapshot.num_intervals(), 3)
+            for i, (_, _, _, events) in enumerate(_doors):
+                self.assertEqual(snapshot.events(i), events)
+        finally:
+            snapshot.close()
+
+    def test_window_covers_local_date_ranges(self):
+        # The window runs from midnight on the first date in the door
+        # furthest east to midnight after the last date in the door
+        # furthest west
+        sydney = ZoneInfo('Australia/Sydney')
+        los_angeles = ZoneInfo('America/Los_Angeles')
+        config = dict(self.config, **{'first date': date(2026, 1, 10),
+                                      'last date': date(2026, 1, 20)})
+        doors = {
+            'id-1': {'name': 'Harbour', 'PYTZ': sydney},
+            'id-2': {'name': 'Beach', 'PYTZ': los_angeles},
+            'id-3': {'name': 'Shed'},
+        }
+        output = {'Harbour': [], 'Beach': [], 'Shed': []}
+        Verkada._write_snapshot(config, self.digest, doors, output)
+
+        snapshot = Snapshot.load(self.filename)
+        try:
+            self.assertEqual(snapshot.first_epoch,
+                             datetime(2026, 1, 10, tzinfo=sydney).timestamp())
+            self.assertEqual(snapshot.last_epoch,
+                             datetime(2026, 1, 21, tzinfo=los_angeles).timestamp())
+            self.assertEqual(snapshot.time_zones,
+                             ['Australia/Sydney', 'America/Los_Angeles', None])
+        finally:
+            snapshot.close()
+
+        # Without a timezone, a door's dates are in UTC
+        Verkada._write_snapshot(config, self.digest, {'id-3': doors['id-3']}, output)
+        snapshot = Snapshot.load(self.filename)
+        try:
+            self.assertEqual((snapshot.first_epoch, snapshot.last_epoch),
+                             (datetime(2026, 1, 10, tzinfo=timezone.utc).timestamp(),
+                              datetime(2026, 1, 21, tzinfo=timezone.utc).timestamp()))
+        finally:
+            snapshot.close()
+
+    def test_digest_depends_on_inputs(self):
+        self.assertEqual(Snapshot.digest('inputs', 1), self.digest)
+        self.assertNotEqual(Snapshot.digest('inputs', 2), self.digest)
+
+    def test_read_snapshot_with_matching_digest(self):
+        output = Verkada._read_snapshot(self.config, self.digest)
+        self.assertEqual(sorted(output), ['Café door', 'Front', 'Shed'])
+        event = output['Front'][0]
+        self.assertEqual(event['door_status'], 'unlocked')
+        self.assertEqual(event['start_time'],
+                         datetime.fromtimestamp(1000, timezone.utc))
+        self.assertEqual(str(event['start_time'].tzinfo), 'America/New_York')
+
+    def test_reject_digest_mismatch(self):
+        self.assertIsNone(Verkada._read_snapshot(self.config, Snapshot.digest('other')))
+
+    def test_reject_crc_corruption(self):
+        def _corrupt(data):
+            data[-1] ^= 0xff
+            return data
+        self._rewrite(_corrupt)
+        with self.assertRaisesRegex(ValueError, 'checksum'):
+            Snapshot.load(self.filename)
+        self.assertIsNone(Verkada._read_snapshot(self.config, self.digest))
+
+    def test_reject_truncation(self):
+        self._rewrite(lambda data: data[:-3])
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            Snapshot.load(self.filename)
+        self._rewrite(lambda data: data[:20])
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            Snapshot.load(self.filename)
+        self.assertIsNone(Verkada._read_snapshot(self.config, self.digest))
+
+    def test_reject_wrong_version(self):
+        # The version follows the 8 byte magic
+        def _bump(data):
+            struct.pack_into('<I', data, 8, Snapshot._version + 1)
+            return data
+        self._rewrite(_bump)
+        with self.assertRaisesRegex(ValueError, 'version'):
+            Snapshot.load(self.filename)
+        self.assertIsNone(Verkada._read_snapshot(self.config, self.digest))
+
+    def test_reject_other_file(self):
+        self._rewrite(lambda data: b'x' * len(data))
+        with self.assertRaisesRegex(ValueError, 'Not a VerCalBot snapshot'):
+            Snapshot.load(self.filename)
+
+#-----------------------------------------------------------------
+
+class IndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {'state dir': self.dir}
+        self.filename = Snapshot.filename(self.config)
+        self._write(10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, last_epoch):
+        Snapshot.write(self.filename, Snapshot.digest(last_epoch),
+                       0, last_epoch, _doors, _statuses)
+        # Make sure that the cache sees a new modification time
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + last_epoch))
+
+    def test_reload_closes_unused_index(self):
+        cache = doorStatus._IndexCache(self.config)
+        old = cache.acquire()
+        cache.release(old)
+        self.assertFalse(old.snapshot._mmap.closed)
+
+        self._write(20000)
+        new = cache.acquire()
+        self.assertIsNot(new, old)
+        self.assertEqual(new.last_epoch, 20000)
+        self.assertTrue(old.snapshot._mmap.closed)
+        cache.release(new)
+        self.assertFalse(new.snapshot._mmap.closed)
+
+    def test_reload_keeps_index_in_use(self):
+        cache = doorStatus._IndexCache(self.config)
+        old = cache.acquire()
+
+        self._write(20000)
+        new = cache.acquire()
+        # The old index is still being used by a request
+        self.assertFalse(old.snapshot._mmap.closed)
+        self.assertEqual(old.status_at('Front', 1500)['door_status'], 'unlocked')
+
+        cache.release(old)
+        self.assertTrue(old.snapshot._mmap.closed)
+        cache.release(new)
+        self.assertFalse(new.snapshot._mmap.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+# Generate synthetic -- but realistic -- Verkada organizations, in the
+# same JSON shapes that the Verkada API returns:
+#
+# - cameras (which carry the site timezones)
+# - doors (spread across sites in mixed timezones)
+# - door exception calendars (non-recurring, DAILY, and WEEKLY
+#   exceptions, with excluded dates and dense overlaps)
+# - a regular door schedule (in the data/verkada-door-schedule.json
+#   format)
+#
+# The output is deterministic for a given seed.  It is used by the
+# benchmark suite (benchmark.py) and the local stand-in Verkada server
+# (fakeVerkadaServer.py).
+
+import json
+import uuid
+import random
+import argparse
+
+from datetime import date, datetime, timedelta, timezone
+
+_timezones = [
+    'America/New_York',
+    'America/Chicago',
+    'America/Denver',
+    'America/Phoenix',
+    'America/Los_Angeles',
+    'Europe/London',
+    'Asia/Kolkata',
+    'Australia/Sydney',
+]
+
+_statuses = [
+    'locked',
+    'access_controlled',
+    'card_and_code',
+    'unlocked',
+]
+
+_by_day = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+_day_names = [
+    'Monday',
+    'Tuesday',
+    'Wednesday',
+    'Thursday',
+    'Friday',
+    'Saturday',
+    'Sunday',
+]
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+def _random_span(rng):
+    # Start somewhere between 05:00 and 20:00, on a 15 minute boundary,
+    # and last 30 minutes to 8 hours (but not past midnight)
+    start = rng.randrange(5 * 60, 20 * 60, 15)
+    length = rng.randrange(30, 8 * 60 + 1, 15)
+    end = min(start + length, 23 * 60 + 45)
+    return start, end
+
+def _exception(rng, first_date, last_date):
+    span = (last_date - first_date).days
+    start, end = _random_span(rng)
+    event_date = first_date + timedelta(days=rng.randrange(span + 1))
+    event = {
+        'date': event_date.isoformat(),
+        'start_time': _time(start),
+        'end_time': _time(end),
+        'door_status': rng.choice(_statuses),
+        'recurrence_rule': None,
+    }
+
+    kind = rng.random()
+    if kind < 0.4:
+        return event
+
+    until = event_date + timedelta(days=rng.randrange(7, 365))
+    excluded = sorted({(event_date + timedelta(days=rng.randrange((until - event_date).days + 1))).isoformat()
+                       for _ in range(rng.randrange(0, 6))})
+    rule = {
+        'frequency': 'DAILY' if kind < 0.7 else 'WEEKLY',
+        'until': until.isoformat(),
+        # Like the real Verkada API: sometimes None, sometimes a list
+        'excluded_dates': excluded if excluded or rng.random() < 0.5 else None,
+    }
+    if rule['frequency'] == 'WEEKLY':
+        rule['by_day'] = sorted(rng.sample(_by_day, rng.randrange(1, 6)),
+                                key=_by_day.index)
+    event['recurrence_rule'] = rule
+
+    return event
+
+def _weekly_schedule(rng, tz):
+    # A handful of schedule "shapes" that many doors share, plus the
+    # occasional one-off
+    weekdays = _day_names[:5]
+    shape = rng.randrange(5)
+    if shape == 0:
+        return [
+            {'status': 'access_controlled', 'days': _day_names,
+             'start_time': '00:00', 'end_time': '23:59', 'time_zone': tz},
+            {'status': 'unlocked', 'days': weekdays,
+             'start_time': '08:00', 'end_time': '17:00', 'time_zone': tz},
+        ]
+    elif shape == 1:
+        return [
+            {'status': 'unlocked', 'days': weekdays,
+             'start_time': '07:30', 'end_time': '18:00', 'time_zone': tz},
+        ]
+    elif shape == 2:
+        return [
+            {'status': 'card_and_code', 'days': _day_names,
+             'start_time': '22:00', 'end_time': '06:00', 'time_zone': tz},
+            {'status': 'unlocked', 'days': ['Saturday'],
+             'start_time': '09:00', 'end_time': '12:00', 'time_zone': tz},
+        ]
+    elif shape == 3:
+        return [
+            {'status': 'locked', 'days': _day_names,
+             'start_time': '00:00', 'end_time': '23:59', 'time_zone': tz},
+        ]
+
+    start, end = _random_span(rng)
+    return [
+        {'status': rng.choice(_statuses),
+         'days': sorted(rng.sample(_day_names, rng.randrange(1, 8)), key=_day_names.index),
+         'start_time': _time(start)[:5], 'end_time': _time(end)[:5],
+         'time_zone': tz},
+    ]
+
+# Generate an organization with num_doors doors and num_calendars
+# exception calendars, with exceptions between first_date and
+# last_date.  Returns a dictionary with the raw Verkada API payloads.
+def generate(num_doors, num_calendars, first_date, last_date,
+             exceptions_per_calendar=8, doors_per_calendar=None, seed=0):
+    rng = random.Random(seed)
+
+    num_sites = max(1, num_doors // 50)
+    sites = []
+    cameras = []
+    for i in range(num_sites):
+        site = {
+            'site_id': _uuid(rng),
+            'timezone': _timezones[i % len(_timezones)],
+        }
+        sites.append(site)
+        cameras.append({
+            'camera_id': _uuid(rng),
+            'name': f"Camera {i}",
+            'site_id': site['site_id'],
+            'timezone': site['timezone'],
+        })
+    # Cameras that are not yet deployed have no site and no timezone
+    for i in range(max(1, num_sites // 10)):
+        cameras.append({
+            'camera_id': _uuid(rng),
+            'name': f"Undeployed camera {i}",
+            'site_id': None,
+            'timezone': None,
+        })
+
+    doors = []
+    for i in range(num_doors):
+        site = sites[i % num_sites]
+        door = {
+            'door_id': _uuid(rng),
+            'name': f"Door {i:05d}",
+            'site': {'site_id': site['site_id'], 'name': f"Site {i % num_sites}"},
+        }
+        # Most doors have a timezone; older ones rely on their site
+        if rng.random() < 0.8:
+            door['timezone'] = site['timezone']
+        doors.append(door)
+
+    if doors_per_calendar is None:
+        doors_per_calendar = max(1, min(num_doors, 3 * num_doors // max(1, num_calendars)))
+
+    calendars = []
+    for i in range(num_calendars):
+        mapped = rng.sample(doors, min(len(doors), rng.randrange(1, doors_per_calendar + 1)))
+        calendars.append({
+            'door_exception_calendar_id': _uuid(rng),
+            'name': f"Exception calendar {i:04d}",
+            'doors': [door['door_id'] for door in mapped],
+            'exceptions': [_exception(rng, first_date, last_date)
+                           for _ in range(exceptions_per_calendar)],
+        })
+
+    schedule = []
+    for door in doors:
+        if rng.random() < 0.7:
+            tz = door.get('timezone', _timezones[0])
+            schedule.append({
+                'name': door['name'],
+                'schedule': _weekly_schedule(rng, tz),
+            })
+
+    return {
+        'cameras': {'cameras': cameras},
+        'doors': {'doors': doors},
+        'door_exception_calendars': {'door_exception_calendars': calendars},
+        'schedule': {'doors': schedule},
+    }
+
+# Make a dictionary of door names -> lists of Google Calendar events
+# (in the same form that GoogleCalendar.download() returns) from merged
+# Verkada events.  A fraction of the events are dropped, moved, or
+# given a different status, and some stale events are added, so that
+# comparing the two yields a realistic diff.
+def google_events_from(verkada_events, drift=0.1, seed=0):
+    rng = random.Random(seed)
+    output = {}
+    count = 0
+
+    def _event(name, status, start, end):
+        nonlocal count
+        count += 1
+        start_dt = datetime.fromtimestamp(start, timezone.utc)
+        end_dt = datetime.fromtimestamp(end, timezone.utc)
+        return {
+            'id': f"event{count:08d}",
+            'summary': name,
+            'description': status,
+            'start': start_dt,
+            'end': end_dt,
+            'start_epoch': start,
+            'end_epoch': end,
+        }
+
+    for name, events in verkada_events.items():
+        google = []
+        for event in events:
+            status = event['door_status']
+            start = event['start_epoch']
+            end = event['end_epoch']
+            if rng.random() < drift:
+                change = rng.randrange(3)
+                if change == 0:
+                    continue
+                elif change == 1:
+                    start += 15 * 60
+                    end += 15 * 60
+                else:
+                    status = rng.choice(_statuses)
+            google.append(_event(name, status, start, end))
+
+        for _ in range(int(len(events) * drift / 2)):
+            start = rng.choice(events)['start_epoch'] + 3600
+            google.append(_event(name, rng.choice(_statuses), start, start + 1800))
+
+        google.sort(key=lambda x: x['start_epoch'])
+        output[name] = google
+
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Verkada organization')
+    parser.add_argument('--doors', type=int, default=100)
+    parser.add_argument('--calendars', type=int, default=20)
+    parser.add_argument('--exceptions-per-calendar', type=int, default=8)
+    parser.add_argument('--days-past', type=int, default=42)
+    parser.add_argument('--days-future', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True,
+                        help='Write the generated data to this JSON file')
+    args = parser.parse_args()
+
+    today = date.today()
+    data = generate(args.doors, args.calendars,
+                    today - timedelta(days=args.days_past),
+                    today + timedelta(days=args.days_future),
+                    exceptions_per_calendar=args.exceptions_per_calendar,
+                    seed=args.seed)
+    with open(args.output, 'w') as fp:
+        json.dump(data, fp, indent=2)
+
+if __name__ == "__main__":
+    main()